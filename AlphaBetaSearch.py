@@ -0,0 +1,257 @@
+"""
+Iterative deepening alpha-beta (negamax) search over bitboards, used by Engines.ALPHA_BETA.
+
+- Transposition table: a bounded Memo keyed by the packed position (same layout as BoardState) and the plies left,
+  since the move limit changes the score, storing (depth, score, bound, best move). The win scores are stored
+  relative to the node and not to the root, so they stay valid when the position is reached at another ply.
+- Move ordering: the best move of the transposition table first, then the longest captures
+  (captures are mandatory, so a move list is either all captures or all simple moves),
+  then the killer moves of the ply and the history heuristic.
+- Every search has a wall clock budget, the move of the deepest finished iteration is returned.
+The game ends like CheckersTraining.play_game: without moves or at the move limit, won by the best score of get_scores.
+"""
+import math
+import time
+from BitBoard import generate_moves_from_bitboards, play_path_on_bitboards, position_key
+from CustomMemo import Memo
+from Enumerators import Evaluators
+from SimpleConfig import ALPHA_BETA_MAX_DEPTH, ALPHA_BETA_TABLE_SIZE, ALPHA_BETA_TIME_BUDGET
+from StateKeys import canonical_state_key, encode_state
+
+WIN_SCORE = 100000  # above any evaluation
+WIN_THRESHOLD = WIN_SCORE - 1000  # scores beyond it are wins or losses, WIN_SCORE less the plies to the end
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def popcount(bb):
+    return bin(bb).count('1')
+
+
+def score_difference(player1, player2, kings, player):
+    # GameBoard.get_scores on bitboards, as (score of player) - (score of the opponent)
+    player1_score = (12 - popcount(player2)) + popcount(player1 & kings) * 3
+    player2_score = (12 - popcount(player1)) + popcount(player2 & kings) * 3
+    return (player1_score - player2_score) * player
+
+
+def score_to_table(score, ply):
+    # the win scores count the plies from the node instead of the root
+    if score >= WIN_THRESHOLD:
+        return score + ply
+    if score <= -WIN_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= WIN_THRESHOLD:
+        return score - ply
+    if score <= -WIN_THRESHOLD:
+        return score + ply
+    return score
+
+
+def evaluate_scores(player1, player2, kings, player):
+    # same scale as the rewards of calculate_reward
+    return score_difference(player1, player2, kings, player) * 10
+
+
+def flat_board_with_player(player1, player2, kings, player):
+    # 33 values, like CheckersTraining.filter_and_flatten_board
+    tiles = [0] * 32
+    for s in range(32):
+        bit = 1 << s
+        if player1 & bit:
+            tiles[s] = 2 if kings & bit else 1
+        elif player2 & bit:
+            tiles[s] = -2 if kings & bit else -1
+    return [player] + tiles
+
+
+class MonteCarloEvaluator:
+    """
+    The monte carlo table scores a position from the player that moved into it,
+    unknown positions are evaluated with the scores.
+    """
+
+    def __init__(self, training):
+        self.training = training
+
+    def __call__(self, player1, player2, kings, player):
+        found_key = self.training.find_monte_carlo_key(canonical_state_key(
+            encode_state([flat_board_with_player(player1, player2, kings, -player)])))
+        if found_key is None:
+            return evaluate_scores(player1, player2, kings, player)
+        return -self.training.monte_carlo_scoring[found_key]
+
+
+class NetworkEvaluator:
+    """
+    The network scores a position from the player that moved into it, like have_nn_select_moves.
+    """
+
+    def __init__(self, network):
+        self.network = network
+
+    def __call__(self, player1, player2, kings, player):
+        return -float(self.network.predict_batch([flat_board_with_player(player1, player2, kings, -player)])[0])
+
+
+def build_evaluator(evaluator, training):
+    if evaluator == Evaluators.MC:
+        return MonteCarloEvaluator(training)
+    if evaluator == Evaluators.NN:
+        return NetworkEvaluator(training.numpy_nn)
+    return evaluate_scores
+
+
+class AlphaBetaSearch:
+    def __init__(self, evaluate=evaluate_scores, time_budget=ALPHA_BETA_TIME_BUDGET, max_depth=ALPHA_BETA_MAX_DEPTH,
+                 table_size=ALPHA_BETA_TABLE_SIZE, tablebase=None):
+        """
+        Parameters:
+        evaluate (callable): (player1, player2, kings, player) -> score of the position for player, the side to move.
+        time_budget (float): Seconds per search.
+        max_depth (int): Deepest iteration.
+        table_size (int): Positions kept by the transposition table.
+        tablebase (EndgameTablebase): Exact results of the endgames, probed before evaluating.
+        """
+        self.evaluate = evaluate
+        self.tablebase = tablebase
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.transpositions = Memo(table_size)  # kept between searches
+        self.killers = []  # two killer moves per ply
+        self.history = dict()  # (from square, to square) -> bonus of the moves that caused cutoffs
+        self.deadline = math.inf
+        self.nodes = 0
+        self.completed_depth = 0
+
+    def search(self, player1, player2, kings, player, moves_left, root_moves=None):
+        """
+        Returns the best move of player, one of root_moves (generated when not given).
+
+        Parameters:
+        moves_left (int): Plies left before the move limit ends the game.
+        """
+        if root_moves is None:
+            root_moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        best_move = root_moves[0]
+        self.completed_depth = 0
+        if len(root_moves) == 1:
+            return best_move
+        self.deadline = time.perf_counter() + self.time_budget
+        self.nodes = 0
+        self.killers = []
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score, move = self.search_root(player1, player2, kings, player, depth, moves_left, root_moves, best_move)
+            except SearchTimeout:
+                break
+            best_move = move
+            self.completed_depth = depth
+            if abs(score) >= WIN_SCORE - self.max_depth or depth >= moves_left:
+                break  # the result is known, deeper iterations would not change it
+        return best_move
+
+    def search_root(self, player1, player2, kings, player, depth, moves_left, root_moves, previous_best):
+        # the best move of the previous iteration is searched first
+        ordered = [previous_best] + [move for move in root_moves if move is not previous_best]
+        alpha, best_move = -math.inf, previous_best
+        for move in ordered:
+            child = play_path_on_bitboards(player1, player2, kings, move, player)
+            score = -self.negamax(*child, -player, depth - 1, -math.inf, -alpha, 1, moves_left - 1)
+            if score > alpha:
+                alpha, best_move = score, move
+        return alpha, best_move
+
+    def final_score(self, player1, player2, kings, player, ply):
+        difference = score_difference(player1, player2, kings, player)
+        if difference == 0:
+            return 0
+        # faster wins and slower losses are preferred
+        return WIN_SCORE - ply if difference > 0 else ply - WIN_SCORE
+
+    def negamax(self, player1, player2, kings, player, depth, alpha, beta, ply, moves_left):
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if not moves or moves_left <= 0:
+            return self.final_score(player1, player2, kings, player, ply)
+        if self.tablebase is not None:
+            probed = self.tablebase.probe(player1, player2, kings, player)
+            if probed is not None and probed[1] <= moves_left:
+                # wins needing fewer plies left rank first, it is not a distance to the end of the game
+                value, plies_needed = probed
+                return (WIN_SCORE - ply - plies_needed) * value
+        if depth <= 0:
+            return self.evaluate(player1, player2, kings, player)
+
+        key = position_key(player1, player2, kings, player) | moves_left << 97
+        original_alpha = alpha
+        table_move = None
+        if key in self.transpositions:
+            table_depth, table_score, bound, table_move = self.transpositions[key]
+            table_score = score_from_table(table_score, ply)
+            if table_depth >= depth:
+                if bound == EXACT:
+                    return table_score
+                if bound == LOWER_BOUND:
+                    alpha = max(alpha, table_score)
+                else:
+                    beta = min(beta, table_score)
+                if alpha >= beta:
+                    return table_score
+
+        best_score, best_move = -math.inf, None
+        for move in self.order_moves(moves, table_move, ply):
+            child = play_path_on_bitboards(player1, player2, kings, move, player)
+            score = -self.negamax(*child, -player, depth - 1, -beta, -alpha, ply + 1, moves_left - 1)
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                self.record_cutoff(move, ply, depth)
+                break
+
+        if best_score <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.transpositions[key] = (depth, score_to_table(best_score, ply), bound, tuple(best_move))
+        return best_score
+
+    def order_moves(self, moves, table_move, ply):
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+
+        def priority(move):
+            path = tuple(move)
+            if path == table_move:
+                return (3, 0)
+            if abs(move[0][2] - move[0][0]) == 2:
+                return (2, len(move))  # captures, the longest first
+            if path in killers:
+                return (1, 0)
+            return (0, self.history.get((move[0][:2], move[-1][2:]), 0))
+
+        return sorted(moves, key=priority, reverse=True)
+
+    def record_cutoff(self, move, ply, depth):
+        if abs(move[0][2] - move[0][0]) == 2:
+            return  # captures are already searched first
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        path = tuple(move)
+        killers = self.killers[ply]
+        if path not in killers:
+            killers.insert(0, path)
+            del killers[2:]
+        history_key = (move[0][:2], move[-1][2:])
+        self.history[history_key] = self.history.get(history_key, 0) + depth * depth
@@ -0,0 +1,311 @@
+"""
+Bitboard representation of the checkers board.
+
+Only the 32 playable tiles are tracked, numbered row by row, so square s is at row s // 4
+and column 2 * (s % 4) + (1 if the row is even else 0).
+A position is three 32 bit masks: player 1 chips, player -1 chips and crowned chips (of any player).
+Moves are generated by shifting whole masks one diagonal step, which replaces the 64 tile scan
+done on the numpy board.
+"""
+import numpy as np
+
+FULL_MASK = 0xFFFFFFFF
+
+# (row, col) of every playable square, indexed by square number
+SQUARE_TO_ROW_COL = tuple((s // 4, 2 * (s % 4) + (1 if (s // 4) % 2 == 0 else 0)) for s in range(32))
+# flat index (row * 8 + col) on the 8x8 board of every playable square
+PLAYABLE_INDICES = np.array([row * 8 + col for row, col in SQUARE_TO_ROW_COL])
+
+EVEN_ROWS = sum(1 << s for s in range(32) if (s // 4) % 2 == 0)
+ODD_ROWS = FULL_MASK ^ EVEN_ROWS
+LEFT_EDGE = sum(1 << s for s in range(32) if SQUARE_TO_ROW_COL[s][1] == 0)
+RIGHT_EDGE = sum(1 << s for s in range(32) if SQUARE_TO_ROW_COL[s][1] == 7)
+# complements kept positive, so the shifts below also work on numpy uint64 arrays of masks
+NOT_LEFT_EDGE = FULL_MASK ^ LEFT_EDGE
+NOT_RIGHT_EDGE = FULL_MASK ^ RIGHT_EDGE
+
+
+def shift_up_left(bb):
+    # (-1, -1)
+    return ((bb & EVEN_ROWS) >> 4) | ((bb & ODD_ROWS & NOT_LEFT_EDGE) >> 5)
+
+
+def shift_up_right(bb):
+    # (-1, 1)
+    return ((bb & EVEN_ROWS & NOT_RIGHT_EDGE) >> 3) | ((bb & ODD_ROWS) >> 4)
+
+
+def shift_down_left(bb):
+    # (1, -1)
+    return (((bb & EVEN_ROWS) << 4) | ((bb & ODD_ROWS & NOT_LEFT_EDGE) << 3)) & FULL_MASK
+
+
+def shift_down_right(bb):
+    # (1, 1)
+    return (((bb & EVEN_ROWS & NOT_RIGHT_EDGE) << 5) | ((bb & ODD_ROWS) << 4)) & FULL_MASK
+
+
+# Same order used by MoveTables.py, so the moves come out in the same order.
+UP_SHIFTS = (shift_up_left, shift_up_right)
+DOWN_SHIFTS = (shift_down_left, shift_down_right)
+OPPOSITE_SHIFT = {
+    shift_up_left: shift_down_right,
+    shift_up_right: shift_down_left,
+    shift_down_left: shift_up_right,
+    shift_down_right: shift_up_left,
+}
+ALL_SHIFTS = UP_SHIFTS + DOWN_SHIFTS
+
+
+def destination_table(steps):
+    # [square, direction] -> square reached by steps shifts in that direction, -1 when it leaves the board
+    table = np.full((32, len(ALL_SHIFTS)), -1, dtype=np.int64)
+    for s in range(32):
+        for d, shift in enumerate(ALL_SHIFTS):
+            bit = 1 << s
+            for _ in range(steps):
+                bit = shift(bit)
+            if bit:
+                table[s, d] = bit.bit_length() - 1
+    return table
+
+
+STEP_DESTINATIONS = destination_table(1)
+SQUARE_ROWS = np.array([row for row, _ in SQUARE_TO_ROW_COL])
+SQUARE_COLS = np.array([col for _, col in SQUARE_TO_ROW_COL])
+SQUARE_BITS = np.arange(32, dtype=np.uint64)
+
+
+def board_to_bitboards(board):
+    """
+    Convert an 8x8 (or flat 64) numpy board into the three masks.
+
+    Returns:
+    tuple: (player 1 chips, player -1 chips, crowned chips)
+    """
+    tiles = np.asarray(board).ravel()[PLAYABLE_INDICES]
+    return (
+        int.from_bytes(np.packbits(tiles > 0, bitorder='little').tobytes(), 'little'),
+        int.from_bytes(np.packbits(tiles < 0, bitorder='little').tobytes(), 'little'),
+        int.from_bytes(np.packbits((tiles == 2) | (tiles == -2), bitorder='little').tobytes(), 'little'),
+    )
+
+
+def bitboards_to_board(player1, player2, kings):
+    """
+    Convert the three masks back into the 8x8 numpy board used by GameBoard, unplayable tiles marked with 3.
+    """
+    board = np.full(64, 3, dtype=int)
+    tiles = np.zeros(32, dtype=int)
+    for mask, value in ((player1, 1), (player2, -1)):
+        bits = np.unpackbits(np.frombuffer(mask.to_bytes(4, 'little'), dtype=np.uint8), bitorder='little')
+        tiles[bits == 1] = value
+    king_bits = np.unpackbits(np.frombuffer(kings.to_bytes(4, 'little'), dtype=np.uint8), bitorder='little')
+    tiles[king_bits == 1] *= 2
+    board[PLAYABLE_INDICES] = tiles
+    return board.reshape((8, 8))
+
+
+def square_bit(row, col):
+    return 1 << (row * 4 + col // 2)
+
+
+def position_key(player1, player2, kings, player):
+    # the position packed like BoardState, bit 96 set when player -1 is to move
+    return player1 | (player2 << 32) | (kings << 64) | ((player == -1) << 96)
+
+
+CROWN_ROWS = {1: sum(1 << s for s in range(4)), -1: sum(1 << s for s in range(28, 32))}
+
+
+def play_path_on_bitboards(player1, player2, kings, path, player):
+    """
+    Bitboard version of GameBoard.update_score_and_board: moves the chip along path, removes the jumped
+    chips and crowns it when it ends on the last row.
+
+    Returns:
+    tuple: (player 1 chips, player -1 chips, crowned chips) after the move.
+    """
+    from_bit = square_bit(path[0][0], path[0][1])
+    to_bit = square_bit(path[-1][2], path[-1][3])
+    captured = 0
+    for from_row, from_col, to_row, to_col in path:
+        if abs(to_row - from_row) == 2:
+            captured |= square_bit((from_row + to_row) // 2, (from_col + to_col) // 2)
+    own, opponent = (player1, player2) if player == 1 else (player2, player1)
+    is_king = kings & from_bit
+    own = (own ^ from_bit) | to_bit
+    opponent &= FULL_MASK ^ captured
+    kings &= FULL_MASK ^ (from_bit | captured)
+    if is_king or to_bit & CROWN_ROWS[player]:
+        kings |= to_bit
+    return (own, opponent, kings) if player == 1 else (opponent, own, kings)
+
+
+def iterate_bits(bb):
+    # yields the single bit masks from the lowest square to the highest, which is the row by row order
+    while bb:
+        bit = bb & -bb
+        yield bit
+        bb ^= bit
+
+
+def shifts_for_chip(player, is_king):
+    if is_king:
+        return UP_SHIFTS + DOWN_SHIFTS
+    return UP_SHIFTS if player == 1 else DOWN_SHIFTS
+
+
+def to_move(from_bit, to_bit):
+    from_row, from_col = SQUARE_TO_ROW_COL[from_bit.bit_length() - 1]
+    to_row, to_col = SQUARE_TO_ROW_COL[to_bit.bit_length() - 1]
+    return (from_row, from_col, to_row, to_col)
+
+
+def find_jumpers(own, opponent, kings, empty, player):
+    """
+    Mask of the chips of the player that have at least one capture available.
+    """
+    jumpers = 0
+    for shifts, movers in ((UP_SHIFTS, own if player == 1 else own & kings),
+                           (DOWN_SHIFTS, own if player == -1 else own & kings)):
+        for shift in shifts:
+            landings = shift(shift(movers) & opponent) & empty
+            if landings:
+                back = OPPOSITE_SHIFT[shift]
+                jumpers |= back(back(landings) & opponent) & movers
+    return jumpers
+
+
+def collect_jumps(bit, is_king, opponent, empty, player, path, capturing_moves):
+    """
+    Depth first search of every capture sequence of the chip in bit, appending each complete path.
+    Captured chips are removed as the chip jumps, and the chip is not crowned until the sequence ends.
+    """
+    found = False
+    for shift in shifts_for_chip(player, is_king):
+        middle = shift(bit) & opponent
+        if not middle:
+            continue
+        landing = shift(middle) & empty
+        if not landing:
+            continue
+        path.append(to_move(bit, landing))
+        collect_jumps(landing, is_king, opponent ^ middle, (empty | bit | middle) ^ landing, player, path, capturing_moves)
+        path.pop()
+        found = True
+    if not found and path:
+        capturing_moves.append(path.copy())
+
+
+def generate_moves_from_bitboards(player1, player2, kings, player):
+    """
+    Generate the valid moves of player, captures are mandatory.
+
+    Returns:
+    list: Paths shaped like [[(row, col, new_row, new_col), ...], ...], same as CheckersRulesGame.
+    """
+    own, opponent = (player1, player2) if player == 1 else (player2, player1)
+    empty = ~(player1 | player2) & FULL_MASK
+    jumpers = find_jumpers(own, opponent, kings, empty, player)
+    if jumpers:
+        capturing_moves = []
+        for bit in iterate_bits(jumpers):
+            collect_jumps(bit, bit & kings, opponent, empty, player, [], capturing_moves)
+        return capturing_moves
+
+    non_capturing_moves = []
+    for bit in iterate_bits(own):
+        for shift in shifts_for_chip(player, bit & kings):
+            target = shift(bit) & empty
+            if target:
+                non_capturing_moves.append([to_move(bit, target)])
+    return non_capturing_moves
+
+
+def generate_bitboard_moves(board, player):
+    """
+    Drop in replacement of CheckersRulesGame.generate_valid_moves for a numpy board.
+    """
+    player1, player2, kings = board_to_bitboards(board)
+    return generate_moves_from_bitboards(player1, player2, kings, player)
+
+
+def boards_to_bitboards_batch(boards):
+    """
+    Convert a batch of boards into the three masks of every board.
+
+    Parameters:
+    boards (np.ndarray): (N, 8, 8) or (N, 64) numpy boards, or (N, 32) with only the playable tiles.
+
+    Returns:
+    tuple: (player 1 chips, player -1 chips, crowned chips), each one an (N,) uint64 array.
+    """
+    boards = np.asarray(boards)
+    tiles = boards.reshape(len(boards), -1)
+    if tiles.shape[1] == 64:
+        tiles = tiles[:, PLAYABLE_INDICES]
+
+    def pack(mask):
+        return np.ascontiguousarray(np.packbits(mask, axis=1, bitorder='little')).view('<u4')[:, 0].astype(np.uint64)
+
+    return pack(tiles > 0), pack(tiles < 0), pack((tiles == 2) | (tiles == -2))
+
+
+def mask_bits(masks):
+    # (N,) masks -> (N, 32) booleans, one per square
+    return ((masks[:, None] >> SQUARE_BITS) & np.uint64(1)).astype(bool)
+
+
+def generate_moves_batch(boards, players):
+    """
+    Generate the valid moves of N boards at once.
+    The simple moves and the boards with a capture available are found for the whole batch with
+    mask shifts, only the capture paths (multiple jumps) are expanded board by board.
+
+    Parameters:
+    boards (np.ndarray): (N, 8, 8), (N, 64) or (N, 32) boards, see boards_to_bitboards_batch.
+    players (np.ndarray): (N,) player to move on each board, 1 or -1.
+
+    Returns:
+    tuple: (offsets, moves), moves[offsets[i]:offsets[i + 1]] are the paths of board i,
+        the same list generate_bitboard_moves returns for it.
+    """
+    player1, player2, kings = boards_to_bitboards_batch(boards)
+    is_player1 = np.asarray(players) == 1
+    own = np.where(is_player1, player1, player2)
+    opponent = np.where(is_player1, player2, player1)
+    empty = ~(player1 | player2) & np.uint64(FULL_MASK)
+    up_movers = np.where(is_player1, own, own & kings)
+    down_movers = np.where(is_player1, own & kings, own)
+
+    step_sources = []
+    jumpers = np.zeros(len(own), dtype=np.uint64)
+    for shift, movers in zip(ALL_SHIFTS, (up_movers, up_movers, down_movers, down_movers)):
+        back = OPPOSITE_SHIFT[shift]
+        step_sources.append(back(shift(movers) & empty))
+        landings = shift(shift(movers) & opponent) & empty
+        jumpers |= back(back(landings) & opponent) & movers
+    has_capture = jumpers != 0
+
+    # (board, square, direction) of every simple move, in the order of the single board generator
+    can_step = np.stack([mask_bits(sources) for sources in step_sources], axis=2)
+    can_step[has_capture] = False
+    board_index, square, direction = np.nonzero(can_step)
+    target = STEP_DESTINATIONS[square, direction]
+    simple_moves = [[move] for move in zip(SQUARE_ROWS[square].tolist(), SQUARE_COLS[square].tolist(),
+                                           SQUARE_ROWS[target].tolist(), SQUARE_COLS[target].tolist())]
+    counts = np.bincount(board_index, minlength=len(own))
+    simple_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    moves = []
+    position = 0
+    for i in np.flatnonzero(has_capture).tolist():
+        capturing_moves = generate_moves_from_bitboards(int(player1[i]), int(player2[i]), int(kings[i]), 1 if is_player1[i] else -1)
+        moves.extend(simple_moves[position:simple_offsets[i]])
+        position = simple_offsets[i]
+        moves.extend(capturing_moves)
+        counts[i] = len(capturing_moves)
+    moves.extend(simple_moves[position:])
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    return offsets, moves
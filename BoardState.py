@@ -0,0 +1,50 @@
+"""
+Compact, hashable snapshot of a board, used as key for the memos and the loop detection.
+It replaces keys built with f"{board}", numpy formatting is slow and gives ~200 bytes strings.
+"""
+from BitBoard import bitboards_to_board, board_to_bitboards
+
+PLAYER_2_BIT = 1 << 96
+
+
+class BoardState:
+    """
+    The board packed in a single integer: bits 0-31 player 1 chips, bits 32-63 player -1 chips,
+    bits 64-95 crowned chips and bit 96 set when player -1 is the side to move.
+    """
+    __slots__ = ('packed',)
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    @classmethod
+    def from_bitboards(cls, player1, player2, kings, player=1):
+        return cls(player1 | (player2 << 32) | (kings << 64) | (PLAYER_2_BIT if player == -1 else 0))
+
+    @classmethod
+    def from_board(cls, board, player=1):
+        """
+        Parameters:
+        board (np.ndarray): 8x8 (or flat 64) board.
+        player (int): Side to move, 1 or -1.
+        """
+        return cls.from_bitboards(*board_to_bitboards(board), player)
+
+    @property
+    def player(self):
+        return -1 if self.packed & PLAYER_2_BIT else 1
+
+    def to_bitboards(self):
+        return self.packed & 0xFFFFFFFF, (self.packed >> 32) & 0xFFFFFFFF, (self.packed >> 64) & 0xFFFFFFFF
+
+    def to_board(self):
+        return bitboards_to_board(*self.to_bitboards())
+
+    def __hash__(self):
+        return hash(self.packed)
+
+    def __eq__(self, other):
+        return isinstance(other, BoardState) and self.packed == other.packed
+
+    def __repr__(self):
+        return f"BoardState({self.packed:#x})"
@@ -3,10 +3,12 @@ import tensorflow as tf
 
 # Suppress TensorFlow logs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # or any {0, 1, 2, 3} based on the verbosity level
+tf.compat.v1.enable_eager_execution()
 
 class CheckersNN:
     def __init__(self):
         self.model = self.build_model()
+        self.infer = self.build_inference(self.model)
     
     def build_model(self):
         model = tf.keras.Sequential([
@@ -22,12 +24,28 @@ class CheckersNN:
         model.compile(optimizer='adam', loss='mean_squared_error', metrics=['mae'])
         return model
     
+    def build_inference(self, model):
+        """
+        Compiled forward pass with a fixed input signature, so it is traced once for any batch size.
+        """
+        @tf.function(input_signature=[tf.TensorSpec(shape=(None, 33), dtype=tf.float32)])
+        def infer(x):
+            return model(x, training=False)
+        return infer
+
     def train(self, x, y):
         # x = x.reshape(-1, 65)
         self.model.fit(x, y, epochs=10, verbose=0)
 
     def predict(self, x):
         return self.model.predict(x)
+
+    def predict_batch(self, x):
+        """
+        Scores a (N, 33) batch of boards in one forward pass, skipping the dataset machinery of model.predict.
+        Returns a (N,) array.
+        """
+        return self.infer(tf.convert_to_tensor(x, dtype=tf.float32)).numpy()[:, 0]
     
     def save_model(self, path):
         self.model.save(path)
@@ -40,4 +58,5 @@ class CheckersNN:
         else:
             self.model = self.build_model()  # Create a new model
             print(f"No model found at {path}. Created a new model.")
+        self.infer = self.build_inference(self.model)
 
@@ -0,0 +1,59 @@
+"""
+Inference only engine for the CheckersNN model, evaluated with numpy.
+The weights are read once from the keras .h5 file with h5py, so tensorflow is never imported.
+"""
+import json
+import os
+import h5py
+import numpy as np
+
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'linear': lambda x: x,
+}
+
+
+class CheckersNNNumpy:
+    def __init__(self, path=None):
+        self.layers = []  # (kernel, bias, activation) of every dense layer, in order
+        if path:
+            self.load(path)
+
+    def load(self, path):
+        """
+        Load the dense layers of a model saved by CheckersNN.save_model.
+        """
+        if not os.path.exists(path):
+            print(f"No model found at {path}. Numpy engine has no weights.")
+            return
+        with h5py.File(path, 'r') as f:
+            config = json.loads(f.attrs['model_config'])
+            activations = [layer['config']['activation'] for layer in config['config']['layers']
+                           if layer['class_name'] == 'Dense']
+            weights = f['model_weights']
+            layers = []
+            for layer_name in weights.attrs['layer_names']:
+                group = weights[layer_name]
+                weight_names = list(group.attrs['weight_names'])
+                if not weight_names:
+                    continue
+                kernel = np.ascontiguousarray(group[weight_names[0]][()], dtype=np.float32)
+                bias = np.ascontiguousarray(group[weight_names[1]][()], dtype=np.float32)
+                layers.append((kernel, bias))
+        self.layers = [(kernel, bias, ACTIVATIONS[activation]) for (kernel, bias), activation in zip(layers, activations)]
+        print(f"Model loaded from {path} (numpy engine)")
+
+    def predict_batch(self, x):
+        """
+        Scores a (N, 33) batch of boards, returns a (N,) array.
+        """
+        if not self.layers:
+            raise FileNotFoundError("The numpy engine has no weights, save a model with CheckersNN first.")
+        x = np.asarray(x, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            x = activation(x @ kernel + bias)
+        return x[:, 0]
+
+    def predict(self, x):
+        # same shape as keras predict, (N, 1)
+        return self.predict_batch(x).reshape(-1, 1)
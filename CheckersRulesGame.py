@@ -1,7 +1,10 @@
 
 import numpy as np
+from BitBoard import generate_bitboard_moves, generate_moves_batch
+from BoardState import BoardState
 from GameBoard import GameBoard
-from SimpleConfig import debug_print
+from MoveTables import JUMP_TARGETS, OPPONENT_PIECES, STEP_TARGETS
+from SimpleConfig import USE_BITBOARD_MOVE_GENERATOR, debug_print
 
 class CheckersRulesGame(GameBoard):
     def __init__(self):
@@ -21,7 +24,7 @@ class CheckersRulesGame(GameBoard):
         Returns:
         bool: True if the transition is valid, False otherwise.
         """
-        key = f"{current_board} - {new_board} - {from_pos}-{to_pos}"
+        key = (BoardState.from_board(current_board), BoardState.from_board(new_board), tuple(from_pos), tuple(to_pos))
         if key in self.transition_memo:
             return self.transition_memo[key]
 
@@ -126,14 +129,7 @@ class CheckersRulesGame(GameBoard):
         """
             piece_moving is the piece of the current player that is moving
         """
-        # used to get the potential opponents piece:
-        oponents_piece = {
-            1:{ -1, -2},
-            2:{ -1, -2},
-            -1:{ 1, 2},
-            -2:{ 1, 2},
-        }
-        return board[row, col] in oponents_piece[piece_or_player]
+        return board[row, col] in OPPONENT_PIECES[piece_or_player]
 
     def are_coordenates_valid(self, board, row, col):
         # returns true if the cordenates are in the bounds of the board and it is not a tile 3, or umplayable tile.
@@ -177,9 +173,34 @@ class CheckersRulesGame(GameBoard):
         return False
 
     def generate_valid_moves(self, board, player):
-        key = f"{player} - {self.board}"
+        key = self.board_hash(board, player)
         if key in self.valid_moves_memo:
             return self.valid_moves_memo[key]
+        if USE_BITBOARD_MOVE_GENERATOR:
+            res = generate_bitboard_moves(board, player)
+        else:
+            res = self.scan_valid_moves(board, player)
+        self.valid_moves_memo[key] = res
+        return res
+
+    def generate_valid_moves_batch(self, boards, players):
+        """
+        Generate the valid moves of many boards at once, not memoized.
+
+        Parameters:
+        boards (np.ndarray): (N, 8, 8) boards, or (N, 32) with only the playable tiles.
+        players (np.ndarray): (N,) player to move on each board.
+
+        Returns:
+        tuple: (offsets, moves), moves[offsets[i]:offsets[i + 1]] is generate_valid_moves(boards[i], players[i]).
+        """
+        return generate_moves_batch(boards, players)
+
+    def scan_valid_moves(self, board, player):
+        """
+        Original move generator, scans the 64 tiles of the numpy board.
+        Kept as the reference implementation of the rules for the bitboard generator.
+        """
         capturing_moves = []
         non_capturing_moves = []
         
@@ -191,52 +212,36 @@ class CheckersRulesGame(GameBoard):
                     if not capturing_moves:
                         self.find_all_non_capturing_moves(board, row, col, player, non_capturing_moves)
         
-        res = capturing_moves if capturing_moves else non_capturing_moves
-        self.valid_moves_memo[key] = res
-        return res
+        return capturing_moves if capturing_moves else non_capturing_moves
 
-    def get_directions_for_piece_during_capture(self, board, row, col, player):
-        chip_type = board[row, col]
-        directions = []
-        if player == 1 or chip_type in (2, -2):
-            directions = directions + [(-1, -1), (-1, 1), (-2, -2), (-2, 2)]
-        if player == -1 or chip_type in (2, -2):
-            directions = directions + [(1, -1), (1, 1), (2, -2), (2, 2)]
-        return directions
-
-    def get_directions_for_piece_non_capture(self, board, row, col, player):
-        chip_type = board[row, col]
-        directions = []
-        if player == 1 or chip_type in (2, -2):
-            directions = directions + [(-1, -1), (-1, 1)]
-        if player == -1 or chip_type in (2, -2):
-            directions = directions + [(1, -1), (1, 1)]
-        return directions
-
-    def find_all_capturing_moves(self, board, row, col, player, capturing_moves, path=[]):
-        directions = self.get_directions_for_piece_during_capture(board, row, col, player)
+    def find_all_capturing_moves(self, board, row, col, player, capturing_moves, path=None):
+        """
+        Adds to capturing_moves every capture path of the chip at (row, col).
+        Every hop is made on board itself and undone when the search backtracks, board is left as it was.
+        """
+        if path is None:
+            path = []
+        chip = board[row, col]
+        opponents = OPPONENT_PIECES[player]
         found = False
-        for dr, dc in directions:
-            mid_row, mid_col = row + dr // 2, col + dc // 2
-            new_row, new_col = row + dr, col + dc
-            if self.are_coordenates_valid(board, new_row, new_col) and self.are_coordenates_empty_and_playable(board, new_row, new_col):
-                if self.are_coordenates_an_opponents_piece(board, mid_row, mid_col, player):
-                    new_board = board.copy()
-                    new_board[row, col] = 0
-                    new_board[mid_row, mid_col] = 0
-                    new_board[new_row, new_col] = board[row, col]
-                    path.append((row, col, new_row, new_col))
-                    self.find_all_capturing_moves(new_board, new_row, new_col, player, capturing_moves, path)
-                    found = True
-                    path.pop()
-        
+        for (mid_row, mid_col), (new_row, new_col) in JUMP_TARGETS[chip][row][col]:
+            if board[new_row, new_col] == 0 and board[mid_row, mid_col] in opponents:
+                captured = board[mid_row, mid_col]
+                board[row, col] = 0
+                board[mid_row, mid_col] = 0
+                board[new_row, new_col] = chip
+                path.append((row, col, new_row, new_col))
+                self.find_all_capturing_moves(board, new_row, new_col, player, capturing_moves, path)
+                path.pop()
+                board[new_row, new_col] = 0
+                board[mid_row, mid_col] = captured
+                board[row, col] = chip
+                found = True
+
         if not found and path:
             capturing_moves.append(path.copy())
 
     def find_all_non_capturing_moves(self, board, row, col, player, non_capturing_moves):
-        directions = self.get_directions_for_piece_non_capture(board, row, col, player)
-
-        for dr, dc in directions:
-            new_row, new_col = row + dr, col + dc
-            if self.are_coordenates_valid(board, new_row, new_col) and self.are_coordenates_empty_and_playable(board, new_row, new_col):
+        for new_row, new_col in STEP_TARGETS[board[row, col]][row][col]:
+            if board[new_row, new_col] == 0:
                 non_capturing_moves.append([(row, col, new_row, new_col)])
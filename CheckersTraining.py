@@ -3,11 +3,29 @@ import random
 import time
 import numpy as np
 import os
+from AlphaBetaSearch import AlphaBetaSearch, build_evaluator
+from BitBoard import board_to_bitboards
 from CheckersRulesGame import CheckersRulesGame
-from Enumerators import Engines
-from MathTooling import average, clean_string, transform_key_to_base72
+from Enumerators import Engines, Playouts
+from MathTooling import clean_string
+from MonteCarloTreeSearch import MonteCarloTreeSearch
+from ParallelTreeSearch import LeafParallelTreeSearch, RootParallelTreeSearch
+from EndgameTablebase import TABLEBASE_FILE, EndgameTablebase
+from OpeningBook import BOOK_FILE, OpeningBook
+from MonteCarloStore import MANIFEST_EXTENSION, SPILL_PREFIX, MappedMonteCarloTable, table_files, write_monte_carlo_file
+from StateKeys import canonical_state_key, encode_state, legacy_state_key, mirror_state_key
 from SimpleConfig import (
+    ALPHA_BETA_EVALUATOR,
+    CHECKPOINT_INTERVAL,
+    ENDGAME_TABLEBASE,
     EXECUTE_SAVE_ASYNC,
+    MCTS_LEAF_PARALLEL,
+    MCTS_PLAYOUTS,
+    MCTS_WORKERS,
+    MONTE_CARLO_SHARDS,
+    MONTE_CARLO_VERIFY_SHARDS,
+    OPENING_BOOK,
+    OPENING_BOOK_PLIES,
     PLAYER_1_ENGINE,
     PLAYER_2_ENGINE,
     RANDOM_FIRST_PLAYS,
@@ -18,16 +36,13 @@ from SimpleConfig import (
     RANDOM_FIRST_PLAYS,
     SAVES_INTERVAL
 )
-from CheckersNN import CheckersNN
-import tensorflow as tf
+from CheckersNNNumpy import CheckersNNNumpy
 import json
 from concurrent.futures import ThreadPoolExecutor
 import string
 
 
 
-tf.compat.v1.enable_eager_execution()
-
 class CheckersTraining(CheckersRulesGame):
 
     def __init__(self):
@@ -40,12 +55,16 @@ class CheckersTraining(CheckersRulesGame):
         self.predicted_player2 = 0
         if not os.path.exists(self.save_directory):
             os.makedirs(self.save_directory)
-        self.nn = CheckersNN()  # Initialize neural network
-        # load NN model if exist and if it is going to be used:
-        if Engines.NN in [PLAYER_1_ENGINE, PLAYER_2_ENGINE] and\
-            os.path.exists(os.path.join(self.save_directory,'checkers_model.h5')):
-            self.nn.load(os.path.join(self.save_directory, "checkers_model.h5"))
-        self.monte_carlo_scoring = dict()
+        self._nn = None  # built on first use, see nn
+        self._numpy_nn = None  # built on first use, see numpy_nn
+        self._alpha_beta = None  # built on first use, see alpha_beta
+        self._mcts = None  # built on first use, see mcts
+        self._opening_book = None  # loaded on first use, see opening_book
+        self._tablebase = None  # mapped on first use, see tablebase
+        self.monte_carlo_scoring = MappedMonteCarloTable(spill_directory=self.save_directory, shards=MONTE_CARLO_SHARDS)  # canonical integer state key (StateKeys.py) -> score
+        self.monte_carlo_file = None  # binary file of monte_carlo_scoring referenced by game_status.json
+        self.monte_carlo_logs = []  # delta logs replayed over monte_carlo_file on load, oldest first
+        self.legacy_monte_carlo_scoring = dict()  # base 72 keys of old saves, moved to monte_carlo_scoring as they are found
         self.executor = ThreadPoolExecutor(max_workers=1)  # Create an executor for asynchronous tasks
         self.player_1_win_count = 0
         self.player_2_win_count = 0
@@ -56,6 +75,91 @@ class CheckersTraining(CheckersRulesGame):
         self.loop_run = True
 
 
+    @property
+    def nn(self):
+        """
+        Tensorflow neural network, imported and built the first time it is needed,
+        so processes that do not play or train with it never load tensorflow.
+        """
+        if self._nn is None:
+            from CheckersNN import CheckersNN
+            self._nn = CheckersNN()  # Initialize neural network
+            # load NN model if exist and if it is going to be used:
+            if Engines.NN in [PLAYER_1_ENGINE, PLAYER_2_ENGINE] and\
+                os.path.exists(os.path.join(self.save_directory,'checkers_model.h5')):
+                self._nn.load(os.path.join(self.save_directory, "checkers_model.h5"))
+        return self._nn
+
+    @property
+    def numpy_nn(self):
+        # inference only copy of the saved model, used by Engines.NN_NUMPY
+        if self._numpy_nn is None:
+            self._numpy_nn = CheckersNNNumpy(os.path.join(self.save_directory, "checkers_model.h5"))
+        return self._numpy_nn
+
+    @property
+    def alpha_beta(self):
+        # search of Engines.ALPHA_BETA, its transposition table is kept between moves
+        if self._alpha_beta is None:
+            tablebase = self.tablebase if ENDGAME_TABLEBASE else None
+            self._alpha_beta = AlphaBetaSearch(build_evaluator(ALPHA_BETA_EVALUATOR, self), tablebase=tablebase)
+        return self._alpha_beta
+
+    @property
+    def mcts(self):
+        # tree of Engines.MCTS, the subtree of the position reached is reused by the next move
+        if self._mcts is None:
+            workers = MCTS_WORKERS or os.cpu_count()
+            network_path = os.path.join(self.save_directory, "checkers_model.h5")
+            if workers == 1:
+                network = self.numpy_nn if MCTS_PLAYOUTS == Playouts.NN else None
+                self._mcts = MonteCarloTreeSearch(playouts=MCTS_PLAYOUTS, network=network)
+            elif MCTS_LEAF_PARALLEL:
+                self._mcts = LeafParallelTreeSearch(workers, playouts=MCTS_PLAYOUTS, network_path=network_path)
+            else:
+                self._mcts = RootParallelTreeSearch(workers, playouts=MCTS_PLAYOUTS, network_path=network_path)
+        return self._mcts
+
+    @property
+    def opening_book(self):
+        # positions of the first OPENING_BOOK_PLIES plies -> best known move, empty until OpeningBook.py builds the file
+        if self._opening_book is None:
+            path = os.path.join(self.save_directory, BOOK_FILE)
+            self._opening_book = OpeningBook(path) if os.path.exists(path) else dict()
+        return self._opening_book
+
+    def book_move(self, board, valid_moves, player, total_moves):
+        """
+        Returns the opening book move of the position, None when the book is off, the opening is over or the position is not in it.
+        """
+        if not OPENING_BOOK or total_moves > OPENING_BOOK_PLIES or not self.opening_book:
+            return None
+        return self.opening_book.find_move(*board_to_bitboards(board), player, valid_moves)
+
+    @property
+    def tablebase(self):
+        # exact results of the positions with few chips, empty until EndgameTablebase.py builds the file
+        if self._tablebase is None:
+            path = os.path.join(self.save_directory, TABLEBASE_FILE)
+            self._tablebase = EndgameTablebase(path if os.path.exists(path) else None)
+        return self._tablebase
+
+    def tablebase_move(self, board, valid_moves, player, total_moves):
+        """
+        Returns the perfect move of the position, None when the tablebase is off or the position is not in it.
+        """
+        if not ENDGAME_TABLEBASE:
+            return None
+        return self.tablebase.best_move(*board_to_bitboards(board), player, self.move_limit - total_moves, valid_moves)
+
+    def tablebase_decides(self, board, player):
+        # True when the scores of the board are the result of perfect play, so the game can end
+        return ENDGAME_TABLEBASE and self.tablebase.decided(*board_to_bitboards(board), player)
+
+    def search_engine(self, engine):
+        # search used by the engines that think on the position, Engines.ALPHA_BETA and Engines.MCTS
+        return self.alpha_beta if engine == Engines.ALPHA_BETA else self.mcts
+
     def simulate_play_on_board(self, board, move, player):
         new_board = self.update_score_and_board(move, player, board)
         return new_board.flatten()
@@ -68,14 +172,19 @@ class CheckersTraining(CheckersRulesGame):
         And rewarded proprotionally to the points the player got.
         ties are slighly punished
         """
-        if  self.player1_score == self.player2_score:
-            return -self.total_moves  # slight penalization on tie
+        return self.score_reward(player, self.player1_score, self.player2_score, self.total_moves)
+
+    @staticmethod
+    def score_reward(player, player1_score, player2_score, total_moves):
+        # calculate_reward for any game, not only the one on this board
+        if  player1_score == player2_score:
+            return -total_moves  # slight penalization on tie
         res = 0
-        if self.player1_score > self.player2_score:
-            res = self.player1_score if player == 1 else -self.player1_score
-        elif self.player1_score < self.player2_score:
-            res = -self.player2_score if player == 1 else self.player2_score
-        return (res * 10) - self.total_moves # moves become a penalizing factor, the longer the game takes the more it is punished
+        if player1_score > player2_score:
+            res = player1_score if player == 1 else -player1_score
+        elif player1_score < player2_score:
+            res = -player2_score if player == 1 else player2_score
+        return (res * 10) - total_moves # moves become a penalizing factor, the longer the game takes the more it is punished
 
     def filter_and_flatten_board(self, board, player):
         # Convert the board to a list of lists if it is a NumPy array
@@ -86,29 +195,45 @@ class CheckersTraining(CheckersRulesGame):
         return np.array([player] + filtered_board).reshape(1, -1)
 
 
-    def have_nn_select_moves(self, valid_moves, player):
-        best_percentage = -math.inf 
-        best_move = None
-        flat_board_with_player = None
-        for current_move in valid_moves:
-            new_board = self.board.copy()
-            flat_board = self.simulate_play_on_board(new_board, current_move, player)
-            flat_board_with_player = self.filter_and_flatten_board(flat_board, player)
-            score_move_percentage = self.nn.predict(flat_board_with_player)[0][0]
+    def have_nn_select_moves(self, valid_moves, player, network=None):
+        """
+        All the candidate boards are scored by the neural network in a single batch.
+        network defaults to the tensorflow model, any object with predict_batch can be used (ie numpy_nn).
+        Returns the best move and the flat board it leads to.
+        """
+        if network is None:
+            network = self.nn
+        candidates = np.vstack([
+            self.filter_and_flatten_board(self.simulate_play_on_board(self.board.copy(), current_move, player), player)
+            for current_move in valid_moves
+        ])
+        scores = network.predict_batch(candidates)
+        best_percentage = -math.inf
+        best_index = None
+        for index, score_move_percentage in enumerate(scores):
             if best_percentage < score_move_percentage:
-                best_move = current_move
+                best_index = index
                 best_percentage = score_move_percentage
             elif best_percentage == score_move_percentage:
-                best_move = random.choice([best_move, current_move])
-                best_percentage = score_move_percentage
+                best_index = random.choice([best_index, index])
         if player == -1:
             self.predicted_player1 = best_percentage
         else:
             self.predicted_player2 = best_percentage
         debug_print(f"Predicted: {self.predicted_player1} - player 1")
         debug_print(f"Predicted: {self.predicted_player2} - player -1")
-        return best_move, flat_board_with_player
+        return valid_moves[best_index], candidates[best_index:best_index + 1]
     
+    def have_search_select_moves(self, valid_moves, player, search):
+        """
+        Searches the current board with search (alpha_beta or mcts) within its time budget,
+        the game ends at the move limit so the search does not look past it.
+        """
+        player1, player2, kings = board_to_bitboards(self.board)
+        chosen_move = search.search(player1, player2, kings, player, self.move_limit - self.total_moves, valid_moves)
+        flat_board = self.simulate_play_on_board(self.board.copy(), chosen_move, player)
+        return chosen_move, self.filter_and_flatten_board(flat_board, player)
+
     def select_random_play(self, valid_moves, player):
         chosen_move = random.choice(valid_moves)
         new_board = self.board.copy()
@@ -184,66 +309,180 @@ class CheckersTraining(CheckersRulesGame):
         print("Saving results in a file...")
         self.remove_zero_values(self.monte_carlo_scoring)
 
+        mapped = isinstance(self.monte_carlo_scoring, MappedMonteCarloTable)
+        if mapped:
+            # changes made while the table is written go to a new log, the current logs stay valid until then
+            self.start_monte_carlo_log()
+        monte_carlo_file = self.new_monte_carlo_file_name(self.monte_carlo_extension() if mapped else '.bin')
+        table_path = os.path.join(self.save_directory, monte_carlo_file)
+        if mapped:
+            self.monte_carlo_scoring.save(table_path, self.total_games)
+        else:
+            write_monte_carlo_file(table_path, self.monte_carlo_scoring.stats_items())
+        self.monte_carlo_file = monte_carlo_file
+        self.monte_carlo_logs = self.monte_carlo_logs[-1:] if mapped else []
+        self.write_status()
+        self.remove_old_monte_carlo_files()
+        print(f"Status saved after {self.total_games} games.")
+        if TRAINING:
+            self._save_model()
+
+    def write_status(self, rotate=True):
+        """
+        Writes game_status.json, rotate keeps the previous one as game_status2.json.
+        Without rotate the file is replaced at once, so a crash leaves either the old or the new status.
+        """
         src = os.path.join(self.save_directory, f"game_status.json")
         dst = os.path.join(self.save_directory, f"game_status2.json")
-        if os.path.exists(dst):
-            os.remove(os.path.join(self.save_directory,'game_status2.json'))
-        if os.path.exists(src):
-            os.rename(src, dst)
-
-        dst = os.path.join(self.save_directory, f"game_status.json")
+        if rotate:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if os.path.exists(src):
+                os.rename(src, dst)
         status = {
             'total_games': self.total_games,
             'valid_moves_memo': dict(),  # Convert to list for JSON
             'transition_memo': dict(),  # Convert to list for JSON
-            'monte_carlo_scoring': dict(self.monte_carlo_scoring)
+            'monte_carlo_scoring': dict(self.legacy_monte_carlo_scoring),
+            'monte_carlo_file': self.monte_carlo_file,
+            'monte_carlo_logs': self.monte_carlo_logs,
+            'monte_carlo_keys': 'canonical'
         }
-        with open(dst, 'w') as f:
+        tmp = src + '.tmp'
+        with open(tmp, 'w') as f:
             json.dump(status, f)
-        print(f"Status saved after {self.total_games} games.")
-        if TRAINING:
-            self._save_model()
+        os.replace(tmp, src)
+
+    def start_monte_carlo_log(self):
+        """
+        Starts a new delta log for the monte carlo checkpoints, game_status.json references it before anything is written to it.
+        """
+        name = self.new_monte_carlo_file_name('.log')
+        self.monte_carlo_logs = self.monte_carlo_logs + [name]
+        self.write_status(rotate=False)
+        self.monte_carlo_scoring.start_log(os.path.join(self.save_directory, name))
+
+    def checkpoint_periodically(self, game_count):
+        if game_count % CHECKPOINT_INTERVAL == 0 and isinstance(self.monte_carlo_scoring, MappedMonteCarloTable):
+            self.monte_carlo_scoring.checkpoint()
+
+    def new_monte_carlo_file_name(self, extension='.bin'):
+        # never reuses a name, the file of the current table is still mapped
+        name = f"monte_carlo_{self.total_games}{extension}"
+        suffix = 1
+        while os.path.exists(os.path.join(self.save_directory, name)):
+            name = f"monte_carlo_{self.total_games}_{suffix}{extension}"
+            suffix += 1
+        return name
+
+    def monte_carlo_extension(self):
+        # a sharded table is saved as a manifest next to its shard files
+        return MANIFEST_EXTENSION if self.monte_carlo_scoring.shards > 1 else '.bin'
+
+    def referenced_monte_carlo_files(self):
+        """
+        Returns the tables and delta logs referenced by game_status.json and game_status2.json.
+        """
+        referenced = set()
+        for status_file in ('game_status.json', 'game_status2.json'):
+            path = os.path.join(self.save_directory, status_file)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                status = json.load(f)
+            monte_carlo_file = status.get('monte_carlo_file')
+            if monte_carlo_file and os.path.exists(os.path.join(self.save_directory, monte_carlo_file)):
+                referenced.add(monte_carlo_file)
+                referenced.update(os.path.basename(name) for name in table_files(os.path.join(self.save_directory, monte_carlo_file)))
+            referenced.update(status.get('monte_carlo_logs', []))
+        return referenced
+
+    def remove_old_monte_carlo_files(self):
+        """
+        Removes the binary tables (manifests and their shards) and delta logs not referenced by game_status.json or game_status2.json.
+        """
+        keep = self.referenced_monte_carlo_files()
+        for name in os.listdir(self.save_directory):
+            if name.startswith('monte_carlo_') and name.endswith(('.bin', '.log', MANIFEST_EXTENSION)) and name not in keep:
+                try:
+                    os.remove(os.path.join(self.save_directory, name))
+                except OSError:
+                    pass  # still mapped (windows), removed by a later save
 
 
     def reduce_cache_size(self):
-        self.valid_moves_memo.remove_least_used()
-        self.transition_memo.remove_least_used()
+        # the memos are bounded (MEMO_CAPACITY), they are kept warm and only their counters are reported
+        self.valid_moves_memo.print_stats("Valid moves memo")
+        self.transition_memo.print_stats("Transition memo")
 
 
     def load_status(self):
         src = os.path.join(self.save_directory, f"game_status.json")
+        # runs spilled by a previous process, their entries are in the logs or lost with it
+        for name in os.listdir(self.save_directory):
+            if name.startswith(SPILL_PREFIX):
+                os.remove(os.path.join(self.save_directory, name))
         if os.path.exists(src):
             with open(src, 'r') as f:
                 status = json.load(f)
                 self.total_games = status.get('total_games', 0)
-                self.monte_carlo_scoring =  dict(status.get('monte_carlo_scoring', []))
+                self.legacy_monte_carlo_scoring = dict(status.get('monte_carlo_scoring', []))
+                self.monte_carlo_file = status.get('monte_carlo_file')
+                if self.monte_carlo_file and os.path.exists(os.path.join(self.save_directory, self.monte_carlo_file)):
+                    # only mapped, pages are read on demand
+                    self.monte_carlo_scoring = MappedMonteCarloTable(os.path.join(self.save_directory, self.monte_carlo_file),
+                                                                     spill_directory=self.save_directory,
+                                                                     shards=MONTE_CARLO_SHARDS, verify=MONTE_CARLO_VERIFY_SHARDS)
+                else:
+                    self.monte_carlo_scoring = MappedMonteCarloTable(spill_directory=self.save_directory, shards=MONTE_CARLO_SHARDS)
+                # imports files saved before the binary format, the states were stored in the json
+                self.monte_carlo_scoring.update((int(key), value) for key, value in status.get('monte_carlo_states', {}).items())
+                # changes checkpointed after the table was saved, replayed in order
+                self.monte_carlo_logs = [name for name in status.get('monte_carlo_logs', [])
+                                         if os.path.exists(os.path.join(self.save_directory, name))]
+                for name in self.monte_carlo_logs:
+                    replayed = self.monte_carlo_scoring.replay_log(os.path.join(self.save_directory, name))
+                    print(f"Recovered {replayed} monte carlo changes from {name}")
+                if status.get('monte_carlo_keys') != 'canonical' and len(self.monte_carlo_scoring):
+                    self.canonicalize_monte_carlo_table()
+        self.start_monte_carlo_log()
+
+    def canonicalize_monte_carlo_table(self):
+        """
+        Migrates a table saved before the canonical keys: the entries stored under the mirror of their canonical key
+        are moved to it, merged with the entry already there. The migrated table replaces the saved one,
+        the previous status is kept as game_status2.json.
+        """
+        print("Migrating the monte carlo table to canonical keys...")
+        monte_carlo_file = self.new_monte_carlo_file_name(self.monte_carlo_extension())
+        merged = self.monte_carlo_scoring.canonicalize(os.path.join(self.save_directory, monte_carlo_file), self.total_games)
+        self.monte_carlo_file = monte_carlo_file
+        self.monte_carlo_logs = []  # replayed into the migrated table
+        self.write_status()
+        print(f"Merged {merged} mirrored entries, {len(self.monte_carlo_scoring)} left.")
 
 
     def have_mc_select_moves(self, valid_moves, player):
+        """
+        Returns the move leading to the best scored state of the monte carlo table and the flat board of that state.
+        """
         best_percentage = -math.inf 
         best_move = None
-        flat_board_with_player = None
+        best_flat_board = None
         for current_move in valid_moves:
             new_board = self.board.copy()
             flat_board = self.simulate_play_on_board(new_board, current_move, player)
             flat_board_with_player = self.filter_and_flatten_board(flat_board, player)
-            state = clean_string(f"{flat_board_with_player}")
-            inv_state = transform_key_to_base72(self.mirror_play(state))
-            state = transform_key_to_base72(state)
-            
-            if state in self.monte_carlo_scoring:
-                score_move_percentage = self.monte_carlo_scoring[state]
-            elif inv_state in self.monte_carlo_scoring:
-                score_move_percentage = self.monte_carlo_scoring[inv_state]
-            else:
-                score_move_percentage = 0
+            state = self.monte_carlo_key(flat_board_with_player)
+            found_key = self.find_monte_carlo_key(state)
+            score_move_percentage = self.monte_carlo_scoring[found_key] if found_key is not None else 0
             debug_print(f"Predicted: {score_move_percentage} for {state}")
             if best_percentage < score_move_percentage:
-                best_move = current_move
+                best_move, best_flat_board = current_move, flat_board_with_player
                 best_percentage = score_move_percentage
             elif best_percentage == score_move_percentage:
                 # choses random, mostly useful if they are unknown zeros
-                best_move = random.choice([best_move, current_move])
+                best_move, best_flat_board = random.choice([(best_move, best_flat_board), (current_move, flat_board_with_player)])
                 best_percentage = score_move_percentage
         if player == -1:
             self.predicted_player1 = best_percentage
@@ -251,7 +490,7 @@ class CheckersTraining(CheckersRulesGame):
             self.predicted_player2 = best_percentage
         debug_print(f"Predicted: {self.predicted_player1} - player 1")
         debug_print(f"Predicted: {self.predicted_player2} - player -1")
-        return best_move, flat_board_with_player
+        return best_move, best_flat_board
 
 
     def calculate_percentages(self, mc_wins, random_wins, ties):
@@ -266,42 +505,159 @@ class CheckersTraining(CheckersRulesGame):
         return percentage_mc_wins, percentage_random_wins, percentage_ties
 
 
+    def monte_carlo_key(self, flat_board_with_player):
+        """
+        Returns the canonical integer key of the state, the same for the state and its mirror play.
+        """
+        return canonical_state_key(encode_state(flat_board_with_player))
+
+    def find_monte_carlo_key(self, state):
+        """
+        Returns the canonical key state if it is stored in monte_carlo_scoring, None otherwise.
+        Entries still under the base 72 keys of an old save are migrated the first time they are looked up,
+        the old keys are lossy (several boards share them) so they can not be converted upfront.
+        """
+        if state in self.monte_carlo_scoring:
+            return state
+        if self.legacy_monte_carlo_scoring:
+            for key in (state, mirror_state_key(state)):
+                legacy_key = legacy_state_key(key)
+                if legacy_key in self.legacy_monte_carlo_scoring:
+                    self.monte_carlo_scoring[state] = self.legacy_monte_carlo_scoring.pop(legacy_key)
+                    return state
+        return None
+
     def update_reward_monte_carlo_score(self, inputs, reward):
         # inputs normally shaped as flat_board_with_player
-        state = clean_string(f"{inputs}")
-        inv_state = self.mirror_play(state)
-        # reward = reward / 100
-        state = transform_key_to_base72(state)
-        inv_state = transform_key_to_base72(inv_state)
-        if state in self.monte_carlo_scoring:
-            self.monte_carlo_scoring[state] = average(reward, self.monte_carlo_scoring[state])
+        self.update_reward_monte_carlo_key(encode_state(inputs), reward)
+
+    def update_reward_monte_carlo_key(self, state, reward):
+        """
+        Adds the reward to the running mean of the state (stored under its canonical key),
+        every game weighs the same instead of the last one counting for half of the value.
+        """
+        key = canonical_state_key(state)
+        if self.find_monte_carlo_key(key) is None:
+            self.new_branches_created += 1
+        elif key == state:
             self.old_branches_updated += 1
-        elif inv_state in self.monte_carlo_scoring:
-            self.monte_carlo_scoring[inv_state] = average(reward, self.monte_carlo_scoring[inv_state])
-            self.inverted_branches_used += 1
         else:
-            self.monte_carlo_scoring[state]=reward
-            self.new_branches_created += 1
+            self.inverted_branches_used += 1
+        self.monte_carlo_scoring.add_reward(key, reward)
 
 
     def play_with_selected_engine(self, valid_moves, player):
         if RANDOM_FIRST_PLAYS > self.total_moves:
             return self.select_random_play(valid_moves, player)
-        if player == 1:
-            if PLAYER_1_ENGINE == Engines.MC:
-                return self.have_mc_select_moves(valid_moves, player)
-            elif PLAYER_1_ENGINE == Engines.NN:
-                return self.have_nn_select_moves(valid_moves, player)
-            else:
-                return self.select_random_play(valid_moves, player)
-        if player == -1:
-            if PLAYER_2_ENGINE == Engines.MC:
-                return self.have_mc_select_moves(valid_moves, player)
-            elif PLAYER_2_ENGINE == Engines.NN:
-                return self.have_nn_select_moves(valid_moves, player)
+        if player not in (1, -1):
+            return None, None
+        known_move = self.book_move(self.board, valid_moves, player, self.total_moves)
+        if known_move is None:
+            known_move = self.tablebase_move(self.board, valid_moves, player, self.total_moves)
+        if known_move is not None:
+            flat_board = self.simulate_play_on_board(self.board.copy(), known_move, player)
+            return known_move, self.filter_and_flatten_board(flat_board, player)
+        engine = PLAYER_1_ENGINE if player == 1 else PLAYER_2_ENGINE
+        if engine == Engines.MC:
+            return self.have_mc_select_moves(valid_moves, player)
+        elif engine == Engines.NN:
+            return self.have_nn_select_moves(valid_moves, player)
+        elif engine == Engines.NN_NUMPY:
+            return self.have_nn_select_moves(valid_moves, player, self.numpy_nn)
+        elif engine in (Engines.ALPHA_BETA, Engines.MCTS):
+            return self.have_search_select_moves(valid_moves, player, self.search_engine(engine))
+        return self.select_random_play(valid_moves, player)
+
+
+    def play_game(self):
+        """
+        Plays a full game from the initial board with the configured engines,
+        and delivers the rewards of every play to the monte carlo table (and the NN when training).
+        """
+        self.board = self.initialize_board()
+        plays_from_players = {
+            1: [],
+            -1: []
+        }
+        self.total_games += 1
+        player = random.choice([1, -1]) # Start with random player
+        debug_print("Current Board:")
+        self.print_board()  # Print the board for debugging
+        self.tie_detected = False
+        while True:
+            if self.tablebase_decides(self.board, player):
+                debug_print("Endgame tablebase: the scores decide the game.")
+                break
+            valid_moves = self.generate_valid_moves(self.board, player)
+            if not valid_moves:
+                break
+
+            chosen_move, flat_board_with_player =  self.play_with_selected_engine(valid_moves, player)
+            if not chosen_move:
+                raise ("There is a problem, no move was chosen.")
+            
+            plays_from_players[player].append(flat_board_with_player)
+            self.update_score_and_board(chosen_move, player)
+
+            self.update_reward_monte_carlo_score(flat_board_with_player, self.calculate_reward(player))
+            
+            if self.detect_loop():
+                self.tie_detected = True
+                debug_print("Loop detected. Game ends in a tie.")
+                debug_print(f"Total moves: {self.total_moves}")
+                break
+
+            if DEBUG_ON:
+                self.print_board()
+                debug_print(f"Player 1 score: {self.player1_score} ({PLAYER_1_ENGINE})")
+                debug_print(f"Player -1 score: {self.player2_score} ({PLAYER_2_ENGINE})")
+                debug_print(f"Total moves: {self.total_moves}")
+                debug_print(f"Total Games played: {self.total_games}")
+                self.update_game_scores()
+                time.sleep(1)
+
+            if player == 1:
+                self.player1_moves += 1
             else:
-                return self.select_random_play(valid_moves, player)
-        return None, None
+                self.player2_moves += 1
+
+            player = -player  # reverse player playing
+
+            self.total_moves += 1
+            if self.total_moves >= self.move_limit:
+                # self.tie_detected = True
+                debug_print("Move limit reached. Game ends in a tie.")
+                debug_print(f"Total moves: {self.total_moves}")
+                break
+
+
+        self.update_game_scores()
+        debug_print(f"Player {player} has no valid moves. Game over.")
+        debug_print(f"Player 1 moves: {self.player1_moves}")
+        debug_print(f"Player -1 moves: {self.player2_moves}")
+        debug_print(f"Player 1 score: {self.player1_score}")
+        debug_print(f"Player -1 score: {self.player2_score}")
+
+        reward = self.calculate_reward(1)
+        if self.player1_score > self.player2_score:
+            self.player_1_win_count += 1
+        elif self.player1_score < self.player2_score:
+            self.player_2_win_count += 1
+        else:
+            self.tie_games += 1
+
+        debug_print(f"Delivering reward for P{1}: {reward}")
+        for play in plays_from_players[1]:
+            self.update_reward_monte_carlo_score(play, reward)
+            if TRAINING:
+                self.nn.train(np.array(play), np.array([reward]))
+        
+        reward = self.calculate_reward(-1)
+        debug_print(f"Delivering reward for P{-1}: {reward}")
+        for play in plays_from_players[-1]:
+            self.update_reward_monte_carlo_score(play, reward)
+            if TRAINING:
+                self.nn.train(np.array(play), np.array([reward]))
 
 
     def run_simulation(self):
@@ -315,94 +671,11 @@ class CheckersTraining(CheckersRulesGame):
                 self.new_branches_created = 0
                 self.old_branches_updated = 0
                 self.inverted_branches_used = 0
-                self.board = self.initialize_board()
-                plays_from_players = {
-                    1: [],
-                    -1: []
-                }
-                self.total_games += 1
-                player = random.choice([1, -1]) # Start with random player
-                debug_print("Current Board:")
-                self.print_board()  # Print the board for debugging
-                self.tie_detected = False
-                while True:
-                    valid_moves = self.generate_valid_moves(self.board, player)
-                    if not valid_moves:
-                        break
-
-                    chosen_move, flat_board_with_player =  self.play_with_selected_engine(valid_moves, player)
-                    if not chosen_move:
-                        raise ("There is a problem, no move was chosen.")
-                    
-                    plays_from_players[player].append(flat_board_with_player)
-                    self.update_score_and_board(chosen_move, player)
-
-                    self.update_reward_monte_carlo_score(flat_board_with_player, self.calculate_reward(player))
-                    
-                    if self.detect_loop():
-                        self.tie_detected = True
-                        debug_print("Loop detected. Game ends in a tie.")
-                        debug_print(f"Total moves: {self.total_moves}")
-                        break
-
-                    if DEBUG_ON:
-                        self.print_board()
-                        debug_print(f"Player 1 score: {self.player1_score} ({PLAYER_1_ENGINE})")
-                        debug_print(f"Player -1 score: {self.player2_score} ({PLAYER_2_ENGINE})")
-                        debug_print(f"Total moves: {self.total_moves}")
-                        debug_print(f"Total Games played: {self.total_games}")
-                        self.update_game_scores()
-                        time.sleep(1)
-
-                    if player == 1:
-                        self.player1_moves += 1
-                    else:
-                        self.player2_moves += 1
-
-                    player = -player  # reverse player playing
-
-                    self.total_moves += 1
-                    if self.total_moves >= self.move_limit:
-                        # self.tie_detected = True
-                        debug_print("Move limit reached. Game ends in a tie.")
-                        debug_print(f"Total moves: {self.total_moves}")
-                        break
-
-
-                self.update_game_scores()
-                debug_print(f"Player {player} has no valid moves. Game over.")
-                debug_print(f"Player 1 moves: {self.player1_moves}")
-                debug_print(f"Player -1 moves: {self.player2_moves}")
-                debug_print(f"Player 1 score: {self.player1_score}")
-                debug_print(f"Player -1 score: {self.player2_score}")
-
-                reward = self.calculate_reward(1)
-                if self.player1_score > self.player2_score:
-                    self.player_1_win_count += 1
-                elif self.player1_score < self.player2_score:
-                    self.player_2_win_count += 1
-                else:
-                    self.tie_games += 1
-
-                debug_print(f"Delivering reward for P{1}: {reward}")
-                for play in plays_from_players[1]:
-                    self.update_reward_monte_carlo_score(play, reward)
-                    if TRAINING:
-                        self.nn.train(np.array(play), np.array([reward]))
-                
-                reward = self.calculate_reward(-1)
-                debug_print(f"Delivering reward for P{-1}: {reward}")
-                for play in plays_from_players[-1]:
-                    self.update_reward_monte_carlo_score(play, reward)
-                    if TRAINING:
-                        self.nn.train(np.array(play), np.array([reward]))
+                self.play_game()
+                self.checkpoint_periodically(self.total_games)
                 self.save_model_periodically(self.total_games) # periodically
                 if self.total_games % STOP_CHECK_INTERVAL == 0:
-                    print(f"MC new branches: {self.new_branches_created} - Old Branches {self.old_branches_updated} - Mirror used {self.inverted_branches_used}")
-                    print(f"Global score: P1: {self.player_1_win_count}  ({PLAYER_1_ENGINE}) P-1: {self.player_2_win_count}" \
-                        f"({PLAYER_2_ENGINE}) - Tie {self.tie_games} - MC:{len(self.monte_carlo_scoring)}")
-                    p1, p2, p3 = self.calculate_percentages(self.player_1_win_count, self.player_2_win_count, self.tie_games)
-                    print(f"{p1}% ({PLAYER_1_ENGINE}) - {p2}% ({PLAYER_2_ENGINE}) - {p3}% ties")
+                    self.print_progress()
                     if self.check_and_delete_stop_file():
                         break
             print("Preparing to stop the application...")
@@ -412,12 +685,23 @@ class CheckersTraining(CheckersRulesGame):
 
 
 
+    def print_progress(self):
+        print(f"MC new branches: {self.new_branches_created} - Old Branches {self.old_branches_updated} - Mirror used {self.inverted_branches_used}")
+        print(f"Global score: P1: {self.player_1_win_count}  ({PLAYER_1_ENGINE}) P-1: {self.player_2_win_count}" \
+            f"({PLAYER_2_ENGINE}) - Tie {self.tie_games} - MC:{len(self.monte_carlo_scoring)}")
+        p1, p2, p3 = self.calculate_percentages(self.player_1_win_count, self.player_2_win_count, self.tie_games)
+        print(f"{p1}% ({PLAYER_1_ENGINE}) - {p2}% ({PLAYER_2_ENGINE}) - {p3}% ties")
+
     def remove_zero_values(self, input_dict):
         print(f"Removing 0 values...")
-        keys_to_remove = [key for key, value in input_dict.items() if value == 0]
-        for key in keys_to_remove:
-            del input_dict[key]
-        print(f'Removed {len(keys_to_remove)} keys.')
+        if isinstance(input_dict, MappedMonteCarloTable):
+            removed = input_dict.remove_zero_values()  # vectorized over the mapped file
+        else:
+            keys_to_remove = [key for key, value in input_dict.items() if value == 0]
+            for key in keys_to_remove:
+                del input_dict[key]
+            removed = len(keys_to_remove)
+        print(f'Removed {removed} keys.')
 
     
     def save_game_results(self):
@@ -427,7 +711,9 @@ class CheckersTraining(CheckersRulesGame):
         self.remove_zero_values(self.monte_carlo_scoring)
         status = {
             'total_games': self.total_games,
-            'monte_carlo_scoring': dict(self.monte_carlo_scoring)
+            'monte_carlo_scoring': dict(self.legacy_monte_carlo_scoring),
+            # key -> [mean, visits], merged by TrainningResultsConsolidator
+            'monte_carlo_states': {key: [mean, visits] for key, mean, visits in self.monte_carlo_scoring.stats_items()}
         }
         new_file = os.path.join(self.save_directory,f'{random_name}.json')
         with open(new_file, 'w') as f:
@@ -451,6 +737,8 @@ class CheckersTraining(CheckersRulesGame):
         print("Executor still running, waiting for it to complete")
         self.executor.shutdown(wait=True)
         print("Executor shutdown complete")
+        if self._mcts is not None:
+            self._mcts.close()  # stops the worker processes of the parallel searches
 
 if __name__ == "__main__":
     game = CheckersTraining()
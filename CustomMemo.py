@@ -1,56 +1,77 @@
 """
-This intends to create a structure that stores items and keep taps on the frequency they are used.
-After some time, the least used can be removed based on conditions ( minimum usage) or the 50% least used.
+This intends to create a structure that stores items and keep taps on how they are used.
+The memo is bounded: when it is full, inserting a new item evicts the least recently used one,
+so the memory stays flat and the hit rate does not collapse after a purge.
 """
+from collections import OrderedDict
+from SimpleConfig import MEMO_CAPACITY
+
 
 class Memo:
-    def __init__(self):
-        self.data_dict = {}
-        self.freq_dict = {}
+    def __init__(self, capacity=MEMO_CAPACITY):
+        """
+        Parameters:
+        capacity (int): Maximum number of items kept.
+        """
+        self.capacity = capacity
+        self.data_dict = OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def __setitem__(self, key, value):
+        if key in self.data_dict:
+            self.data_dict.move_to_end(key)
+        elif len(self.data_dict) >= self.capacity:
+            self.data_dict.popitem(last=False)
+            self.evictions += 1
         self.data_dict[key] = value
-        self.freq_dict[key] = 0
 
     def __getitem__(self, key):
         if key in self.data_dict:
-            self.freq_dict[key] += 1
+            self.hits += 1
+            self.data_dict.move_to_end(key)
             return self.data_dict[key]
+        self.misses += 1
         raise KeyError(f'Key {key} not found')
-    
+
     def __contains__(self, key):
-        return key in self.data_dict
+        # used before __getitem__, the hit is counted there
+        if key in self.data_dict:
+            return True
+        self.misses += 1
+        return False
 
     def __delitem__(self, key):
         if key in self.data_dict:
             del self.data_dict[key]
-            del self.freq_dict[key]
         else:
             raise KeyError(f'Key {key} not found')
 
+    def __len__(self):
+        return len(self.data_dict)
+
     def insert(self, key, value):
         self.__setitem__(key, value)
 
     def get(self, key):
         return self.__getitem__(key)
 
-    def remove_least_used(self):
-        # Convert freq_dict to a list of (key, frequency) pairs
-        freq_list = list(self.freq_dict.items())
-        
-        # Sort freq_list by frequency
-        freq_list.sort(key=lambda x: x[1])
-        
-        # Determine the number of elements to remove (90%)
-        remove_precentage = 0.9
-        num_to_remove = int(len(freq_list) * remove_precentage)
-        print(f"Removing {num_to_remove} items from the cache, leaving {int(len(freq_list) * (1-remove_precentage))}.")
-        
-        # Remove the least used keys
-        for i in range(num_to_remove):
-            key_to_remove = freq_list[i][0]
-            del self[key_to_remove]
-
-
-
-    
\ No newline at end of file
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print_stats(self, name):
+        print(f"{name}: {len(self)}/{self.capacity} items - hits {self.hits} - misses {self.misses} - "
+              f"evictions {self.evictions} - hit rate {self.hit_rate() * 100:.2f}%")
+
+    def remove_least_used(self, remove_precentage=0.9):
+        """
+        Removes the given fraction of the items, least recently used first.
+        Not needed to bound the memory, the capacity already does it.
+        """
+        num_to_remove = int(len(self.data_dict) * remove_precentage)
+        print(f"Removing {num_to_remove} items from the cache, leaving {len(self.data_dict) - num_to_remove}.")
+        for _ in range(num_to_remove):
+            self.data_dict.popitem(last=False)
+        self.evictions += num_to_remove
@@ -0,0 +1,188 @@
+"""
+Endgame tablebase of the positions with at most TABLEBASE_PIECES chips on the board.
+
+The game ends when the player to move has no moves or at the move limit, and it is won by the best
+score of get_scores, so the result of a position depends on the plies left. The builder does the
+retrograde analysis as value iteration over the plies left: with 0 plies left the result is the one of
+the current scores, with k plies left it is the best result of the moves over k - 1 plies left.
+The captures and crowns lead to other positions of the table, so all the positions are solved together.
+The value stored is the result with the most plies left (1 win, 0 tie, -1 loss for the player to move), the
+plies needed are the fewest plies left from which the result is that value, so a probe is exact when the game
+has at least that many plies left. With 0 plies needed the current scores already give the result.
+The plies needed are not a distance to the end of the game (that always comes at the move limit or without moves),
+a win needing fewer plies is only one kept on a shorter game.
+Loops end the game with the current scores as well, they are not part of the analysis.
+
+File layout: a 64 bytes header (magic, position count and pieces), the position keys (BitBoard.position_key) sorted
+as 16 bytes big endian strings, then the int8 values and the uint8 plies needed in the same order.
+Loading only maps the file, like MonteCarloStore.
+
+Run this file to build model_saves/endgame_tablebase.bin.
+"""
+import os
+import time
+from itertools import combinations, product
+import numpy as np
+from AlphaBetaSearch import popcount, score_difference
+from BitBoard import CROWN_ROWS, generate_moves_from_bitboards, play_path_on_bitboards, position_key
+from MonteCarloStore import HEADER_SIZE, KEY_DTYPE, keys_to_bytes
+from SimpleConfig import TABLEBASE_PIECES
+
+TABLEBASE_MAGIC = b'EGTB0001'
+TABLEBASE_FILE = "endgame_tablebase.bin"
+HORIZON = 60  # GameBoard.move_limit, no game has more plies left
+PLAYER_1_MAN, PLAYER_1_KING, PLAYER_2_MAN, PLAYER_2_KING = range(4)
+
+
+def enumerate_positions(pieces):
+    """
+    Returns the (player1, player2, kings) bitboards of every board with 1 to pieces chips.
+    A man never stands on the row where it would have been crowned.
+    """
+    positions = []
+    for count in range(1, pieces + 1):
+        for squares in combinations(range(32), count):
+            for chips in product(range(4), repeat=count):
+                player1 = player2 = kings = 0
+                for square, chip in zip(squares, chips):
+                    bit = 1 << square
+                    if chip == PLAYER_1_MAN and bit & CROWN_ROWS[1] or chip == PLAYER_2_MAN and bit & CROWN_ROWS[-1]:
+                        break
+                    if chip in (PLAYER_1_MAN, PLAYER_1_KING):
+                        player1 |= bit
+                    else:
+                        player2 |= bit
+                    if chip in (PLAYER_1_KING, PLAYER_2_KING):
+                        kings |= bit
+                else:
+                    positions.append((player1, player2, kings))
+    return positions
+
+
+def build_tablebase(pieces=TABLEBASE_PIECES, horizon=HORIZON):
+    """
+    Solves every position with at most pieces chips.
+
+    Returns:
+    tuple: (keys, values, plies_needed), the sorted position keys and their np.int8 values and np.uint8 plies needed.
+    """
+    positions = [position + (player,) for position in enumerate_positions(pieces) for player in (1, -1)]
+    positions.sort(key=lambda position: position_key(*position))
+    index = {position_key(*position): i for i, position in enumerate(positions)}
+    static = np.zeros(len(positions), dtype=np.int8)  # result of the current scores for the player to move
+    child_counts = np.zeros(len(positions), dtype=np.int64)
+    children = []
+    for i, (player1, player2, kings, player) in enumerate(positions):
+        static[i] = np.sign(score_difference(player1, player2, kings, player))
+        moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        child_counts[i] = len(moves)
+        children.extend(index[position_key(*play_path_on_bitboards(player1, player2, kings, move, player), -player)]
+                        for move in moves)
+    children = np.array(children, dtype=np.int64)
+    with_moves = child_counts > 0
+    starts = (np.cumsum(child_counts) - child_counts)[with_moves]
+
+    values = static.copy()
+    plies_needed = np.zeros(len(positions), dtype=np.uint8)
+    for plies_left in range(1, horizon + 1):
+        new_values = static.copy()
+        new_values[with_moves] = np.maximum.reduceat(-values[children], starts)
+        changed = new_values != values
+        if not changed.any():
+            break  # the results do not depend on the plies left anymore
+        plies_needed[changed] = plies_left
+        values = new_values
+    return list(index), values, plies_needed
+
+
+def write_tablebase(path, keys, values, plies_needed, pieces):
+    header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+    header[:8] = np.frombuffer(TABLEBASE_MAGIC, dtype=np.uint8)
+    header[8:16] = np.array([len(keys)], dtype='<u8').view(np.uint8)
+    header[16:24] = np.array([pieces], dtype='<u8').view(np.uint8)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        keys_to_bytes(keys).tofile(f)
+        np.asarray(values, dtype=np.int8).tofile(f)
+        np.asarray(plies_needed, dtype=np.uint8).tofile(f)
+
+
+class EndgameTablebase:
+    """
+    Read only tablebase mapped from a file, without a path it is empty and every probe misses.
+    """
+
+    def __init__(self, path=None):
+        self.pieces = 0
+        self.keys = np.zeros(0, dtype=KEY_DTYPE)
+        self.values = np.zeros(0, dtype=np.int8)
+        self.plies_needed = np.zeros(0, dtype=np.uint8)
+        if path:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            if header[:8] != TABLEBASE_MAGIC:
+                raise ValueError(f"{path} is not an endgame tablebase.")
+            count = int(np.frombuffer(header[8:16], dtype='<u8')[0])
+            self.pieces = int(np.frombuffer(header[16:24], dtype='<u8')[0])
+            self.keys = np.memmap(path, dtype=KEY_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+            self.values = np.memmap(path, dtype=np.int8, mode='r', offset=HEADER_SIZE + 16 * count, shape=(count,))
+            self.plies_needed = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE + 17 * count, shape=(count,))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def probe(self, player1, player2, kings, player):
+        """
+        Returns (value, plies needed) of the position for the player to move, None when it has more chips than the table.
+        """
+        if popcount(player1 | player2) > self.pieces:
+            return None
+        packed = position_key(player1, player2, kings, player).to_bytes(16, 'big')
+        index = int(np.searchsorted(self.keys, packed))
+        # numpy drops the trailing zero bytes of the stored strings
+        if index == len(self.keys) or self.keys[index] != packed.rstrip(b'\x00'):
+            return None
+        return int(self.values[index]), int(self.plies_needed[index])
+
+    def decided(self, player1, player2, kings, player):
+        # the current scores give the result of perfect play, whatever the plies left
+        probed = self.probe(player1, player2, kings, player)
+        return probed is not None and probed[1] == 0
+
+    def best_move(self, player1, player2, kings, player, moves_left, valid_moves):
+        """
+        Returns the move of valid_moves keeping the best result, among the wins the one needing the fewest plies left
+        and among the losses the one needing the most (a loss that does not hold on the shorter games).
+        None when the position is not in the table, the game is too short for its result,
+        or no child whose result holds with the plies left after the move keeps that result.
+        """
+        probed = self.probe(player1, player2, kings, player)
+        if probed is None or probed[1] > moves_left:
+            return None
+        best_move, best_rank = None, None
+        for move in valid_moves:
+            child_position = play_path_on_bitboards(player1, player2, kings, move, player)
+            child = self.probe(*child_position, -player)
+            if child is None:
+                return None
+            if moves_left == 1:
+                # the move limit ends the game after this move, the current scores give the result
+                child = (int(np.sign(score_difference(*child_position, -player))), 0)
+            if child[1] > moves_left - 1:
+                continue  # the result of the child needs more plies than the game has left
+            value, plies_needed = -child[0], child[1]
+            rank = (value, -plies_needed if value > 0 else plies_needed)
+            if best_rank is None or rank > best_rank:
+                best_move, best_rank = move, rank
+        if best_rank is None or best_rank[0] < probed[0]:
+            return None
+        return best_move
+
+if __name__ == "__main__":
+    from CheckersTraining import CheckersTraining
+    started = time.time()
+    keys, values, plies_needed = build_tablebase()
+    path = os.path.join(CheckersTraining().save_directory, TABLEBASE_FILE)
+    write_tablebase(path, keys, values, plies_needed, TABLEBASE_PIECES)
+    print(f"Endgame tablebase of {len(keys)} positions up to {TABLEBASE_PIECES} chips saved to {path} "
+          f"({os.path.getsize(path)} bytes) in {time.time() - started:.1f}s.")
@@ -5,6 +5,20 @@ class Engines(Enum):
     NN = 1  # Neural network
     MC = 2  # Monte Carlo
     RANDOM = 3 # Random
+    NN_NUMPY = 4 # Neural network weights evaluated with numpy, inference only
+    ALPHA_BETA = 5 # Iterative deepening alpha-beta search, positions scored by ALPHA_BETA_EVALUATOR
+    MCTS = 6 # Monte Carlo tree search with UCT
+
+
+class Evaluators(Enum):
+    SCORES = 1 # Difference of the get_scores points
+    MC = 2 # Monte Carlo table, scores for the unknown positions
+    NN = 3 # Neural network, evaluated with numpy
+
+
+class Playouts(Enum):
+    RANDOM = 1 # Random moves
+    NN = 2 # Move the neural network (numpy) scores best
 
     
 class Player(Enum):
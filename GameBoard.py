@@ -1,6 +1,7 @@
 import numpy as np
 from SimpleConfig import debug_print 
 from CustomMemo import Memo
+from Zobrist import ZOBRIST_PLAYER_2, hash_board, zobrist_key
 
 class GameBoard():
     def __init__(self):
@@ -16,6 +17,15 @@ class GameBoard():
         self.place_players_chips(self.blank_board)
         self.board = self.initialize_board()
 
+    @property
+    def board(self):
+        return self._board
+
+    @board.setter
+    def board(self, board):
+        # every new board gets its hash computed once, plays on it update the hash incrementally
+        self._board = board
+        self.zobrist_hash = hash_board(board)
 
     def initialize_board(self):
         self.bodies_of_captures = set() # used to represent recently captured positions on the UI.
@@ -107,8 +117,8 @@ class GameBoard():
         for move in move_positions:
             from_pos, to_pos = (move[0], move[1]), (move[-2], move[-1])
             # Move the piece
-            board[to_pos[0], to_pos[1]] = board[from_pos[0], from_pos[1]]
-            board[from_pos[0], from_pos[1]] = 0
+            self.set_tile(board, to_pos[0], to_pos[1], board[from_pos[0], from_pos[1]])
+            self.set_tile(board, from_pos[0], from_pos[1], 0)
 
             # Check for captures and remove the captured pieces
             row_diff = to_pos[0] - from_pos[0]
@@ -118,7 +128,7 @@ class GameBoard():
                 mid_row = (from_pos[0] + to_pos[0]) // 2
                 mid_col = (from_pos[1] + to_pos[1]) // 2
                 self.bodies_of_captures.add(f"{mid_row}_{mid_col}")
-                board[mid_row, mid_col] = 0
+                self.set_tile(board, mid_row, mid_col, 0)
             elif abs(row_diff) > 2 or abs(col_diff) > 2:
                 step_row = int(row_diff / abs(row_diff))
                 step_col = int(col_diff / abs(col_diff))
@@ -128,17 +138,32 @@ class GameBoard():
                     current_col += step_col
                     if board[current_row, current_col] == -player or board[current_row, current_col] == -2 * player:
                         self.bodies_of_captures.add(f"{current_row}_{current_col}")
-                        board[current_row, current_col] = 0
+                        self.set_tile(board, current_row, current_col, 0)
 
             # Check if the piece should be crowned
             if (player == 1 and to_pos[0] == 0) or (player == -1 and to_pos[0] == 7):
-                board[to_pos[0], to_pos[1]] = 2 * player
+                self.set_tile(board, to_pos[0], to_pos[1], 2 * player)
 
         # Update the scores based on the current board state
         # but only if the main scoreboard is updated
         if board is None or not board.any():
             self.update_game_scores()
         return board
+
+    def board_hash(self, board, player=1):
+        """
+        Zobrist hash of board and the side to move, the game board hash comes for free since it is kept incrementally.
+        """
+        res = self.zobrist_hash if board is self._board else hash_board(board)
+        return res ^ ZOBRIST_PLAYER_2 if player == -1 else res
+
+    def set_tile(self, board, row, col, value):
+        """
+        Write a tile of board, keeping zobrist_hash up to date when board is the game board.
+        """
+        if board is self._board:
+            self.zobrist_hash ^= zobrist_key(row, col, board[row, col]) ^ zobrist_key(row, col, value)
+        board[row, col] = value
     
     def get_scores(self, board):
         """
@@ -170,7 +195,7 @@ class GameBoard():
         Returns:
         bool: True if a loop is detected, False otherwise.
         """
-        board_state = f"{self.board}"
+        board_state = self.zobrist_hash
         
         if board_state in self.previous_boards:
             self.loop_counter += 1
@@ -0,0 +1,260 @@
+"""
+Lockstep self play.
+A batch of games is advanced one ply at a time: the moves of every live game are generated at once
+(generate_moves_batch), the engines choose for all of them (the neural networks score the candidates of
+every game in a single predict_batch call), the moves are applied in bulk and the finished games are
+replaced by new ones. Rewards are delivered the same way CheckersTraining.play_game does.
+"""
+import random
+import numpy as np
+from BitBoard import PLAYABLE_INDICES, board_to_bitboards, boards_to_bitboards_batch, generate_moves_batch
+from CheckersTraining import CheckersTraining
+from Enumerators import Engines
+from StateKeys import encode_canonical_states
+from SimpleConfig import LOCKSTEP_GAMES, PLAYER_1_ENGINE, PLAYER_2_ENGINE, RANDOM_FIRST_PLAYS, STOP_CHECK_INTERVAL, TRAINING
+
+
+def apply_moves_batch(boards, moves, players):
+    """
+    Play moves[i] by players[i] on a copy of boards[i], same result as GameBoard.update_score_and_board:
+    the chip leaves its tile, the jumped chips are removed and it is crowned if the path ends on the last row.
+
+    Parameters:
+    boards (np.ndarray): (N, 8, 8) boards.
+    moves (list): N paths, ie [(7, 0, 5, 2), (5, 2, 3, 4)].
+    players (np.ndarray): (N,) player making each move.
+
+    Returns:
+    np.ndarray: (N, 8, 8) new boards.
+    """
+    boards = np.array(boards).reshape(len(moves), 64)
+    if not moves:
+        return boards.reshape(0, 8, 8)
+    players = np.asarray(players)
+    games = np.arange(len(moves))
+    origins = np.array([path[0][0] * 8 + path[0][1] for path in moves])
+    final_rows = np.array([path[-1][2] for path in moves])
+    finals = final_rows * 8 + np.array([path[-1][3] for path in moves])
+    jumped = [(game, (hop[0] + hop[2]) // 2 * 8 + (hop[1] + hop[3]) // 2)
+              for game, path in enumerate(moves) for hop in path if abs(hop[2] - hop[0]) == 2]
+    chips = boards[games, origins]
+    crowned = ((players == 1) & (final_rows == 0)) | ((players == -1) & (final_rows == 7))
+    chips = np.where(crowned, 2 * players, chips)
+    boards[games, origins] = 0
+    if jumped:
+        jumped_games, jumped_tiles = zip(*jumped)
+        boards[list(jumped_games), list(jumped_tiles)] = 0
+    boards[games, finals] = chips  # last, a crowned chip can end a path on the tile it started from
+    return boards.reshape(len(moves), 8, 8)
+
+
+def flatten_boards(boards, players):
+    # (N, 33) boards shaped like CheckersTraining.filter_and_flatten_board, the player first
+    tiles = boards.reshape(len(boards), 64)[:, PLAYABLE_INDICES]
+    return np.column_stack([np.asarray(players), tiles])
+
+
+class LockstepGame:
+    """
+    State of one game of the batch, the fields GameBoard keeps for its single game.
+    The scores stay at 0 until the game ends, like on the game board, so the rewards during the game match.
+    """
+
+    def __init__(self):
+        self.player = random.choice([1, -1])
+        self.total_moves = 1  # initialize_board starts counting at 1
+        self.player1_score = 0
+        self.player2_score = 0
+        self.previous_boards = []
+        self.loop_counter = 0
+        self.plays = {1: [], -1: []}
+
+    def detect_loop(self, board_key, recent_boards_limit, loop_threshold):
+        # same rules as GameBoard.detect_loop
+        if board_key in self.previous_boards:
+            self.loop_counter += 1
+        else:
+            self.loop_counter = 0
+        self.previous_boards.append(board_key)
+        if len(self.previous_boards) > recent_boards_limit:
+            self.previous_boards.pop(0)
+        return self.loop_counter >= loop_threshold
+
+
+class LockstepSelfPlay:
+    def __init__(self, training=None, games=LOCKSTEP_GAMES):
+        """
+        Parameters:
+        training (CheckersTraining): Owns the monte carlo table, the neural networks, the counters and the saves.
+        games (int): Number of games advanced together.
+        """
+        self.training = training if training is not None else CheckersTraining()
+        self.games = games
+        self.boards = np.zeros((games, 8, 8), dtype=int)
+        self.slots = [None] * games  # LockstepGame of every slot, None when the slot is free
+        self.started_games = 0
+        self.max_games = None
+
+    def start_game(self, slot):
+        if not self.training.loop_run or (self.max_games and self.started_games >= self.max_games):
+            self.slots[slot] = None
+            return
+        self.boards[slot] = self.training.initialize_board()
+        self.slots[slot] = LockstepGame()
+        self.started_games += 1
+
+    def engine_for(self, game):
+        if RANDOM_FIRST_PLAYS > game.total_moves:
+            return Engines.RANDOM
+        return PLAYER_1_ENGINE if game.player == 1 else PLAYER_2_ENGINE
+
+    def score_candidates(self, engine, flat_boards):
+        """
+        Score of every (N, 33) candidate board for engine, higher is better.
+        """
+        training = self.training
+        if engine == Engines.NN:
+            return training.nn.predict_batch(flat_boards)
+        if engine == Engines.NN_NUMPY:
+            return training.numpy_nn.predict_batch(flat_boards)
+        scores = []
+        for state in encode_canonical_states(flat_boards):
+            found_key = training.find_monte_carlo_key(state)
+            scores.append(training.monte_carlo_scoring[found_key] if found_key is not None else 0)
+        return np.array(scores, dtype=float)
+
+    def choose_moves(self, boards, players, offsets, moves, live):
+        """
+        Index in moves of the move chosen for every live game, None for the games without moves.
+        The candidates of all the games using the same engine are scored together.
+        """
+        counts = np.diff(offsets)
+        chosen = [None] * len(live)
+        scored = dict()  # engine -> games (positions in live) it has to choose for
+        for i, slot in enumerate(live):
+            if not counts[i]:
+                continue
+            game = self.slots[slot]
+            game_moves = moves[offsets[i]:offsets[i + 1]]
+            if RANDOM_FIRST_PLAYS <= game.total_moves:
+                known_move = self.training.book_move(boards[i], game_moves, int(players[i]), game.total_moves)
+                if known_move is None:
+                    known_move = self.training.tablebase_move(boards[i], game_moves, int(players[i]), game.total_moves)
+                if known_move is not None:
+                    chosen[i] = offsets[i] + game_moves.index(known_move)
+                    continue
+            engine = self.engine_for(game)
+            if engine in (Engines.MC, Engines.NN, Engines.NN_NUMPY):
+                scored.setdefault(engine, []).append(i)
+            elif engine in (Engines.ALPHA_BETA, Engines.MCTS):
+                move = self.training.search_engine(engine).search(*board_to_bitboards(boards[i]), int(players[i]),
+                                                       self.training.move_limit - game.total_moves, game_moves)
+                chosen[i] = offsets[i] + game_moves.index(move)
+            else:
+                chosen[i] = offsets[i] + random.randrange(counts[i])
+        for engine, positions in scored.items():
+            candidates = [index for i in positions for index in range(offsets[i], offsets[i + 1])]
+            candidate_players = np.repeat(players[positions], counts[positions])
+            candidate_boards = apply_moves_batch(np.repeat(boards[positions], counts[positions], axis=0),
+                                                 [moves[index] for index in candidates], candidate_players)
+            scores = self.score_candidates(engine, flatten_boards(candidate_boards, candidate_players))
+            start = 0
+            for i in positions:
+                game_scores = scores[start:start + counts[i]]
+                best = np.flatnonzero(game_scores == game_scores.max())
+                chosen[i] = offsets[i] + int(random.choice(best))  # ties are broken at random
+                start += counts[i]
+        return chosen
+
+    def step(self):
+        """
+        Plays one ply on every live game.
+        """
+        live = [slot for slot, game in enumerate(self.slots) if game is not None]
+        boards = self.boards[live]
+        players = np.array([self.slots[slot].player for slot in live])
+        offsets, moves = generate_moves_batch(boards, players)
+        chosen = self.choose_moves(boards, players, offsets, moves, live)
+
+        playing = [i for i in range(len(live)) if chosen[i] is not None]
+        if playing:
+            self.apply_chosen_moves([live[i] for i in playing], boards[playing], players[playing], [moves[chosen[i]] for i in playing])
+        for i, slot in enumerate(live):
+            if chosen[i] is None:
+                self.finish_game(slot)  # no valid moves
+
+    def apply_chosen_moves(self, slots, boards, players, moves):
+        """
+        Plays the chosen moves in bulk, delivers the reward of every play and ends the games that are over.
+        """
+        training = self.training
+        new_boards = apply_moves_batch(boards, moves, players)
+        flat_boards = flatten_boards(new_boards, players)
+        player1, player2, kings = boards_to_bitboards_batch(new_boards)
+        board_keys = zip(player1.tolist(), player2.tolist(), kings.tolist())
+        for slot, new_board, flat_board_with_player, board_key in zip(slots, new_boards, flat_boards, board_keys):
+            game = self.slots[slot]
+            self.boards[slot] = new_board
+            flat_board_with_player = flat_board_with_player.reshape(1, -1)
+            game.plays[game.player].append(flat_board_with_player)
+            training.update_reward_monte_carlo_score(
+                flat_board_with_player,
+                training.score_reward(game.player, game.player1_score, game.player2_score, game.total_moves))
+            if game.detect_loop(board_key, training.recent_boards_limit, training.loop_threshold):
+                self.finish_game(slot)
+                continue
+            game.player = -game.player
+            game.total_moves += 1
+            if game.total_moves >= training.move_limit or training.tablebase_decides(new_board, game.player):
+                self.finish_game(slot)
+
+    def finish_game(self, slot):
+        """
+        Delivers the rewards of a finished game, counts it like play_game and starts a new game in its slot.
+        """
+        training = self.training
+        game = self.slots[slot]
+        game.player1_score, game.player2_score = training.get_scores(self.boards[slot])
+        if game.player1_score > game.player2_score:
+            training.player_1_win_count += 1
+        elif game.player1_score < game.player2_score:
+            training.player_2_win_count += 1
+        else:
+            training.tie_games += 1
+        for player in (1, -1):
+            reward = training.score_reward(player, game.player1_score, game.player2_score, game.total_moves)
+            for play in game.plays[player]:
+                training.update_reward_monte_carlo_score(play, reward)
+                if TRAINING:
+                    training.nn.train(np.array(play), np.array([reward]))
+        training.total_games += 1
+        training.checkpoint_periodically(training.total_games)
+        training.save_model_periodically(training.total_games)
+        if training.total_games % STOP_CHECK_INTERVAL == 0:
+            training.print_progress()
+            training.check_and_delete_stop_file()
+        self.start_game(slot)
+
+    def run(self, max_games=None):
+        """
+        Plays until stop.txt is found in the save directory (or max_games are played), then saves.
+        The games already started are finished before stopping.
+        """
+        training = self.training
+        training.load_status()
+        self.max_games = max_games
+        for slot in range(self.games):
+            self.start_game(slot)
+        print(f"Lockstep self play started with {self.games} games.")
+        try:
+            while any(game is not None for game in self.slots):
+                self.step()
+            print("Preparing to stop the application...")
+            training.loop_run = False
+            training.save_model_periodically(training.total_games)
+        finally:
+            training.shutdown_executor()
+
+
+if __name__ == "__main__":
+    LockstepSelfPlay().run()
@@ -0,0 +1,767 @@
+"""
+Binary, memory mapped persistence of the monte carlo table.
+
+Every entry holds the statistics of a state: the running mean of the rewards it got (the value the engines read)
+and how many rewards it got (visits), 8 bytes instead of a python float in a dict.
+
+File layout: a 64 bytes header (magic, entry count and bloom filter words), the keys sorted as 16 bytes big endian
+strings (so byte order is the same as the integer order), then the float32 means and the uint32 visits in the same order,
+then a blocked bloom filter of the keys (MONTE_CARLO_BLOOM_BITS per key, the hashes of a key fall in one 64 bytes block).
+Files written before the visits (MCSORTD1) are read with 1 visit per entry, files without a filter are always searched.
+Loading only maps the file, the pages are read by the OS the first time a lookup touches them,
+and the bloom filter answers most lookups of unknown states without touching the keys.
+
+The table is tiered: the entries changed since the last save are kept in RAM (the hot tier) up to
+MONTE_CARLO_HOT_ENTRIES, beyond it the least recently changed half is spilled to a sorted run file (same layout,
+a deleted entry has 0 visits). Lookups go through the changes, the runs from the newest and then the saved file,
+so the table runs in bounded memory and the runs are merged into the saved file by the next save.
+
+The saved table is partitioned by a hash of the keys into MONTE_CARLO_SHARDS shards, every shard is a table file
+of its own written by a worker process, and a json manifest lists them with their entry counts, crc32 checksums and
+the games played. A shard can be read, verified or rewritten without the others, a lookup only searches the shard
+of its key. With a single shard the table is saved as one file without a manifest.
+
+Between two saves the touched entries are appended to a delta log (a header and then key, value, visits, deleted
+records), replaying the logs over the last saved file recovers the table after a crash.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+from itertools import islice
+import numpy as np
+from SharedMonteCarloTable import MASK_64, mix_key
+from StateKeys import canonical_state_words
+from SimpleConfig import MONTE_CARLO_BLOOM_BITS, MONTE_CARLO_HOT_ENTRIES, MONTE_CARLO_MAX_RUNS, MONTE_CARLO_SHARD_WORKERS
+
+MAGIC = b'MCSORTD2'
+MAGIC_WITHOUT_VISITS = b'MCSORTD1'
+HEADER_SIZE = 64
+KEY_DTYPE = 'S16'
+VALUE_DTYPE = '<f4'
+VISITS_DTYPE = '<u4'
+LOG_MAGIC = b'MCDELTA2'
+LOG_MAGIC_WITHOUT_VISITS = b'MCDELTA1'
+LOG_DTYPE = np.dtype([('key', KEY_DTYPE), ('value', VALUE_DTYPE), ('visits', VISITS_DTYPE), ('deleted', 'u1')])
+LOG_DTYPE_WITHOUT_VISITS = np.dtype([('key', KEY_DTYPE), ('value', VALUE_DTYPE), ('deleted', 'u1')])
+BLOOM_BLOCK_WORDS = 8  # 512 bits, one cache line
+BLOOM_HASHES = 7  # bits of a key in its block, 9 bits of the second hash each
+BLOOM_CHUNK = 1 << 20  # keys hashed at once while building a filter
+SPILL_PREFIX = 'monte_carlo_spill_'
+MANIFEST_FORMAT = 'monte_carlo_shards_1'
+MANIFEST_EXTENSION = '.manifest'
+SHARD_SEED = 1  # mixed into the key hash, so the shard of a key does not pick its bloom filter block
+CHECKSUM_CHUNK = 1 << 24
+
+
+def keys_to_bytes(keys):
+    return np.array([key.to_bytes(16, 'big') for key in keys], dtype=KEY_DTYPE)
+
+
+def bytes_to_keys(keys_array):
+    words = np.ascontiguousarray(keys_array).view('>u8').reshape(-1, 2)
+    return [(high << 64) | low for high, low in zip(words[:, 0].tolist(), words[:, 1].tolist())]
+
+
+def mix_words(low, high):
+    # SharedMonteCarloTable.mix_key over uint64 arrays
+    h = low ^ (high * np.uint64(0x9E3779B97F4A7C15))
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def shard_of(key, count):
+    return mix_key(mix_key(key & MASK_64, key >> 64), SHARD_SEED) % count if count > 1 else 0
+
+
+def shard_of_arrays(keys_array, count):
+    # shard_of of every key of an S16 array
+    if count == 1:
+        return np.zeros(len(keys_array), dtype=np.intp)
+    words = np.ascontiguousarray(keys_array).view('>u8').reshape(-1, 2).astype(np.uint64)
+    return (mix_words(mix_words(words[:, 1], words[:, 0]), np.uint64(SHARD_SEED)) % np.uint64(count)).astype(np.intp)
+
+
+def build_bloom_filter(keys_array, bits_per_key=MONTE_CARLO_BLOOM_BITS):
+    """
+    Returns the uint64 words of the blocked bloom filter of the keys, empty when bits_per_key is 0.
+    """
+    bloom = empty_bloom_filter(len(keys_array), bits_per_key)
+    add_to_bloom_filter(bloom, keys_array)
+    return bloom
+
+
+def empty_bloom_filter(count, bits_per_key=MONTE_CARLO_BLOOM_BITS):
+    # words of a filter sized for count keys
+    if not bits_per_key:
+        return np.zeros(0, dtype='<u8')
+    blocks = max(1, -(-count * bits_per_key // (BLOOM_BLOCK_WORDS * 64)))
+    return np.zeros(blocks * BLOOM_BLOCK_WORDS, dtype='<u8')
+
+
+def add_to_bloom_filter(bloom, keys_array):
+    if not len(bloom):
+        return
+    blocks = len(bloom) // BLOOM_BLOCK_WORDS
+    shifts = np.uint64(9) * np.arange(BLOOM_HASHES, dtype=np.uint64)
+    for start in range(0, len(keys_array), BLOOM_CHUNK):
+        words = np.ascontiguousarray(keys_array[start:start + BLOOM_CHUNK]).view('>u8').reshape(-1, 2).astype(np.uint64)
+        h = mix_words(words[:, 1], words[:, 0])
+        g = mix_words(h, np.zeros_like(h))
+        bits = (g[:, None] >> shifts) & np.uint64(511)
+        positions = (h % np.uint64(blocks))[:, None] * np.uint64(BLOOM_BLOCK_WORDS) + (bits >> np.uint64(6))
+        np.bitwise_or.at(bloom, positions.ravel().astype(np.intp), (np.uint64(1) << (bits & np.uint64(63))).ravel())
+
+
+def bloom_may_contain(bloom, key):
+    """
+    False when key is surely not among the keys of the filter.
+    """
+    h = mix_key(key & MASK_64, key >> 64)
+    g = mix_key(h, 0)
+    start = (h % (len(bloom) // BLOOM_BLOCK_WORDS)) * BLOOM_BLOCK_WORDS
+    block = bloom[start:start + BLOOM_BLOCK_WORDS].tolist()
+    for i in range(BLOOM_HASHES):
+        bit = (g >> (9 * i)) & 511
+        if not (block[bit >> 6] >> (bit & 63)) & 1:
+            return False
+    return True
+
+
+def write_sorted_arrays(path, keys_array, values_array, visits_array, bloom_bits=MONTE_CARLO_BLOOM_BITS):
+    # returns the crc32 of the file
+    order = np.argsort(keys_array, kind='stable')
+    keys_array = keys_array[order]
+    bloom = build_bloom_filter(keys_array, bloom_bits)
+    header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+    header[:8] = np.frombuffer(MAGIC, dtype=np.uint8)
+    header[8:24] = np.array([len(keys_array), len(bloom)], dtype='<u8').view(np.uint8)
+    checksum = 0
+    with open(path, 'wb') as f:
+        for array in (header, keys_array, values_array[order].astype(VALUE_DTYPE),
+                      visits_array[order].astype(VISITS_DTYPE), bloom):
+            data = np.ascontiguousarray(array).tobytes()
+            checksum = zlib.crc32(data, checksum)
+            f.write(data)
+    return checksum
+
+
+def write_sorted_chunks(path, chunks, capacity, bloom_bits=MONTE_CARLO_BLOOM_BITS):
+    """
+    Writes a table file from (keys, values, visits) chunks given in increasing key order, without holding them together.
+    capacity is an upper bound of the entries, it sizes the bloom filter. Returns the entries written.
+    """
+    bloom = empty_bloom_filter(capacity, bloom_bits)
+    count = 0
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, 'w+b') as f, tempfile.TemporaryFile(dir=directory) as values_file, \
+            tempfile.TemporaryFile(dir=directory) as visits_file:
+        f.write(bytes(HEADER_SIZE))
+        for keys_array, values_array, visits_array in chunks:
+            f.write(np.ascontiguousarray(keys_array).tobytes())
+            values_file.write(values_array.astype(VALUE_DTYPE).tobytes())
+            visits_file.write(visits_array.astype(VISITS_DTYPE).tobytes())
+            add_to_bloom_filter(bloom, keys_array)
+            count += len(keys_array)
+        for side_file in (values_file, visits_file):
+            side_file.seek(0)
+            shutil.copyfileobj(side_file, f, CHECKSUM_CHUNK)
+        f.write(bloom.tobytes())
+        header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+        header[:8] = np.frombuffer(MAGIC, dtype=np.uint8)
+        header[8:24] = np.array([count, len(bloom)], dtype='<u8').view(np.uint8)
+        f.seek(0)
+        f.write(header.tobytes())
+    return count
+
+
+def file_checksum(path):
+    checksum = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b''):
+            checksum = zlib.crc32(chunk, checksum)
+    return checksum
+
+
+def write_monte_carlo_file(path, items):
+    """
+    Writes any (key, mean, visits) iterable, ie stats_items(), in the binary format.
+    """
+    keys, values, visits = [], [], []
+    for key, value, key_visits in items:
+        keys.append(key)
+        values.append(value)
+        visits.append(key_visits)
+    write_sorted_arrays(path, keys_to_bytes(keys), np.array(values, dtype=VALUE_DTYPE), np.array(visits, dtype=VISITS_DTYPE))
+
+
+def canonical_key_arrays(keys_array, values_array, visits_array):
+    """
+    Replaces every key by its canonical key (StateKeys.canonical_state_key), a state stored under both forms
+    is merged into one entry with the mean of the rewards of both and the sum of their visits.
+
+    Returns:
+    tuple: (keys, values, visits) arrays, one entry per canonical key.
+    """
+    if not len(keys_array):
+        return keys_array, values_array, visits_array
+    words = np.ascontiguousarray(keys_array).view('>u8').reshape(-1, 2).astype(np.uint64)
+    low, high = canonical_state_words(words[:, 1], words[:, 0])
+    canonical = np.ascontiguousarray(np.column_stack([high, low]).astype('>u8')).view(KEY_DTYPE).ravel()
+    return combine_stats(canonical, values_array, visits_array)
+
+
+def combine_stats(keys_array, values_array, visits_array):
+    """
+    Merges the entries of the same key: the mean of their rewards weighted by the visits, and the sum of the visits.
+
+    Returns:
+    tuple: (keys, values, visits) arrays sorted by key, one entry per key.
+    """
+    keys_array, inverse = np.unique(keys_array, return_inverse=True)
+    inverse = inverse.ravel()
+    visits = np.bincount(inverse, weights=visits_array.astype(np.float64))
+    sums = np.bincount(inverse, weights=values_array.astype(np.float64) * visits_array)
+    return keys_array, (sums / visits).astype(VALUE_DTYPE), visits.astype(VISITS_DTYPE)
+
+
+def map_monte_carlo_file(path):
+    """
+    Returns the (keys, values, visits, bloom filter) arrays of a file, memory mapped read only.
+    The bloom filter is None when the file has none.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if header[:8] not in (MAGIC, MAGIC_WITHOUT_VISITS):
+        raise ValueError(f"{path} is not a monte carlo file.")
+    count, bloom_words = (int(value) for value in np.frombuffer(header[8:24], dtype='<u8'))
+    if count == 0:
+        return empty_layer()
+    keys_array = np.memmap(path, dtype=KEY_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+    values_array = np.memmap(path, dtype=VALUE_DTYPE, mode='r', offset=HEADER_SIZE + 16 * count, shape=(count,))
+    if header[:8] == MAGIC_WITHOUT_VISITS:
+        return keys_array, values_array, np.broadcast_to(np.ones(1, dtype=VISITS_DTYPE), (count,)), None
+    visits_array = np.memmap(path, dtype=VISITS_DTYPE, mode='r', offset=HEADER_SIZE + 20 * count, shape=(count,))
+    bloom = None
+    if bloom_words:
+        bloom = np.memmap(path, dtype='<u8', mode='r', offset=HEADER_SIZE + 24 * count, shape=(bloom_words,))
+    return keys_array, values_array, visits_array, bloom
+
+
+def empty_layer():
+    return np.zeros(0, dtype=KEY_DTYPE), np.zeros(0, dtype=VALUE_DTYPE), np.zeros(0, dtype=VISITS_DTYPE), None
+
+
+def merge_layers(layers, keep_deleted=False):
+    """
+    Merges (keys, values, visits) layers given oldest first, the newest entry of a key wins.
+
+    Returns:
+    tuple: (keys, values, visits) arrays sorted by key, without the deleted entries (0 visits) unless keep_deleted.
+    """
+    newest_first = list(layers[::-1]) + [empty_layer()]
+    keys_array, first = np.unique(np.concatenate([layer[0] for layer in newest_first]), return_index=True)
+    values_array = np.concatenate([layer[1] for layer in newest_first])[first]
+    visits_array = np.concatenate([layer[2] for layer in newest_first])[first]
+    if not keep_deleted:
+        kept = visits_array > 0
+        keys_array, values_array, visits_array = keys_array[kept], values_array[kept], visits_array[kept]
+    return keys_array, values_array, visits_array
+
+
+def layer_shard(layer, index, count):
+    # (keys, values, visits) of the entries of a layer in shard index
+    keys_array, values_array, visits_array = layer[:3]
+    if count == 1:
+        return keys_array, values_array, visits_array
+    kept = shard_of_arrays(keys_array, count) == index
+    return keys_array[kept], values_array[kept], visits_array[kept]
+
+
+def shard_path(path, index):
+    return f"{os.path.splitext(path)[0]}.shard{index}.bin"
+
+
+def save_shard(task):
+    """
+    Writes one shard of a table, run by the worker processes of MappedMonteCarloTable.save.
+
+    Parameters:
+    task (tuple): (path, index, count, base_paths, run_paths, changes), base_paths are the files of the saved table
+    (only the one of the shard is read when it has count shards), run_paths the spilled runs, oldest first,
+    and changes the (keys, values, visits) arrays of the hot entries of the shard.
+
+    Returns:
+    tuple: (entries, crc32) of the shard file.
+    """
+    path, index, count, base_paths, run_paths, changes = task
+    if len(base_paths) == count:
+        base_paths = base_paths[index:index + 1]
+    layers = [layer_shard(map_monte_carlo_file(layer_path), index, count) for layer_path in base_paths + run_paths]
+    keys_array, values_array, visits_array = merge_layers(layers + [changes])
+    return len(keys_array), write_sorted_arrays(path, keys_array, values_array, visits_array)
+
+
+def verify_shard(shard):
+    # shard is a (path, crc32) pair
+    path, checksum = shard
+    return os.path.exists(path) and file_checksum(path) == checksum
+
+
+def run_workers(function, tasks, workers=MONTE_CARLO_SHARD_WORKERS):
+    """
+    Returns function applied to every task, in a pool of worker processes (0 workers is one per core).
+    """
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        return [function(task) for task in tasks]
+    with multiprocessing.get_context().Pool(workers) as pool:
+        return pool.map(function, tasks)
+
+
+def write_manifest(path, shard_paths, results, total_games):
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'total_games': total_games,
+        'shards': [{'file': os.path.basename(shard), 'entries': entries, 'crc32': checksum}
+                   for shard, (entries, checksum) in zip(shard_paths, results)]
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def read_manifest(path):
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError(f"{path} is not a monte carlo manifest.")
+    return manifest
+
+
+def table_files(path):
+    """
+    Returns the files of a saved table: the shards listed by its manifest, or the table file itself.
+    """
+    with open(path, 'rb') as f:
+        if f.read(8) in (MAGIC, MAGIC_WITHOUT_VISITS):
+            return [path]
+    directory = os.path.dirname(path)
+    return [os.path.join(directory, shard['file']) for shard in read_manifest(path)['shards']]
+
+
+def verify_manifest(path, workers=MONTE_CARLO_SHARD_WORKERS):
+    """
+    Returns the shard files of a manifest that are missing or do not match their checksum, each shard is read by a worker.
+    """
+    shards = list(zip(table_files(path), [shard['crc32'] for shard in read_manifest(path)['shards']]))
+    return [shard for (shard, _), valid in zip(shards, run_workers(verify_shard, shards, workers)) if not valid]
+
+
+def create_log_file(path):
+    header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+    header[:8] = np.frombuffer(LOG_MAGIC, dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+
+
+def append_log_records(path, items):
+    """
+    Appends (key, (mean, visits)) records to a delta log, statistics of None record a deletion.
+    The records are on disk when it returns.
+    """
+    keys, stats = [], []
+    for key, key_stats in items:
+        keys.append(key)
+        stats.append(key_stats)
+    records = np.zeros(len(keys), dtype=LOG_DTYPE)
+    records['key'] = keys_to_bytes(keys)
+    records['value'] = [0 if key_stats is None else key_stats[0] for key_stats in stats]
+    records['visits'] = [0 if key_stats is None else key_stats[1] for key_stats in stats]
+    records['deleted'] = [key_stats is None for key_stats in stats]
+    with open(path, 'ab') as f:
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_log_file(path):
+    """
+    Returns the LOG_DTYPE records of a delta log, a record cut by a crash at the end of the file is ignored.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        if header[:8] not in (LOG_MAGIC, LOG_MAGIC_WITHOUT_VISITS):
+            raise ValueError(f"{path} is not a monte carlo delta log.")
+        data = f.read()
+    dtype = LOG_DTYPE if header[:8] == LOG_MAGIC else LOG_DTYPE_WITHOUT_VISITS
+    stored = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+    if dtype == LOG_DTYPE:
+        return stored
+    records = np.zeros(len(stored), dtype=LOG_DTYPE)
+    for field in ('key', 'value', 'deleted'):
+        records[field] = stored[field]
+    records['visits'] = 1
+    return records
+
+
+class MappedMonteCarloTable:
+    """
+    Dict like monte carlo table over a mapped file (the base) plus the changes made since it was written.
+    Reading a key gives the mean reward of the state, add_reward updates it with the visits.
+    The changes hold (mean, visits) tuples, deleted base entries are kept in changes as None until the next save.
+    Changes beyond hot_entries are spilled to runs, see the module docstring.
+    The keys set since the last checkpoint are appended to the delta log at log_path by checkpoint.
+    """
+
+    def __init__(self, path=None, hot_entries=MONTE_CARLO_HOT_ENTRIES, spill_directory=None, shards=1,
+                 workers=MONTE_CARLO_SHARD_WORKERS, verify=False):
+        """
+        Parameters:
+        path (str): Saved table (a table file or a manifest) mapped as the base, an empty table without it.
+        hot_entries (int): Changes kept in RAM, 0 keeps all of them.
+        spill_directory (str): Directory of the run files, the temporary directory by default.
+        shards (int): Shards written by save, 1 writes a single file.
+        workers (int): Processes writing or verifying the shards, 0 is one per core.
+        verify (bool): Checks the checksums of the shards of the manifest, raises ValueError when one does not match.
+        """
+        self.bases = []  # saved shards, the shard of a key is shard_of(key, len(bases))
+        self.base_paths = []
+        self.runs = []  # spilled changes, mapped like the base, oldest first
+        self.run_paths = []
+        self.changes = dict()  # in the order they were last changed
+        self.hot_entries = hot_entries
+        self.spill_directory = spill_directory
+        self.saving = False  # runs are not compacted while a save reads them
+        self.shards = shards
+        self.workers = workers
+        self.size = 0
+        self.dirty = set()  # keys changed since the last checkpoint
+        self.log_path = None  # delta log, no checkpoints are written without it
+        self.lock = threading.Lock()  # writers, checkpoints and save, reads do not lock
+        if path:
+            files = table_files(path)
+            if verify and files != [path]:
+                corrupted = verify_manifest(path, workers)
+                if corrupted:
+                    raise ValueError(f"Monte carlo shards not matching {path}: {', '.join(corrupted)}")
+            self.map_bases(files)
+
+    def map_bases(self, paths):
+        # the caller holds the lock or owns the table
+        self.base_paths = paths
+        self.bases = [map_monte_carlo_file(path) for path in paths]
+        self.size = sum(len(base[0]) for base in self.bases)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        # copies sent to other processes never write the log
+        state['dirty'] = set()
+        state['log_path'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def layer_index(self, key, layer):
+        # index of key in the base or a run, -1 when it is not there
+        keys_array, _, _, bloom = layer
+        if not len(keys_array) or (bloom is not None and not bloom_may_contain(bloom, key)):
+            return -1
+        packed = key.to_bytes(16, 'big')
+        index = int(np.searchsorted(keys_array, packed))
+        # numpy drops the trailing zero bytes of the stored strings
+        if index < len(keys_array) and keys_array[index] == packed.rstrip(b'\x00'):
+            return index
+        return -1
+
+    def __contains__(self, key):
+        return self.stats(key) is not None
+
+    def stats(self, key):
+        """
+        Returns the (mean, visits) of key, None when it is not in the table.
+        """
+        if key in self.changes:
+            return self.changes[key]
+        layers = self.runs[::-1]
+        if self.bases:
+            layers.append(self.bases[shard_of(key, len(self.bases))])
+        for layer in layers:
+            index = self.layer_index(key, layer)
+            if index != -1:
+                visits = int(layer[2][index])
+                return (float(layer[1][index]), visits) if visits else None
+        return None
+
+    def __getitem__(self, key):
+        key_stats = self.stats(key)
+        if key_stats is None:
+            raise KeyError(f'Key {key} not found')
+        return key_stats[0]
+
+    def visits(self, key):
+        key_stats = self.stats(key)
+        return 0 if key_stats is None else key_stats[1]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def store(self, key, key_stats):
+        # the caller holds the lock, statistics of None delete the key if it is there
+        exists = key in self
+        if key_stats is None:
+            if exists:
+                self.changes.pop(key, None)
+                self.changes[key] = None
+                self.size -= 1
+            return
+        if not exists:
+            self.size += 1
+        self.changes.pop(key, None)  # moved to the end, the most recently changed
+        self.changes[key] = key_stats
+        if self.hot_entries and len(self.changes) > self.hot_entries:
+            self.spill()
+
+    def __setitem__(self, key, value):
+        # a value set directly counts as a single visit
+        with self.lock:
+            self.store(key, (float(value), 1))
+            self.dirty.add(key)
+
+    def add_reward(self, key, reward):
+        """
+        Adds a reward to the running mean of key, a new key starts with it.
+        """
+        with self.lock:
+            mean, visits = self.stats(key) or (0.0, 0)
+            visits += 1
+            self.store(key, (mean + (reward - mean) / visits, visits))
+            self.dirty.add(key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(f'Key {key} not found')
+            self.store(key, None)
+            self.dirty.add(key)
+
+    def update(self, items):
+        for key, value in items:
+            self[key] = value
+
+    def update_stats(self, items):
+        # (key, mean, visits) items, ie stats_items() of another table
+        with self.lock:
+            for key, mean, visits in items:
+                self.store(key, (mean, visits))
+                self.dirty.add(key)
+
+    def __len__(self):
+        return self.size
+
+    def spill(self):
+        """
+        Writes the least recently changed half of the changes to a new run and drops them from memory.
+        The caller holds the lock.
+        """
+        keys = list(islice(self.changes, len(self.changes) // 2))
+        stats = [self.changes[key] or (0, 0) for key in keys]  # a deleted entry has 0 visits
+        self.runs.append(self.write_run(keys_to_bytes(keys), np.array([mean for mean, _ in stats], dtype=VALUE_DTYPE),
+                                        np.array([visits for _, visits in stats], dtype=VISITS_DTYPE)))
+        for key in keys:
+            del self.changes[key]
+        if len(self.runs) > MONTE_CARLO_MAX_RUNS and not self.saving:
+            self.compact_runs()
+
+    def write_run(self, keys_array, values_array, visits_array):
+        handle, path = tempfile.mkstemp(prefix=SPILL_PREFIX, suffix='.run', dir=self.spill_directory)
+        os.close(handle)
+        write_sorted_arrays(path, keys_array, values_array, visits_array)
+        self.run_paths.append(path)
+        return map_monte_carlo_file(path)
+
+    def compact_runs(self):
+        # merges the runs into one, the newest entry of a key wins, the caller holds the lock
+        merged = merge_layers(self.runs, keep_deleted=True)
+        old_paths = self.run_paths
+        self.run_paths = []
+        self.runs = [self.write_run(*merged)]
+        self.remove_run_files(old_paths)
+
+    @staticmethod
+    def remove_run_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # still mapped (windows), left in the spill directory
+
+    def visible_layers(self, bases, runs, changes):
+        """
+        Yields the (keys, values, visits) arrays of the entries of every run (newest first) and base shard
+        not overridden by a newer run or the changes, without the deleted entries.
+        """
+        newer = keys_to_bytes(changes.keys())
+        for position, (keys_array, values_array, visits_array, _) in enumerate(runs[::-1] + bases):
+            keep = visits_array > 0
+            if len(newer) and len(keys_array):
+                keep &= ~np.isin(keys_array, newer)
+            yield keys_array[keep], values_array[keep], visits_array[keep]
+            if position < len(runs):
+                newer = np.concatenate([newer, keys_array])
+
+    def stats_items(self):
+        # (key, mean, visits) of every entry
+        bases, runs, changes = list(self.bases), list(self.runs), dict(self.changes)
+        for keys_array, values_array, visits_array in self.visible_layers(bases, runs, changes):
+            yield from zip(bytes_to_keys(keys_array), values_array.tolist(), visits_array.tolist())
+        for key, key_stats in changes.items():
+            if key_stats is not None:
+                yield key, key_stats[0], key_stats[1]
+
+    def items(self):
+        for key, mean, _ in self.stats_items():
+            yield key, mean
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def remove_zero_values(self):
+        """
+        Deletes every entry with a value of 0, returns how many were deleted.
+        """
+        bases, runs, changes = list(self.bases), list(self.runs), dict(self.changes)
+        zero_keys = []
+        for keys_array, values_array, _ in self.visible_layers(bases, runs, changes):
+            zero_keys += bytes_to_keys(keys_array[values_array == 0])
+        zero_keys += [key for key, key_stats in changes.items() if key_stats is not None and key_stats[0] == 0]
+        for key in zero_keys:
+            del self[key]
+        return len(zero_keys)
+
+    def checkpoint(self):
+        """
+        Appends the entries changed since the last checkpoint to the delta log, returns how many were written.
+        The cost only depends on the changes, not on the size of the table.
+        """
+        with self.lock:
+            return self.append_dirty()
+
+    def append_dirty(self):
+        # the caller holds the lock
+        if self.log_path is None or not self.dirty:
+            return 0
+        count = len(self.dirty)
+        append_log_records(self.log_path, ((key, self.stats(key)) for key in self.dirty))
+        self.dirty = set()
+        return count
+
+    def start_log(self, path):
+        """
+        Checkpoints into the current delta log and continues writing the checkpoints to a new log at path.
+        """
+        with self.lock:
+            self.append_dirty()
+            create_log_file(path)
+            self.log_path = path
+
+    def replay_log(self, path):
+        """
+        Applies the records of a delta log, returns how many were applied.
+        The replayed entries are not checkpointed again, they are already in that log.
+        """
+        records = read_log_file(path)
+        keys = bytes_to_keys(records['key'])
+        with self.lock:
+            for key, value, visits, deleted in zip(keys, records['value'].tolist(), records['visits'].tolist(),
+                                                   records['deleted'].tolist()):
+                self.store(key, None if deleted else (value, visits))
+        return len(keys)
+
+    def save(self, path, total_games=0):
+        """
+        Writes the table to path (the manifest when it has several shards, total_games is recorded in it) and maps it
+        as the new base, the changes and runs written are dropped. Every shard is written by a worker process.
+        Safe to call from the save thread while the game keeps updating the table.
+        """
+        with self.lock:
+            base_paths, run_paths, changes = list(self.base_paths), list(self.run_paths), dict(self.changes)
+            saved_runs = len(self.runs)
+            self.saving = True
+        try:
+            shard_paths = self.write_shards(path, base_paths, run_paths, self.changes_arrays(changes), total_games)
+            new_bases = [map_monte_carlo_file(shard) for shard in shard_paths]
+        finally:
+            with self.lock:
+                self.saving = False
+        with self.lock:
+            self.bases, self.base_paths = new_bases, shard_paths
+            # runs spilled during the save hold entries at least as new as the saved ones
+            self.runs = self.runs[saved_runs:]
+            saved_paths, self.run_paths = self.run_paths[:saved_runs], self.run_paths[saved_runs:]
+            for key, value in changes.items():
+                if key in self.changes and self.changes[key] is value:
+                    del self.changes[key]
+        self.remove_run_files(saved_paths)
+
+    def write_shards(self, path, base_paths, run_paths, changes, total_games):
+        """
+        Writes the base files and runs merged with the changes arrays as self.shards shard files,
+        returns their paths. The manifest is written last, after every shard is complete.
+        """
+        count = self.shards
+        shard_paths = [path] if count == 1 else [shard_path(path, index) for index in range(count)]
+        change_shards = shard_of_arrays(changes[0], count)
+        tasks = [(shard_paths[index], index, count, base_paths, run_paths,
+                  tuple(array[change_shards == index] for array in changes)) for index in range(count)]
+        results = run_workers(save_shard, tasks, self.workers)
+        if count > 1:
+            write_manifest(path, shard_paths, results, total_games)
+        return shard_paths
+
+    @staticmethod
+    def changes_arrays(changes):
+        # (keys, values, visits) arrays of the changes, a deleted entry has 0 visits like in the runs
+        stats = [key_stats or (0, 0) for key_stats in changes.values()]
+        return (keys_to_bytes(changes.keys()), np.array([mean for mean, _ in stats], dtype=VALUE_DTYPE),
+                np.array([visits for _, visits in stats], dtype=VISITS_DTYPE))
+
+    def merged_arrays(self, bases, runs, changes):
+        # (keys, values, visits) arrays of the base and runs with the changes applied
+        visible = list(self.visible_layers(bases, runs, changes))
+        new_keys = [key for key, key_stats in changes.items() if key_stats is not None]
+        keys_array = np.concatenate([keys for keys, _, _ in visible] + [keys_to_bytes(new_keys)])
+        values_array = np.concatenate([values for _, values, _ in visible] +
+                                      [np.array([changes[key][0] for key in new_keys], dtype=VALUE_DTYPE)])
+        visits_array = np.concatenate([visits for _, _, visits in visible] +
+                                      [np.array([changes[key][1] for key in new_keys], dtype=VISITS_DTYPE)])
+        return keys_array, values_array, visits_array
+
+    def canonicalize(self, path, total_games=0):
+        """
+        Migrates the table to canonical keys: saves it to path with the mirrored duplicates merged and maps it as the new base.
+        Returns how many entries were merged. The game must not be updating the table meanwhile.
+        """
+        with self.lock:
+            canonical = canonical_key_arrays(*self.merged_arrays(self.bases, self.runs, self.changes))
+            merged = self.size - len(canonical[0])
+            self.map_bases(self.write_shards(path, [], [], canonical, total_games))
+            self.remove_run_files(self.run_paths)
+            self.runs, self.run_paths = [], []
+            self.changes = dict()
+            self.dirty = set()
+            return merged
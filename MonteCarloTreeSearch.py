@@ -0,0 +1,272 @@
+"""
+Monte Carlo tree search with UCT, used by Engines.MCTS.
+
+The tree lives in a node pool of preallocated numpy arrays, a node is an index and the children of a node
+are a contiguous block of the pool, so there are no per node python objects and the memory is bounded by
+MCTS_POOL_SIZE. When the pool is full the search keeps running without expanding new nodes.
+After a move the subtree of the new position is kept: it is copied to the front of the pool and
+the rest of the nodes are dropped.
+
+Playouts use the bitboard generator behind CheckersRulesGame.generate_valid_moves, the moves are random
+or chosen by the neural network (MCTS_PLAYOUTS). A game ends like CheckersTraining.play_game: without moves or
+at the move limit, won by the best score of get_scores.
+"""
+import math
+import random
+import time
+import numpy as np
+from AlphaBetaSearch import flat_board_with_player, score_difference
+from BitBoard import generate_moves_from_bitboards, play_path_on_bitboards
+from Enumerators import Playouts
+from SimpleConfig import MCTS_EXPLORATION, MCTS_POOL_SIZE, MCTS_ROLLOUTS, MCTS_TIME_BUDGET
+
+
+def game_result(player1, player2, kings):
+    # 1 when player 1 wins, 0 when player -1 wins, 0.5 on a tie
+    difference = score_difference(player1, player2, kings, 1)
+    return 1.0 if difference > 0 else 0.0 if difference < 0 else 0.5
+
+
+class NodePool:
+    """
+    Arrays holding the nodes of the tree, node i is the i-th element of every array.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.player1 = np.zeros(size, dtype=np.int64)
+        self.player2 = np.zeros(size, dtype=np.int64)
+        self.kings = np.zeros(size, dtype=np.int64)
+        self.to_move = np.zeros(size, dtype=np.int8)  # player to move on the node
+        self.moves_left = np.zeros(size, dtype=np.int16)
+        self.parent = np.full(size, -1, dtype=np.int32)
+        self.first_child = np.full(size, -1, dtype=np.int32)  # -1 until expanded
+        self.child_count = np.zeros(size, dtype=np.int32)
+        self.visits = np.zeros(size, dtype=np.float64)
+        self.wins = np.zeros(size, dtype=np.float64)  # for the player that moved into the node
+        self.used = 0
+
+    def new_node(self, player1, player2, kings, to_move, moves_left, parent):
+        node = self.used
+        self.used += 1
+        self.player1[node], self.player2[node], self.kings[node] = player1, player2, kings
+        self.to_move[node] = to_move
+        self.moves_left[node] = moves_left
+        self.parent[node] = parent
+        self.first_child[node] = -1
+        self.child_count[node] = 0
+        self.visits[node] = 0
+        self.wins[node] = 0
+        return node
+
+    def keep_subtree(self, root):
+        """
+        Moves the subtree of root to the front of the pool (root becomes node 0), the other nodes are freed.
+        The children of a node stay contiguous since they are copied in breadth first order.
+        """
+        order = [root]
+        for node in order:
+            first = int(self.first_child[node])
+            if first != -1:
+                order.extend(range(first, first + int(self.child_count[node])))
+        order = np.array(order)
+        new_index = np.full(self.size, -1, dtype=np.int32)
+        new_index[order] = np.arange(len(order), dtype=np.int32)
+        for array in (self.player1, self.player2, self.kings, self.to_move, self.moves_left, self.child_count,
+                      self.visits, self.wins):
+            array[:len(order)] = array[order]
+        first_child = self.first_child[order]
+        self.first_child[:len(order)] = np.where(first_child == -1, -1, new_index[first_child])
+        parent = self.parent[order]
+        self.parent[:len(order)] = np.where(parent == -1, -1, new_index[parent])
+        self.parent[0] = -1
+        self.used = len(order)
+
+
+class MonteCarloTreeSearch:
+    def __init__(self, rollouts=MCTS_ROLLOUTS, time_budget=MCTS_TIME_BUDGET, pool_size=MCTS_POOL_SIZE,
+                 exploration=MCTS_EXPLORATION, playouts=Playouts.RANDOM, network=None):
+        """
+        Parameters:
+        rollouts (int): Playouts per move, 0 to only use the time budget.
+        time_budget (float): Seconds per move, 0 to only use the rollouts.
+        pool_size (int): Nodes of the pool.
+        exploration (float): UCT exploration constant.
+        playouts (Playouts): How the playout moves are chosen.
+        network (object): predict_batch of (N, 33) boards, used by Playouts.NN.
+        """
+        if not rollouts and not time_budget:
+            raise ValueError("MCTS needs a number of rollouts or a time budget.")
+        self.rollouts = rollouts
+        self.time_budget = time_budget
+        self.pool = NodePool(pool_size)
+        self.exploration = exploration
+        self.playouts = playouts
+        self.network = network
+        self.root = -1
+        self.reused_visits = 0  # visits the root had from previous searches
+
+    def find_root(self, player1, player2, kings, player):
+        """
+        Looks for the position among the root, its children and grandchildren of the previous search.
+        """
+        pool = self.pool
+        if self.root == -1:
+            return -1
+        candidates = level = [self.root]
+        for _ in range(2):
+            children = []
+            for node in level:
+                first = int(pool.first_child[node])
+                if first != -1:
+                    children.extend(range(first, first + int(pool.child_count[node])))
+            candidates = candidates + children
+            level = children
+        for node in candidates:
+            if (int(pool.player1[node]), int(pool.player2[node]), int(pool.kings[node]), int(pool.to_move[node])) ==\
+                    (player1, player2, kings, player):
+                return node
+        return -1
+
+    def search(self, player1, player2, kings, player, moves_left, root_moves=None):
+        """
+        Returns the most visited move of player, one of root_moves (generated when not given).
+
+        Parameters:
+        moves_left (int): Plies left before the move limit ends the game.
+        """
+        if root_moves is None:
+            root_moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if len(root_moves) == 1:
+            return root_moves[0]
+        pool = self.pool
+        root = self.find_root(player1, player2, kings, player)
+        if root == -1:
+            pool.used = 0
+            root = pool.new_node(player1, player2, kings, player, moves_left, -1)
+        else:
+            pool.keep_subtree(root)
+            root = 0
+            pool.moves_left[root] = moves_left
+        if pool.first_child[root] == -1 and not self.expand(root, root_moves):
+            # the kept subtree filled the pool, the search starts over
+            pool.used = 0
+            root = pool.new_node(player1, player2, kings, player, moves_left, -1)
+            self.expand(root, root_moves)
+        self.root = root
+        self.reused_visits = int(pool.visits[root])
+
+        self.run_rollouts(root)
+        return root_moves[int(np.argmax(self.root_visits()))]
+
+    def run_rollouts(self, root):
+        deadline = time.perf_counter() + self.time_budget if self.time_budget else math.inf
+        rollouts = 0
+        while (not self.rollouts or rollouts < self.rollouts) and time.perf_counter() < deadline:
+            self.iterate(root)
+            rollouts += 1
+
+    def root_visits(self):
+        # visits of the children of the root, in the order of the root moves
+        pool = self.pool
+        first = int(pool.first_child[self.root])
+        return pool.visits[first:first + int(pool.child_count[self.root])].copy()
+
+    def close(self):
+        pass  # nothing runs outside this process
+
+    def expand(self, node, moves=None):
+        """
+        Adds the children of node, returns False when it has no moves or the pool has no room for them.
+        """
+        pool = self.pool
+        player1, player2, kings = int(pool.player1[node]), int(pool.player2[node]), int(pool.kings[node])
+        player = int(pool.to_move[node])
+        if pool.moves_left[node] <= 0:
+            return False
+        if moves is None:
+            moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if not moves or pool.used + len(moves) > pool.size:
+            return False
+        pool.first_child[node] = pool.used
+        pool.child_count[node] = len(moves)
+        for move in moves:
+            pool.new_node(*play_path_on_bitboards(player1, player2, kings, move, player), -player,
+                          pool.moves_left[node] - 1, node)
+        return True
+
+    def select_child(self, node):
+        # UCT, the unvisited children first
+        pool = self.pool
+        first = int(pool.first_child[node])
+        count = int(pool.child_count[node])
+        visits = pool.visits[first:first + count]
+        unvisited = np.flatnonzero(visits == 0)
+        if len(unvisited):
+            return first + int(random.choice(unvisited))
+        uct = pool.wins[first:first + count] / visits + self.exploration * np.sqrt(math.log(pool.visits[node]) / visits)
+        return first + int(np.argmax(uct))
+
+    def select_leaf(self, root, virtual_loss=False):
+        """
+        Walks down the tree with UCT and expands the leaf reached if it was already visited.
+        With virtual_loss the path is counted as visited (and lost) so the next selections spread over
+        other leaves, backpropagate removes it.
+        """
+        pool = self.pool
+        node = root
+        while pool.first_child[node] != -1:
+            if virtual_loss:
+                pool.visits[node] += 1
+            node = self.select_child(node)
+        if pool.visits[node] > 0 and self.expand(node):
+            if virtual_loss:
+                pool.visits[node] += 1
+            node = self.select_child(node)
+        if virtual_loss:
+            pool.visits[node] += 1
+        return node
+
+    def backpropagate(self, node, result, virtual_loss=False):
+        # result from player 1, see game_result
+        pool = self.pool
+        while node != -1:
+            if not virtual_loss:
+                pool.visits[node] += 1
+            pool.wins[node] += result if pool.to_move[node] == -1 else 1 - result
+            node = int(pool.parent[node])
+
+    def iterate(self, root):
+        node = self.select_leaf(root)
+        self.backpropagate(node, self.playout(node))
+
+    def playout(self, node):
+        pool = self.pool
+        return play_out(int(pool.player1[node]), int(pool.player2[node]), int(pool.kings[node]),
+                        int(pool.to_move[node]), int(pool.moves_left[node]),
+                        self.network if self.playouts == Playouts.NN else None)
+
+
+def play_out(player1, player2, kings, player, moves_left, network=None):
+    """
+    Plays the game to the end with random moves (or the moves network scores best), returns game_result.
+    """
+    while moves_left > 0:
+        moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if not moves:
+            break
+        if network is not None and len(moves) > 1:
+            move = network_move(network, player1, player2, kings, player, moves)
+        else:
+            move = random.choice(moves)
+        player1, player2, kings = play_path_on_bitboards(player1, player2, kings, move, player)
+        player = -player
+        moves_left -= 1
+    return game_result(player1, player2, kings)
+
+
+def network_move(network, player1, player2, kings, player, moves):
+    # the candidate the network scores best for the player moving, like have_nn_select_moves
+    candidates = [flat_board_with_player(*play_path_on_bitboards(player1, player2, kings, move, player), player)
+                  for move in moves]
+    return moves[int(np.argmax(network.predict_batch(candidates)))]
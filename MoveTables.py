@@ -0,0 +1,51 @@
+"""
+Precomputed geometry of the 32 playable tiles, used by the array move generator of CheckersRulesGame.
+
+For every chip value (1 and -1 only move forward, 2 and -2 are crowned and move both ways) and every tile:
+the tiles one step away and the (jumped tile, landing tile) pairs of a capture.
+Only targets inside the board are listed, the diagonal neighbours of a playable tile are always playable.
+The directions keep the original order: (-1, -1), (-1, 1), (1, -1), (1, 1).
+"""
+from BitBoard import SQUARE_TO_ROW_COL
+
+UP_DIRECTIONS = ((-1, -1), (-1, 1))
+DOWN_DIRECTIONS = ((1, -1), (1, 1))
+DIRECTIONS_BY_CHIP = {
+    1: UP_DIRECTIONS,
+    -1: DOWN_DIRECTIONS,
+    2: UP_DIRECTIONS + DOWN_DIRECTIONS,
+    -2: UP_DIRECTIONS + DOWN_DIRECTIONS,
+}
+
+# chips of the opponent of a chip (or of a player)
+OPPONENT_PIECES = {
+    1: frozenset((-1, -2)),
+    2: frozenset((-1, -2)),
+    -1: frozenset((1, 2)),
+    -2: frozenset((1, 2)),
+}
+
+
+def inside_board(row, col):
+    return 0 <= row < 8 and 0 <= col < 8
+
+
+def build_step_table(directions):
+    table = [[() for _ in range(8)] for _ in range(8)]
+    for row, col in SQUARE_TO_ROW_COL:
+        table[row][col] = tuple((row + dr, col + dc) for dr, dc in directions if inside_board(row + dr, col + dc))
+    return table
+
+
+def build_jump_table(directions):
+    table = [[() for _ in range(8)] for _ in range(8)]
+    for row, col in SQUARE_TO_ROW_COL:
+        table[row][col] = tuple(((row + dr, col + dc), (row + 2 * dr, col + 2 * dc)) for dr, dc in directions
+                                if inside_board(row + 2 * dr, col + 2 * dc))
+    return table
+
+
+# STEP_TARGETS[chip][row][col] -> ((new_row, new_col), ...)
+STEP_TARGETS = {chip: build_step_table(directions) for chip, directions in DIRECTIONS_BY_CHIP.items()}
+# JUMP_TARGETS[chip][row][col] -> (((mid_row, mid_col), (new_row, new_col)), ...)
+JUMP_TARGETS = {chip: build_jump_table(directions) for chip, directions in DIRECTIONS_BY_CHIP.items()}
@@ -0,0 +1,120 @@
+"""
+Opening book extracted from the monte carlo table.
+
+Every position reachable in the first OPENING_BOOK_PLIES plies (either player starting) is visited breadth first,
+the move leading to the best scored state of the table is kept for the positions where any of the states is known.
+Only the states the table knows are followed, the rest of the openings were never played.
+
+File layout: a 64 bytes header (magic and entry count) and then (key, move, score) records sorted by key,
+the key is the position packed like BoardState with bit 96 set when player -1 is to move, move is the index of the
+move in generate_moves_from_bitboards order. Loading builds a dict, so a lookup is O(1).
+
+Run this file to build model_saves/opening_book.bin from the saved monte carlo table.
+"""
+import os
+from collections import deque
+import numpy as np
+from AlphaBetaSearch import flat_board_with_player
+from BitBoard import board_to_bitboards, generate_moves_from_bitboards, play_path_on_bitboards, position_key
+from MonteCarloStore import HEADER_SIZE, bytes_to_keys, keys_to_bytes
+from StateKeys import encode_canonical_states
+from SimpleConfig import OPENING_BOOK_PLIES
+
+BOOK_MAGIC = b'MCBOOK01'
+BOOK_DTYPE = np.dtype([('key', 'S16'), ('move', 'u1'), ('score', '<f4')])
+BOOK_FILE = "opening_book.bin"
+
+
+def build_opening_book(training, plies=OPENING_BOOK_PLIES):
+    """
+    Returns a dict position key -> (move index, score) of the best known move of every opening position.
+
+    Parameters:
+    training (CheckersTraining): Owns the monte carlo table.
+    plies (int): Plies from the initial board covered by the book.
+    """
+    start = board_to_bitboards(training.initialize_board())
+    book = dict()
+    visited = set()
+    queue = deque((start + (player, 0)) for player in (1, -1))
+    while queue:
+        player1, player2, kings, player, ply = queue.popleft()
+        key = position_key(player1, player2, kings, player)
+        if key in visited:
+            continue
+        visited.add(key)
+        moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if not moves:
+            continue
+        children = [play_path_on_bitboards(player1, player2, kings, move, player) for move in moves]
+        states = encode_canonical_states([flat_board_with_player(*child, player) for child in children])
+        best_index, best_score = None, None
+        for index, (child, state) in enumerate(zip(children, states)):
+            found_key = training.find_monte_carlo_key(state)
+            if found_key is None:
+                continue
+            score = training.monte_carlo_scoring[found_key]
+            if best_score is None or score > best_score:
+                best_index, best_score = index, score
+            if ply + 1 < plies:
+                queue.append(child + (-player, ply + 1))
+        if best_index is not None:
+            book[key] = (best_index, best_score)
+    return book
+
+
+def write_opening_book(path, book):
+    records = np.zeros(len(book), dtype=BOOK_DTYPE)
+    records['key'] = keys_to_bytes(book.keys())
+    records['move'] = [move for move, _ in book.values()]
+    records['score'] = [score for _, score in book.values()]
+    records.sort(order='key')
+    header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+    header[:8] = np.frombuffer(BOOK_MAGIC, dtype=np.uint8)
+    header[8:16] = np.array([len(records)], dtype='<u8').view(np.uint8)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        records.tofile(f)
+
+
+def read_opening_book(path):
+    """
+    Returns the (N,) BOOK_DTYPE records of a book file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        if header[:8] != BOOK_MAGIC:
+            raise ValueError(f"{path} is not an opening book.")
+        count = int(np.frombuffer(header[8:16], dtype='<u8')[0])
+        return np.fromfile(f, dtype=BOOK_DTYPE, count=count)
+
+
+class OpeningBook:
+    def __init__(self, path):
+        records = read_opening_book(path)
+        self.moves = dict(zip(bytes_to_keys(records['key']), records['move'].tolist()))  # position key -> move index
+
+    def __len__(self):
+        return len(self.moves)
+
+    def find_move(self, player1, player2, kings, player, valid_moves):
+        """
+        Returns the book move of the position, one of valid_moves, or None when the position is not in the book.
+        """
+        index = self.moves.get(position_key(player1, player2, kings, player))
+        if index is None:
+            return None
+        moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if index >= len(moves) or moves[index] not in valid_moves:
+            return None
+        return valid_moves[valid_moves.index(moves[index])]
+
+
+if __name__ == "__main__":
+    from CheckersTraining import CheckersTraining
+    training = CheckersTraining()
+    training.load_status()
+    book = build_opening_book(training)
+    path = os.path.join(training.save_directory, BOOK_FILE)
+    write_opening_book(path, book)
+    print(f"Opening book with {len(book)} positions saved to {path} ({os.path.getsize(path)} bytes).")
@@ -0,0 +1,132 @@
+"""
+Monte Carlo tree search over several processes, used by Engines.MCTS when MCTS_WORKERS is not 1.
+
+Root parallel: every worker process keeps its own tree (reused between moves) and searches the same
+position for the time budget, the visits of the root moves of all the trees are added and the most
+visited move is played.
+Leaf parallel: one tree in the game process, the leaves are selected in batches (with a virtual loss so a
+batch spreads over different leaves) and their playouts run in a pool of worker processes.
+"""
+import multiprocessing
+import random
+import time
+import math
+import numpy as np
+from BitBoard import generate_moves_from_bitboards
+from CheckersNNNumpy import CheckersNNNumpy
+from Enumerators import Playouts
+from MonteCarloTreeSearch import MonteCarloTreeSearch, play_out
+from SimpleConfig import MCTS_EXPLORATION, MCTS_POOL_SIZE, MCTS_ROLLOUTS, MCTS_TIME_BUDGET
+
+
+def run_root_worker(connection, rollouts, time_budget, pool_size, exploration, playouts, network_path):
+    random.seed()  # forked workers would share the random state of the game process
+    network = CheckersNNNumpy(network_path) if playouts == Playouts.NN else None
+    search = MonteCarloTreeSearch(rollouts, time_budget, pool_size, exploration, playouts, network)
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        search.search(*task)
+        connection.send(search.root_visits())
+
+
+class RootParallelTreeSearch:
+    def __init__(self, workers, rollouts=MCTS_ROLLOUTS, time_budget=MCTS_TIME_BUDGET, pool_size=MCTS_POOL_SIZE,
+                 exploration=MCTS_EXPLORATION, playouts=Playouts.RANDOM, network_path=None):
+        """
+        Parameters:
+        workers (int): Worker processes, one tree each.
+        rollouts (int): Playouts per move of every worker, 0 to only use the time budget.
+        time_budget (float): Seconds per move, 0 to only use the rollouts.
+        pool_size (int): Nodes of the pool of every worker.
+        exploration (float): UCT exploration constant.
+        playouts (Playouts): How the playout moves are chosen.
+        network_path (str): Saved model loaded by the workers for Playouts.NN.
+        """
+        self.workers = workers
+        self.worker_arguments = (rollouts, time_budget, pool_size, exploration, playouts, network_path)
+        self.connections = []
+        self.processes = []
+        self.visits = None  # visits of the root moves added over the workers, from the last search
+
+    def start(self):
+        context = multiprocessing.get_context()
+        for _ in range(self.workers):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_root_worker, args=(worker_connection, *self.worker_arguments), daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def search(self, player1, player2, kings, player, moves_left, root_moves=None):
+        """
+        Same as MonteCarloTreeSearch.search, with the root visits of every worker added.
+        """
+        if root_moves is None:
+            root_moves = generate_moves_from_bitboards(player1, player2, kings, player)
+        if len(root_moves) == 1:
+            return root_moves[0]
+        if not self.processes:
+            self.start()
+        for connection in self.connections:
+            connection.send((player1, player2, kings, player, moves_left, root_moves))
+        self.visits = sum(connection.recv() for connection in self.connections)
+        return root_moves[int(np.argmax(self.visits))]
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+        self.connections, self.processes = [], []
+
+
+leaf_network = None  # network of the playouts in a leaf parallel worker
+
+
+def start_leaf_worker(network_path):
+    global leaf_network
+    random.seed()
+    leaf_network = CheckersNNNumpy(network_path) if network_path else None
+
+
+def play_out_position(position):
+    return play_out(*position, leaf_network)
+
+
+class LeafParallelTreeSearch(MonteCarloTreeSearch):
+    def __init__(self, workers, rollouts=MCTS_ROLLOUTS, time_budget=MCTS_TIME_BUDGET, pool_size=MCTS_POOL_SIZE,
+                 exploration=MCTS_EXPLORATION, playouts=Playouts.RANDOM, network_path=None, batch_size=None):
+        """
+        Parameters:
+        workers (int): Worker processes running the playouts.
+        batch_size (int): Leaves selected before running their playouts, defaults to 4 per worker.
+        Other parameters as MonteCarloTreeSearch, network_path is the saved model loaded by the workers for Playouts.NN.
+        """
+        super().__init__(rollouts, time_budget, pool_size, exploration, playouts)
+        self.workers = workers
+        self.batch_size = batch_size or workers * 4
+        self.network_path = network_path if playouts == Playouts.NN else None
+        self.executor = None
+
+    def run_rollouts(self, root):
+        if self.executor is None:
+            self.executor = multiprocessing.get_context().Pool(self.workers, start_leaf_worker, (self.network_path,))
+        pool = self.pool
+        deadline = time.perf_counter() + self.time_budget if self.time_budget else math.inf
+        rollouts = 0
+        while (not self.rollouts or rollouts < self.rollouts) and time.perf_counter() < deadline:
+            batch_size = self.batch_size if not self.rollouts else min(self.batch_size, self.rollouts - rollouts)
+            leaves = [self.select_leaf(root, virtual_loss=True) for _ in range(batch_size)]
+            positions = [(int(pool.player1[node]), int(pool.player2[node]), int(pool.kings[node]),
+                          int(pool.to_move[node]), int(pool.moves_left[node])) for node in leaves]
+            for node, result in zip(leaves, self.executor.map(play_out_position, positions, chunksize=4)):
+                self.backpropagate(node, result, virtual_loss=True)
+            rollouts += batch_size
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.close()
+            self.executor.join()
+            self.executor = None
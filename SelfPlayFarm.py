@@ -0,0 +1,152 @@
+"""
+Multi process self play.
+Every worker process plays games with its own CheckersRulesGame state and streams the monte carlo
+(state_key, reward) updates back in batches, the coordinator merges them into monte_carlo_scoring
+and saves periodically, like run_simulation does for a single process.
+With a shared table (SELF_PLAY_SHARED_TABLE, the default) the workers map one SharedMonteCarloTable and update it
+directly, only the game counters go through the queue. Without it every worker plays against the copy of the table
+it got at start up, the updates merged by the coordinator are never sent back to the workers.
+Only the monte carlo table is trained this way, NN training stays on CheckersTraining.run_simulation.
+"""
+import multiprocessing
+import os
+import random
+from CheckersTraining import CheckersTraining
+from MonteCarloStore import MappedMonteCarloTable
+from SharedMonteCarloTable import SharedMonteCarloTable
+from StateKeys import canonical_state_key, encode_state
+from SimpleConfig import SELF_PLAY_BATCH_SIZE, SELF_PLAY_SHARED_TABLE, SELF_PLAY_WORKERS, STOP_CHECK_INTERVAL, TRAINING
+
+
+class SelfPlayWorker(CheckersTraining):
+    """
+    Plays in a worker process. The monte carlo table is a read only snapshot used by the engines,
+    the updates are buffered and sent to the coordinator instead of being applied.
+    A SharedMonteCarloTable is updated in place instead, holding the lock of the canonical key.
+    """
+
+    def __init__(self, monte_carlo_scoring, results_queue, batch_size):
+        super().__init__()
+        self.monte_carlo_scoring = monte_carlo_scoring
+        self.shared_table = isinstance(monte_carlo_scoring, SharedMonteCarloTable)
+        self.results_queue = results_queue
+        self.batch_size = batch_size
+        self.pending_updates = []
+        self.reported = (0, 0, 0, 0)  # games, player 1 wins, player -1 wins, ties already sent
+
+    def update_reward_monte_carlo_score(self, inputs, reward):
+        state = encode_state(inputs)
+        if self.shared_table:
+            with self.monte_carlo_scoring.locked(canonical_state_key(state)):
+                self.update_reward_monte_carlo_key(state, reward)
+        else:
+            self.pending_updates.append((state, reward))
+
+    def flush(self):
+        """
+        Sends the buffered updates with the game results played since the last flush.
+        """
+        counters = (self.total_games, self.player_1_win_count, self.player_2_win_count, self.tie_games)
+        games, player_1_wins, player_2_wins, ties = (now - before for now, before in zip(counters, self.reported))
+        self.results_queue.put((self.pending_updates, games, player_1_wins, player_2_wins, ties))
+        self.pending_updates = []
+        self.reported = counters
+
+
+def run_worker(monte_carlo_scoring, results_queue, stop_event, batch_size):
+    random.seed()  # forked workers would share the random state of the coordinator
+    worker = SelfPlayWorker(monte_carlo_scoring, results_queue, batch_size)
+    while not stop_event.is_set():
+        worker.play_game()
+        if worker.shared_table or len(worker.pending_updates) >= batch_size:
+            worker.flush()
+    worker.flush()
+    results_queue.put(None)  # this worker is done
+
+
+class SelfPlayFarm:
+    def __init__(self, training=None, workers=SELF_PLAY_WORKERS, batch_size=SELF_PLAY_BATCH_SIZE, shared_table=SELF_PLAY_SHARED_TABLE):
+        """
+        Parameters:
+        training (CheckersTraining): Owns the monte carlo table, the counters and the saves.
+        workers (int): Number of worker processes, 0 uses one per core.
+        batch_size (int): Updates buffered by each worker before sending them.
+        shared_table (bool): Workers update a SharedMonteCarloTable instead of sending the updates.
+        """
+        self.training = training if training is not None else CheckersTraining()
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.shared_table = shared_table
+
+    def merge(self, message):
+        updates, games, player_1_wins, player_2_wins, ties = message
+        training = self.training
+        for state, reward in updates:
+            training.update_reward_monte_carlo_key(state, reward)
+        training.player_1_win_count += player_1_wins
+        training.player_2_win_count += player_2_wins
+        training.tie_games += ties
+        for _ in range(games):
+            training.total_games += 1
+            training.checkpoint_periodically(training.total_games)
+            if not training.loop_run:
+                continue
+            training.save_model_periodically(training.total_games)
+            if training.total_games % STOP_CHECK_INTERVAL == 0:
+                training.print_progress()
+                training.check_and_delete_stop_file()
+
+    def run(self, max_games=None):
+        """
+        Plays until stop.txt is found in the save directory (or max_games are merged), then saves.
+        """
+        if TRAINING:
+            raise ValueError("SelfPlayFarm only trains the monte carlo table, set TRAINING to False.")
+        training = self.training
+        training.load_status()
+        table = None
+        if self.shared_table:
+            table_path = os.path.join(training.save_directory, 'shared_monte_carlo.bin')
+            if os.path.exists(table_path):
+                os.remove(table_path)  # left by a run that did not finish, the saved status is loaded instead
+            table = SharedMonteCarloTable.from_dict(table_path, training.monte_carlo_scoring)
+            training.monte_carlo_scoring = table
+        context = multiprocessing.get_context()
+        results_queue = context.Queue(maxsize=self.workers * 4)
+        stop_event = context.Event()
+        processes = [
+            context.Process(target=run_worker, args=(training.monte_carlo_scoring, results_queue, stop_event, self.batch_size), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        print(f"Self play started with {self.workers} workers.")
+        running = len(processes)
+        try:
+            while running:
+                message = results_queue.get()
+                if message is None:
+                    running -= 1
+                    continue
+                self.merge(message)
+                if max_games and training.total_games >= max_games:
+                    training.loop_run = False
+                if not training.loop_run:
+                    stop_event.set()
+        finally:
+            stop_event.set()
+            for process in processes:
+                if running:
+                    process.terminate()
+                process.join()
+            print("Preparing to stop the application...")
+            training.save_model_periodically(training.total_games)
+            training.shutdown_executor()
+            if table is not None:
+                training.monte_carlo_scoring = MappedMonteCarloTable(spill_directory=training.save_directory)
+                training.monte_carlo_scoring.update_stats(table.stats_items())
+                table.remove()
+
+
+if __name__ == "__main__":
+    SelfPlayFarm().run()
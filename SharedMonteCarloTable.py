@@ -0,0 +1,230 @@
+"""
+Monte carlo table shared by several processes.
+
+Open addressing hash table stored in a memory mapped file, so every self play process maps the
+same pages instead of holding its own copy of the table.
+Keys are the integer states of StateKeys.py, split in a low and a high 64 bit word, values are the float32
+mean rewards with their uint32 visits, like MappedMonteCarloTable.
+
+The slots are split in segments (stripes), a key only probes inside the segment its hash points to
+and every segment has its own lock, so writers on different segments never wait for each other.
+Readers do not lock: a writer fills the value and the low word first and publishes the slot by
+writing the high word last, with the occupied flag.
+"""
+import multiprocessing
+import os
+from contextlib import ExitStack, contextmanager
+import numpy as np
+from SimpleConfig import SHARED_MONTE_CARLO_CAPACITY, SHARED_MONTE_CARLO_STRIPES
+
+MAGIC = b'MCTABLE2'
+HEADER_SIZE = 64
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+OCCUPIED = 1 << 63  # flag of the high word of a used slot, the keys use 33 bits of it
+DELETED = 1 << 62   # tombstone, probing continues past it
+
+
+def mix_key(low, high):
+    """
+    splitmix64 finalizer of the two words of a key.
+    """
+    h = (low ^ (high * 0x9E3779B97F4A7C15)) & MASK_64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return h ^ (h >> 31)
+
+
+class SharedMonteCarloTable:
+    def __init__(self, path, capacity=SHARED_MONTE_CARLO_CAPACITY, stripes=SHARED_MONTE_CARLO_STRIPES, locks=None):
+        """
+        Creates the table file at path, or maps it if it already exists (capacity and stripes are then read from it).
+
+        Parameters:
+        path (str): File backing the table.
+        capacity (int): Number of slots, power of 2.
+        stripes (int): Number of segments and locks, power of 2 lower than capacity.
+        locks (list): Locks of an existing table, only given when the table is sent to another process.
+        """
+        self.path = path
+        if not os.path.exists(path):
+            self.create_file(path, capacity, stripes)
+        self.map_file()
+        self.locks = locks if locks is not None else [multiprocessing.RLock() for _ in range(self.stripes)]
+
+    @staticmethod
+    def create_file(path, capacity, stripes):
+        if capacity & (capacity - 1) or stripes & (stripes - 1) or stripes > capacity:
+            raise ValueError("capacity and stripes have to be powers of 2, and stripes lower than capacity.")
+        header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+        header[:8] = np.frombuffer(MAGIC, dtype=np.uint8)
+        header[8:24] = np.array([capacity, stripes], dtype='<u8').view(np.uint8)
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.truncate(HEADER_SIZE + stripes * 8 + capacity * 24)
+
+    def map_file(self):
+        with open(self.path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if header[:8] != MAGIC:
+            raise ValueError(f"{self.path} is not a monte carlo table.")
+        self.capacity, self.stripes = (int(value) for value in np.frombuffer(header[8:24], dtype='<u8'))
+        self.segment_size = self.capacity // self.stripes
+        offset = HEADER_SIZE
+        self.counts = np.memmap(self.path, dtype='<u8', mode='r+', offset=offset, shape=(self.stripes,))
+        offset += self.stripes * 8
+        self.high = np.memmap(self.path, dtype='<u8', mode='r+', offset=offset, shape=(self.capacity,))
+        offset += self.capacity * 8
+        self.low = np.memmap(self.path, dtype='<u8', mode='r+', offset=offset, shape=(self.capacity,))
+        offset += self.capacity * 8
+        self.values = np.memmap(self.path, dtype='<f4', mode='r+', offset=offset, shape=(self.capacity,))
+        offset += self.capacity * 4
+        self.visit_counts = np.memmap(self.path, dtype='<u4', mode='r+', offset=offset, shape=(self.capacity,))
+
+    def __getstate__(self):
+        # the maps are opened again by the receiving process, the locks travel with the process arguments
+        return {'path': self.path, 'locks': self.locks}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.locks = state['locks']
+        self.map_file()
+
+    @classmethod
+    def from_dict(cls, path, input_dict, capacity=SHARED_MONTE_CARLO_CAPACITY, stripes=SHARED_MONTE_CARLO_STRIPES):
+        table = cls(path, capacity, stripes)
+        if hasattr(input_dict, 'stats_items'):
+            for key, mean, visits in input_dict.stats_items():
+                table.store(key, mean, visits)
+        else:
+            for key, value in input_dict.items():
+                table[key] = value
+        return table
+
+    def segment_and_start(self, low, high):
+        h = mix_key(low, high)
+        return h & (self.stripes - 1), (h >> 32) & (self.segment_size - 1)
+
+    def probe(self, key):
+        """
+        Returns (slot of the key or -1, first free slot or -1, segment). Does not lock.
+        """
+        low, high = key & MASK_64, key >> 64
+        segment, start = self.segment_and_start(low, high)
+        base = segment * self.segment_size
+        free = -1
+        for i in range(self.segment_size):
+            slot = base + ((start + i) & (self.segment_size - 1))
+            slot_high = int(self.high[slot])
+            if slot_high == 0:
+                return -1, slot if free == -1 else free, segment
+            if slot_high == DELETED:
+                if free == -1:
+                    free = slot
+            elif slot_high == high | OCCUPIED and int(self.low[slot]) == low:
+                return slot, free, segment
+        return -1, free, segment
+
+    @contextmanager
+    def locked(self, *keys):
+        """
+        Holds the locks of the segments of keys, so a read-modify-write of those keys is atomic.
+        Locks are taken in segment order to avoid dead locks between processes.
+        """
+        segments = sorted({self.segment_and_start(key & MASK_64, key >> 64)[0] for key in keys})
+        with ExitStack() as stack:
+            for segment in segments:
+                stack.enter_context(self.locks[segment])
+            yield
+
+    def __contains__(self, key):
+        return self.probe(key)[0] != -1
+
+    def __getitem__(self, key):
+        slot = self.probe(key)[0]
+        if slot == -1:
+            raise KeyError(f'Key {key} not found')
+        return float(self.values[slot])
+
+    def get(self, key, default=None):
+        slot = self.probe(key)[0]
+        return default if slot == -1 else float(self.values[slot])
+
+    def visits(self, key):
+        slot = self.probe(key)[0]
+        return 0 if slot == -1 else int(self.visit_counts[slot])
+
+    def store(self, key, mean, visits):
+        with self.locked(key):
+            slot, free, segment = self.probe(key)
+            if slot != -1:
+                self.values[slot] = mean
+                self.visit_counts[slot] = visits
+                return
+            if free == -1:
+                raise RuntimeError("Shared monte carlo table segment is full, increase SHARED_MONTE_CARLO_CAPACITY.")
+            self.values[free] = mean
+            self.visit_counts[free] = visits
+            self.low[free] = key & MASK_64
+            self.high[free] = (key >> 64) | OCCUPIED
+            self.counts[segment] += 1
+
+    def __setitem__(self, key, value):
+        # a value set directly counts as a single visit
+        self.store(key, value, 1)
+
+    def add_reward(self, key, reward):
+        """
+        Adds a reward to the running mean of key, a new key starts with it.
+        """
+        with self.locked(key):
+            slot = self.probe(key)[0]
+            if slot == -1:
+                self.store(key, reward, 1)
+                return
+            visits = int(self.visit_counts[slot]) + 1
+            self.values[slot] += (reward - float(self.values[slot])) / visits
+            self.visit_counts[slot] = visits
+
+    def __delitem__(self, key):
+        with self.locked(key):
+            slot, _, segment = self.probe(key)
+            if slot == -1:
+                raise KeyError(f'Key {key} not found')
+            self.high[slot] = DELETED
+            self.counts[segment] -= 1
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def occupied_slots(self):
+        return np.flatnonzero(self.high & np.uint64(OCCUPIED))
+
+    def keys_at(self, slots):
+        high = (self.high[slots] & np.uint64(~OCCUPIED & MASK_64)).tolist()
+        return [low | (high_word << 64) for low, high_word in zip(self.low[slots].tolist(), high)]
+
+    def keys(self):
+        return self.keys_at(self.occupied_slots())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        slots = self.occupied_slots()
+        return zip(self.keys_at(slots), self.values[slots].tolist())
+
+    def stats_items(self):
+        # (key, mean, visits) of every entry
+        slots = self.occupied_slots()
+        return zip(self.keys_at(slots), self.values[slots].tolist(), self.visit_counts[slots].tolist())
+
+    def flush(self):
+        for array in (self.counts, self.high, self.low, self.values, self.visit_counts):
+            array.flush()
+
+    def close(self):
+        del self.counts, self.high, self.low, self.values, self.visit_counts
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
@@ -1,4 +1,4 @@
-from Enumerators import Engines
+from Enumerators import Engines, Evaluators, Playouts
 import numpy as np
 
 
@@ -12,6 +12,37 @@ EXECUTE_SAVE_ASYNC = False # enables multi threading to save files, sueful most
                           # this will ask the app to stop after the file has been saved, stopping the app safe might take a few minutes
 SAVES_INTERVAL =  100000  # this number hast to be big (>10000) if the async is enabled and debug is False.
 STOP_CHECK_INTERVAL = 5000 # this always has to be lower than SAVES_INTERVAL
+CHECKPOINT_INTERVAL = 1000 # games between appends of the monte carlo changes to the delta log, at most these games are lost in a crash
+SELF_PLAY_WORKERS = 0 # processes used by SelfPlayFarm.py, 0 uses one per core
+SELF_PLAY_BATCH_SIZE = 10000 # monte carlo updates each self play worker buffers before sending them
+SELF_PLAY_SHARED_TABLE = True # self play workers read and update one SharedMonteCarloTable, False gives each worker a copy of the table taken at start up (pickled into every worker under spawn) that never sees what the farm learns
+LOCKSTEP_GAMES = 256 # games advanced together by LockstepSelfPlay.py, the NN scores the candidates of all of them in one call
+SHARED_MONTE_CARLO_CAPACITY = 2**24 # slots of the shared table (24 bytes each), power of 2
+SHARED_MONTE_CARLO_STRIPES = 64 # segments of the shared table, each one with its own lock
+MONTE_CARLO_HOT_ENTRIES = 10000000 # changed monte carlo entries kept in RAM (about 250 bytes each), beyond it the least recently changed half is spilled to disk, 0 keeps all
+MONTE_CARLO_MAX_RUNS = 8 # spilled runs searched by a lookup before they are merged into one
+MONTE_CARLO_SHARDS = 8 # hash partitions of the saved monte carlo table, each written by its own process, 1 saves a single file
+MONTE_CARLO_SHARD_WORKERS = 0 # processes saving or verifying the monte carlo shards, 0 uses one per core
+MONTE_CARLO_VERIFY_SHARDS = False # checks the checksum of every shard when the status is loaded, reading the whole table
+MONTE_CARLO_MERGE_ENTRIES = 5000000 # monte carlo entries TrainningResultsConsolidator keeps in RAM before spilling a sorted run to disk
+MONTE_CARLO_BLOOM_BITS = 10 # bloom filter bits per key of the saved monte carlo files, about 1% of the unknown states read the keys, 0 disables it
+MEMO_CAPACITY = 200000 # items kept by valid_moves_memo and transition_memo each, the least recently used are evicted
+ALPHA_BETA_EVALUATOR = Evaluators.SCORES # how Engines.ALPHA_BETA scores the positions at the end of the search
+ALPHA_BETA_TIME_BUDGET = 0.1 # seconds Engines.ALPHA_BETA can think per move
+ALPHA_BETA_MAX_DEPTH = 20 # deepest iteration of Engines.ALPHA_BETA
+ALPHA_BETA_TABLE_SIZE = 1000000 # positions kept by the transposition table of Engines.ALPHA_BETA
+MCTS_ROLLOUTS = 0 # playouts Engines.MCTS runs per move, 0 to only use MCTS_TIME_BUDGET
+MCTS_TIME_BUDGET = 0.1 # seconds Engines.MCTS can think per move, 0 to only use MCTS_ROLLOUTS
+MCTS_POOL_SIZE = 1000000 # nodes of the Engines.MCTS tree (about 55 bytes each)
+MCTS_EXPLORATION = 1.4 # UCT exploration constant
+MCTS_PLAYOUTS = Playouts.RANDOM # how the Engines.MCTS playouts choose their moves
+MCTS_WORKERS = 1 # processes searching for Engines.MCTS, 1 searches in the game process, 0 uses one per core
+MCTS_LEAF_PARALLEL = False # with several MCTS_WORKERS: one tree with the playouts run by the workers, instead of one tree per worker
+OPENING_BOOK = False # the engines play the moves of model_saves/opening_book.bin (built by OpeningBook.py) while the position is in it
+OPENING_BOOK_PLIES = 10 # plies from the initial board covered by the opening book
+ENDGAME_TABLEBASE = False # probe model_saves/endgame_tablebase.bin (built by EndgameTablebase.py): perfect moves and games ended once the scores decide them
+TABLEBASE_PIECES = 3 # most chips on the board of the positions in the endgame tablebase, 4 has about 15 million positions
+USE_BITBOARD_MOVE_GENERATOR = True # generates moves with BitBoard.py, set False to use the original 64 tiles scan
 
     
 def debug_print(*args, end=None):
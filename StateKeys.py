@@ -0,0 +1,114 @@
+"""
+Integer keys of the monte carlo table.
+
+A state is the player followed by the 32 playable tiles (filter_and_flatten_board), it is packed
+with the same layout as BoardState: bits 0-31 player 1 chips, bits 32-63 player -1 chips,
+bits 64-95 crowned chips and bit 96 set when the player is -1.
+This replaces the f"{ndarray}" -> clean_string -> base 4 -> base 72 string pipeline.
+"""
+import numpy as np
+from MathTooling import transform_key_to_base72
+
+MASK_32 = 0xFFFFFFFF
+_REVERSED_BYTES = [int(f"{b:08b}"[::-1], 2) for b in range(256)]
+_REVERSED_BYTES_ARRAY = np.array(_REVERSED_BYTES, dtype=np.uint8)
+
+
+def _pack_rows(mask):
+    # (N, 32) booleans -> (N,) uint64 with bit i set for tile i
+    return np.ascontiguousarray(np.packbits(mask, axis=1, bitorder='little')).view('<u4')[:, 0].astype(np.uint64)
+
+
+def encode_state_words(flat_boards_with_player):
+    """
+    Vectorized encoder for many states at once.
+
+    Parameters:
+    flat_boards_with_player (np.ndarray): (N, 33) or (33,) array of states.
+
+    Returns:
+    tuple: (low, high) uint64 arrays, the key of each state is low | high << 64.
+    """
+    flat = np.asarray(flat_boards_with_player).reshape(-1, 33)
+    tiles = flat[:, 1:]
+    low = _pack_rows(tiles > 0) | (_pack_rows(tiles < 0) << np.uint64(32))
+    high = _pack_rows((tiles == 2) | (tiles == -2)) | ((flat[:, 0] == -1).astype(np.uint64) << np.uint64(32))
+    return low, high
+
+
+def join_state_words(low, high):
+    return [low_word | (high_word << 64) for low_word, high_word in zip(low.tolist(), high.tolist())]
+
+
+def encode_states(flat_boards_with_player):
+    return join_state_words(*encode_state_words(flat_boards_with_player))
+
+
+def encode_canonical_states(flat_boards_with_player):
+    # canonical_state_key of every state, the keys the monte carlo table is probed with
+    return join_state_words(*canonical_state_words(*encode_state_words(flat_boards_with_player)))
+
+
+def encode_state(flat_board_with_player):
+    return encode_states(flat_board_with_player)[0]
+
+
+def decode_state(key):
+    """
+    Returns the (33,) array of the state, inverse of encode_state.
+    """
+    flat = np.zeros(33, dtype=int)
+    flat[0] = -1 if (key >> 96) & 1 else 1
+    bits = np.unpackbits(np.frombuffer(key.to_bytes(13, 'little')[:12], dtype=np.uint8), bitorder='little')
+    flat[1:][bits[:32] == 1] = 1
+    flat[1:][bits[32:64] == 1] = -1
+    flat[1:][bits[64:96] == 1] *= 2
+    return flat
+
+
+def reverse_32_bits(mask):
+    return (_REVERSED_BYTES[mask & 0xFF] << 24) | (_REVERSED_BYTES[(mask >> 8) & 0xFF] << 16) |\
+        (_REVERSED_BYTES[(mask >> 16) & 0xFF] << 8) | _REVERSED_BYTES[mask >> 24]
+
+
+def mirror_state_key(key):
+    """
+    Key of the same play seen by the other player, the arithmetic version of CheckersTraining.mirror_play:
+    the board is rotated 180 degrees (tile order reversed), the colors swapped and the player negated.
+    """
+    player1 = reverse_32_bits(key & MASK_32)
+    player2 = reverse_32_bits((key >> 32) & MASK_32)
+    kings = reverse_32_bits((key >> 64) & MASK_32)
+    return player2 | (player1 << 32) | (kings << 64) | ((((key >> 96) & 1) ^ 1) << 96)
+
+
+def canonical_state_key(key):
+    """
+    The state and its mirror are the same play, the smallest of both keys stands for the two in the monte carlo table.
+    """
+    return min(key, mirror_state_key(key))
+
+
+def reverse_32_bits_array(masks):
+    # reverse_32_bits of every uint64 (below 2**32) of masks
+    masks_bytes = masks.astype('<u4').view(np.uint8).reshape(-1, 4)
+    return np.ascontiguousarray(_REVERSED_BYTES_ARRAY[masks_bytes][:, ::-1]).view('<u4')[:, 0].astype(np.uint64)
+
+
+def canonical_state_words(low, high):
+    """
+    Vectorized canonical_state_key over the (low, high) uint64 words of many keys, see encode_state_words.
+    """
+    mask = np.uint64(MASK_32)
+    shift = np.uint64(32)
+    mirror_low = reverse_32_bits_array(low >> shift) | (reverse_32_bits_array(low & mask) << shift)
+    mirror_high = reverse_32_bits_array(high & mask) | (((high >> shift) & np.uint64(1)) ^ np.uint64(1)) << shift
+    use_mirror = (mirror_high < high) | ((mirror_high == high) & (mirror_low < low))
+    return np.where(use_mirror, mirror_low, low), np.where(use_mirror, mirror_high, high)
+
+
+def legacy_state_key(key):
+    """
+    Base 72 key the old string pipeline produced for the same state, used to migrate old game_status.json files.
+    """
+    return transform_key_to_base72(''.join(str(tile) for tile in decode_state(key)))
@@ -0,0 +1,285 @@
+"""
+Merges the training results of many machines into one monte carlo table file.
+
+The inputs are the json snapshots written by CheckersTraining.save_game_results (model_saves/<random>.json) and
+saved monte carlo tables (a table file or a manifest). A snapshot is read a chunk at a time with a small incremental
+json reader instead of json.load, so a file is never held whole in memory, and the members that are not merged
+(the legacy states) are skipped by scanning their nesting without decoding them. The states read are buffered up to
+MONTE_CARLO_MERGE_ENTRIES, then canonicalized, combined and spilled to a sorted run file (the MonteCarloStore layout).
+The runs are merged by key ranges and written as a single table, so the memory used depends on
+MONTE_CARLO_MERGE_ENTRIES and not on the size of the inputs.
+
+The entries of a state are combined with the mean of their rewards weighted by their visits, and the sum of the visits.
+Snapshots written before the visits store only the mean, they count as 1 visit. The legacy base 72 states of the
+snapshots are skipped.
+
+Run this file with the output table and the input files, by default every snapshot of model_saves is merged
+into model_saves/consolidated_monte_carlo.bin.
+"""
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import numpy as np
+from MonteCarloStore import (MAGIC, MAGIC_WITHOUT_VISITS, MANIFEST_EXTENSION, VALUE_DTYPE, VISITS_DTYPE,
+                             canonical_key_arrays, combine_stats, keys_to_bytes, map_monte_carlo_file, read_manifest,
+                             table_files, write_sorted_arrays, write_sorted_chunks)
+from SimpleConfig import MONTE_CARLO_MERGE_ENTRIES
+
+READ_CHUNK = 1 << 20  # characters read from a json file at once
+NUMBER_MARGIN = 32  # characters past a decoded value, a number cut by the end of the buffer is read again
+CONSOLIDATED_FILE = "consolidated_monte_carlo.bin"
+STRUCTURE = re.compile(r'["{}\[\],]')  # characters that start a string or change the nesting outside of strings
+STRING_END = re.compile(r'["\\]')
+
+
+class JsonObjectStream:
+    """
+    Reads the members of the json objects of a file one by one, only the buffered chunk and the value read are in memory.
+    """
+
+    def __init__(self, f, chunk_size=READ_CHUNK):
+        self.file = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.file.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+
+    def next_char(self):
+        # the next character that is not a space, without consuming it, '' at the end of the file
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer) or self.eof:
+                return self.buffer[self.position:self.position + 1]
+            self.fill()
+
+    def expect(self, characters):
+        character = self.next_char()
+        if not character or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in {self.file.name}, found {character!r}.")
+        self.position += 1
+        return character
+
+    def value(self):
+        """
+        Returns the next json value.
+        """
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                if end + NUMBER_MARGIN <= len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def skip_value(self):
+        """
+        Moves past the next json value without decoding it, the strings and their escapes are followed
+        so only the nesting is tracked and the consumed chunks are dropped.
+        """
+        self.next_char()
+        depth, in_string, escaped = 0, False, False
+        while True:
+            buffer, position = self.buffer, self.position
+            while position < len(buffer):
+                if escaped:
+                    position += 1
+                    escaped = False
+                elif in_string:
+                    match = STRING_END.search(buffer, position)
+                    if match is None:
+                        position = len(buffer)
+                        break
+                    position = match.end()
+                    if match.group() == '\\':
+                        escaped = True
+                    else:
+                        in_string = False
+                        if depth == 0:
+                            self.position = position
+                            return
+                else:
+                    match = STRUCTURE.search(buffer, position)
+                    if match is None:
+                        position = len(buffer)
+                        break
+                    character, position = match.group(), match.start()
+                    if depth == 0 and character in ',}]':
+                        self.position = position  # end of a number, true, false or null
+                        return
+                    position += 1
+                    if character == '"':
+                        in_string = True
+                    elif character in '{[':
+                        depth += 1
+                    elif character in '}]':
+                        depth -= 1
+                        if depth == 0:
+                            self.position = position
+                            return
+            self.position = position
+            if self.eof:
+                if depth or in_string:
+                    raise ValueError(f"Unexpected end of {self.file.name}.")
+                return
+            self.fill()
+
+    def members(self):
+        """
+        Yields the keys of the next json object, the caller reads the value of every key (value or members)
+        before asking for the next one.
+        """
+        self.expect('{')
+        if self.next_char() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def snapshot_states(path, totals, chunk_size=READ_CHUNK):
+    """
+    Yields the (key, mean, visits) states of a save_game_results snapshot, its total_games is added to totals['games'].
+    """
+    with open(path, 'r') as f:
+        stream = JsonObjectStream(f, chunk_size)
+        for name in stream.members():
+            if name == 'monte_carlo_states':
+                for key in stream.members():
+                    value = stream.value()
+                    mean, visits = (value, 1) if isinstance(value, (int, float)) else value
+                    yield int(key), mean, visits
+            elif name == 'total_games':
+                totals['games'] += stream.value()
+            else:
+                stream.skip_value()
+
+
+def is_table_file(path):
+    with open(path, 'rb') as f:
+        start = f.read(8)
+    return start in (MAGIC, MAGIC_WITHOUT_VISITS) or path.endswith(MANIFEST_EXTENSION)
+
+
+class TrainningResultsConsolidator:
+    def __init__(self, merge_entries=MONTE_CARLO_MERGE_ENTRIES, spill_directory=None, chunk_size=READ_CHUNK):
+        """
+        Parameters:
+        merge_entries (int): Entries held in memory, when the buffer reaches it a sorted run is spilled.
+        spill_directory (str): Directory of the run files, the temporary directory by default.
+        chunk_size (int): Characters read from a json file at once.
+        """
+        self.merge_entries = merge_entries
+        self.chunk_size = chunk_size
+        self.run_directory = tempfile.mkdtemp(prefix='monte_carlo_merge_', dir=spill_directory)
+        self.runs = []  # sorted (keys, values, visits) runs mapped from their files, one entry per key
+        self.pending = []  # (keys, values, visits) arrays not spilled yet
+        self.pending_entries = 0
+        self.totals = {'games': 0, 'files': 0, 'states': 0}
+
+    def add_arrays(self, keys_array, values_array, visits_array):
+        self.pending.append((keys_array, np.asarray(values_array, dtype=VALUE_DTYPE),
+                             np.asarray(visits_array, dtype=VISITS_DTYPE)))
+        self.pending_entries += len(keys_array)
+        self.totals['states'] += len(keys_array)
+        if self.pending_entries >= self.merge_entries:
+            self.spill()
+
+    def spill(self):
+        # writes the pending entries as a sorted run, the mirrored states and duplicates combined
+        if not self.pending_entries:
+            return
+        merged = canonical_key_arrays(*(np.concatenate([arrays[i] for arrays in self.pending]) for i in range(3)))
+        self.pending, self.pending_entries = [], 0
+        path = os.path.join(self.run_directory, f"run{len(self.runs)}.bin")
+        write_sorted_arrays(path, *merged, bloom_bits=0)
+        self.runs.append(map_monte_carlo_file(path)[:3])
+
+    def add_file(self, path):
+        """
+        Adds the states of a snapshot or a saved table.
+        """
+        self.totals['files'] += 1
+        if is_table_file(path):
+            files = table_files(path)
+            if files != [path]:
+                self.totals['games'] += read_manifest(path)['total_games']
+            for table_path in files:
+                keys_array, values_array, visits_array, _ = map_monte_carlo_file(table_path)
+                for start in range(0, len(keys_array), self.merge_entries):
+                    end = start + self.merge_entries
+                    self.add_arrays(keys_array[start:end], values_array[start:end], visits_array[start:end])
+            return
+        keys, values, visits = [], [], []
+        for key, mean, key_visits in snapshot_states(path, self.totals, self.chunk_size):
+            keys.append(key)
+            values.append(mean)
+            visits.append(key_visits)
+            if len(keys) == self.merge_entries:
+                self.add_arrays(keys_to_bytes(keys), values, visits)
+                keys, values, visits = [], [], []
+        self.add_arrays(keys_to_bytes(keys), values, visits)
+
+    def merged_chunks(self):
+        """
+        Yields the runs merged by key ranges, every range reads at most merge_entries entries of the runs.
+        """
+        cursors = [0] * len(self.runs)
+        step = max(1, self.merge_entries // max(1, len(self.runs)))
+        while True:
+            active = [i for i, run in enumerate(self.runs) if cursors[i] < len(run[0])]
+            if not active:
+                return
+            # every key up to the smallest last key of the windows is in the windows
+            bound = min(self.runs[i][0][min(cursors[i] + step, len(self.runs[i][0])) - 1] for i in active)
+            parts = []
+            for i in active:
+                keys_array = self.runs[i][0]
+                end = cursors[i] + int(np.searchsorted(keys_array[cursors[i]:cursors[i] + step], bound, side='right'))
+                parts.append(tuple(array[cursors[i]:end] for array in self.runs[i]))
+                cursors[i] = end
+            yield combine_stats(*(np.concatenate([part[j] for part in parts]) for j in range(3)))
+
+    def merge(self, path):
+        """
+        Writes the merged table to path and removes the runs, returns how many states it has.
+        """
+        self.spill()
+        try:
+            return write_sorted_chunks(path, self.merged_chunks(), sum(len(run[0]) for run in self.runs))
+        finally:
+            self.runs = []
+            shutil.rmtree(self.run_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    save_directory = "model_saves"
+    output = sys.argv[1] if len(sys.argv) > 1 else os.path.join(save_directory, CONSOLIDATED_FILE)
+    inputs = sys.argv[2:] or [name for name in glob.glob(os.path.join(save_directory, '*.json'))
+                              if not os.path.basename(name).startswith('game_status')]
+    consolidator = TrainningResultsConsolidator(spill_directory=os.path.dirname(os.path.abspath(output)))
+    for name in inputs:
+        consolidator.add_file(name)
+        print(f"Read {name}, {consolidator.totals['states']} states so far.")
+    states = consolidator.merge(output)
+    print(f"Merged {consolidator.totals['files']} files of {consolidator.totals['games']} games into {output}: "
+          f"{states} states out of {consolidator.totals['states']} read.")
@@ -0,0 +1,43 @@
+"""
+Zobrist hashing of the board.
+Every (tile, chip) pair gets a random 64 bit number, the hash of a board is the xor of the numbers of its chips.
+Moving, capturing or crowning a chip only needs a few xors to update the hash, so the board
+does not need to be serialized again on every play.
+"""
+import numpy as np
+from BitBoard import PLAYABLE_INDICES
+
+ZOBRIST_SEED = 20240717  # fixed so the hashes are the same on every run
+
+_rng = np.random.default_rng(ZOBRIST_SEED)
+# rows are the 64 tiles of the board, columns the tile values -2, -1, 0, 1, 2, 3 (value + 2).
+# Empty (0) and unplayable (3) tiles do not change the hash.
+ZOBRIST_TABLE = _rng.integers(1, 2**63, size=(64, 6), dtype=np.uint64)
+ZOBRIST_TABLE[:, 2] = 0
+ZOBRIST_TABLE[:, 5] = 0
+ZOBRIST_PLAYER_2 = int(_rng.integers(1, 2**63, dtype=np.uint64))
+# plain python ints, faster than numpy scalars for the incremental updates
+ZOBRIST_KEYS = [[int(value) for value in tile] for tile in ZOBRIST_TABLE]
+
+
+def zobrist_key(row, col, value):
+    return ZOBRIST_KEYS[row * 8 + col][value + 2]
+
+
+def hash_board(board, player=1):
+    """
+    Full hash of an 8x8 (or flat 64) board, player -1 adds the side to move key.
+    """
+    values = np.asarray(board).ravel() + 2
+    res = int(np.bitwise_xor.reduce(ZOBRIST_TABLE[np.arange(64), values]))
+    return res ^ ZOBRIST_PLAYER_2 if player == -1 else res
+
+
+def hash_flat_board(flat_board_with_player):
+    """
+    Hash of the player followed by the 32 playable tiles, as returned by filter_and_flatten_board.
+    Gives the same value as hash_board for the same board and player.
+    """
+    values = np.asarray(flat_board_with_player).ravel()
+    res = int(np.bitwise_xor.reduce(ZOBRIST_TABLE[PLAYABLE_INDICES, values[1:] + 2]))
+    return res ^ ZOBRIST_PLAYER_2 if values[0] == -1 else res
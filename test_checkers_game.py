@@ -1,7 +1,30 @@
+import json
+import math
+import time
+import os
+import random
+import tempfile
 import unittest
 import numpy as np
+from AlphaBetaSearch import WIN_THRESHOLD, AlphaBetaSearch
+from BitBoard import PLAYABLE_INDICES, bitboards_to_board, board_to_bitboards, generate_bitboard_moves, play_path_on_bitboards, position_key
+from BoardState import BoardState
+from CheckersNNNumpy import CheckersNNNumpy
 from CheckersTraining import CheckersTraining
-from MathTooling import transform_dict_keys_base4_to_base72, clean_string
+from CustomMemo import Memo
+from EndgameTablebase import EndgameTablebase, build_tablebase, write_tablebase
+from LockstepSelfPlay import LockstepSelfPlay, apply_moves_batch
+from MonteCarloStore import MappedMonteCarloTable, bloom_may_contain, build_bloom_filter, keys_to_bytes, read_manifest, table_files, verify_manifest
+from MonteCarloTreeSearch import MonteCarloTreeSearch
+from MoveTables import JUMP_TARGETS, STEP_TARGETS
+from OpeningBook import OpeningBook, build_opening_book, write_opening_book
+from ParallelTreeSearch import LeafParallelTreeSearch, RootParallelTreeSearch
+from SelfPlayFarm import SelfPlayFarm
+from SharedMonteCarloTable import SharedMonteCarloTable
+from Zobrist import hash_board, hash_flat_board
+from MathTooling import transform_dict_keys_base4_to_base72, transform_key_to_base72, clean_string
+from TrainningResultsConsolidator import JsonObjectStream, TrainningResultsConsolidator
+from StateKeys import canonical_state_key, decode_state, encode_canonical_states, encode_state, encode_states, legacy_state_key, mirror_state_key
 
 class TestCheckersGame(unittest.TestCase):
     def setUp(self):
@@ -449,5 +472,541 @@ class TestCheckersGame(unittest.TestCase):
         result = transform_dict_keys_base4_to_base72(input_dict)
         self.assertEqual(result, expected_output)
 
+    def test_bitboard_moves_match_board_scan(self):
+        """
+        The bitboard generator has to return the same paths, in the same order, as the original scan
+        on every position reached by random games.
+        """
+        rng = random.Random(7)
+        for _ in range(30):
+            board = self.game.initialize_board()
+            player = rng.choice([1, -1])
+            for _ in range(self.game.move_limit):
+                self.assertEqual(self.game.scan_valid_moves(board, player), generate_bitboard_moves(board, player))
+                self.assertTrue(np.array_equal(bitboards_to_board(*board_to_bitboards(board)), board))
+                valid_moves = generate_bitboard_moves(board, player)
+                if not valid_moves:
+                    break
+                board = self.game.update_score_and_board(rng.choice(valid_moves), player, board)
+                player = -player
+
+    def test_board_state_round_trip(self):
+        board = np.array([
+            [3, 2, 3, 1, 3, 0, 3, 0],
+            [-1, 3, -2, 3, 0, 3, 0, 3],
+            [3, 0, 3, 0, 3, 0, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, 0, 3, 0, 3, 0, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, 0, 3, 0, 3, 1, 3, -2],
+            [0, 3, 0, 3, 2, 3, -1, 3]
+        ])
+        state = BoardState.from_board(board, -1)
+        self.assertTrue(np.array_equal(state.to_board(), board))
+        self.assertEqual(state.player, -1)
+        self.assertEqual(state, BoardState.from_board(board.flatten(), -1))
+        self.assertEqual(hash(state), hash(BoardState.from_board(board.copy(), -1)))
+        self.assertNotEqual(state, BoardState.from_board(board, 1))
+        self.assertNotEqual(state, BoardState.from_board(self.game.initialize_board(), -1))
+
+    def test_zobrist_hash_is_updated_incrementally(self):
+        rng = random.Random(3)
+        for _ in range(10):
+            self.game.board = self.game.initialize_board()
+            player = 1
+            for _ in range(self.game.move_limit):
+                valid_moves = self.game.generate_valid_moves(self.game.board, player)
+                if not valid_moves:
+                    break
+                move = rng.choice(valid_moves)
+                candidate = self.game.simulate_play_on_board(self.game.board.copy(), move, player)
+                self.game.update_score_and_board(move, player)
+                self.assertEqual(self.game.zobrist_hash, hash_board(self.game.board))
+                flat_board_with_player = self.game.filter_and_flatten_board(candidate, player)
+                self.assertEqual(hash_flat_board(flat_board_with_player), hash_board(self.game.board, player))
+                player = -player
+
+    def test_state_key_encoder(self):
+        board = np.array([
+            [3, 2, 3, 1, 3, 0, 3, 0],
+            [-1, 3, -2, 3, 0, 3, 0, 3],
+            [3, 0, 3, 0, 3, 0, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, 0, 3, 0, 3, 0, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, 0, 3, 0, 3, 1, 3, -2],
+            [0, 3, 0, 3, 2, 3, -1, 3]
+        ])
+        flat = self.game.filter_and_flatten_board(board, 1)
+        rotated = board[::-1, ::-1]
+        mirrored_flat = self.game.filter_and_flatten_board(np.where(rotated == 3, 3, -rotated), -1)
+        key = encode_state(flat)
+        self.assertTrue(np.array_equal(decode_state(key), flat[0]))
+        self.assertEqual(mirror_state_key(key), encode_state(mirrored_flat))
+        self.assertEqual(mirror_state_key(mirror_state_key(key)), key)
+        self.assertEqual(encode_states(np.vstack([flat, mirrored_flat])), [key, mirror_state_key(key)])
+        legacy = clean_string(f"{flat}")
+        self.assertEqual(legacy_state_key(key), transform_key_to_base72(legacy))
+        self.assertEqual(legacy_state_key(mirror_state_key(key)), transform_key_to_base72(self.game.mirror_play(legacy)))
+
+    def test_monte_carlo_legacy_keys_are_migrated(self):
+        flat = self.game.filter_and_flatten_board(self.game.initialize_board(), -1)
+        legacy_mirror = transform_key_to_base72(self.game.mirror_play(clean_string(f"{flat}")))
+        self.game.legacy_monte_carlo_scoring = {legacy_mirror: 10}
+        self.game.update_reward_monte_carlo_score(flat, 20)
+        self.assertEqual(self.game.legacy_monte_carlo_scoring, {})
+        self.assertEqual(dict(self.game.monte_carlo_scoring.items()), {canonical_state_key(encode_state(flat)): 15})
+        self.assertEqual(self.game.inverted_branches_used, 1)
+
+    def test_nn_batch_prediction_matches_predict(self):
+        boards = np.random.default_rng(5).integers(-2, 3, size=(6, 33)).astype(np.float32)
+        expected = self.game.nn.predict(boards)[:, 0]
+        self.assertTrue(np.allclose(self.game.nn.predict_batch(boards), expected, atol=1e-5))
+
+        self.game.board = self.game.initialize_board()
+        valid_moves = self.game.generate_valid_moves(self.game.board, 1)
+        move, flat_board_with_player = self.game.have_nn_select_moves(valid_moves, 1)
+        self.assertIn(move, valid_moves)
+        played = self.game.simulate_play_on_board(self.game.board.copy(), move, 1)
+        self.assertTrue(np.array_equal(flat_board_with_player, self.game.filter_and_flatten_board(played, 1)))
+
+    def test_mc_select_moves_returns_the_board_of_the_chosen_move(self):
+        self.game.board = self.game.initialize_board()
+        valid_moves = self.game.generate_valid_moves(self.game.board, 1)
+        chosen = self.game.filter_and_flatten_board(self.game.simulate_play_on_board(self.game.board.copy(), valid_moves[0], 1), 1)
+        self.game.monte_carlo_scoring[self.game.monte_carlo_key(chosen)] = 50.0
+        move, flat_board_with_player = self.game.have_mc_select_moves(valid_moves, 1)
+        self.assertEqual(move, valid_moves[0])
+        self.assertTrue(np.array_equal(flat_board_with_player, chosen))
+
+    def test_numpy_engine_matches_tensorflow_model(self):
+        path = "model_saves/checkers_model.h5"
+        self.game.nn.load(path)
+        numpy_nn = CheckersNNNumpy(path)
+        boards = np.random.default_rng(9).integers(-2, 3, size=(16, 33)).astype(np.float32)
+        self.assertTrue(np.allclose(numpy_nn.predict_batch(boards), self.game.nn.predict_batch(boards), rtol=1e-4, atol=1e-3))
+        with self.assertRaises(FileNotFoundError):
+            CheckersNNNumpy(os.path.join(tempfile.mkdtemp(), 'missing.h5')).predict_batch(boards)
+
+    def test_self_play_farm_merges_worker_updates(self):
+        self.game.save_directory = tempfile.mkdtemp()
+        farm = SelfPlayFarm(self.game, workers=2, batch_size=50, shared_table=False)
+        farm.run(max_games=10)
+        self.assertGreaterEqual(self.game.total_games, 10)
+        self.assertEqual(self.game.player_1_win_count + self.game.player_2_win_count + self.game.tie_games, self.game.total_games)
+        self.assertGreater(len(self.game.monte_carlo_scoring), 0)
+
+    def test_shared_monte_carlo_table(self):
+        path = os.path.join(tempfile.mkdtemp(), 'table.bin')
+        table = SharedMonteCarloTable(path, capacity=64, stripes=4)
+        keys = [encode_state(self.game.filter_and_flatten_board(self.game.initialize_board(), 1)), 1 << 96, 5, (3 << 64) | 7]
+        for i, key in enumerate(keys):
+            table[key] = i + 0.5
+        del table[5]
+        table[1 << 96] = -2.0
+        self.assertEqual(len(table), 3)
+        self.assertNotIn(5, table)
+        self.assertEqual(dict(table.items()), {keys[0]: 0.5, 1 << 96: -2.0, (3 << 64) | 7: 3.5})
+        # another process maps the same file
+        attached = SharedMonteCarloTable(path)
+        self.assertEqual(attached[keys[0]], 0.5)
+        table.remove()
+
+    def test_self_play_farm_with_shared_table(self):
+        self.game.save_directory = tempfile.mkdtemp()
+        farm = SelfPlayFarm(self.game, workers=2, shared_table=True)
+        farm.run(max_games=10)
+        self.assertGreaterEqual(self.game.total_games, 10)
+        self.assertIsInstance(self.game.monte_carlo_scoring, MappedMonteCarloTable)
+        self.assertGreater(len(self.game.monte_carlo_scoring), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.game.save_directory, 'shared_monte_carlo.bin')))
+
+    def test_monte_carlo_table_binary_save_and_load(self):
+        self.game.save_directory = tempfile.mkdtemp()
+        self.game.total_games = 10
+        self.game.monte_carlo_scoring.update([(1 << 96, 2.5), (7, -1.0), (3, 0)])
+        self.game.save_status()
+        loaded = CheckersTraining()
+        loaded.save_directory = self.game.save_directory
+        loaded.load_status()
+        self.assertEqual(loaded.total_games, 10)
+        self.assertEqual(dict(loaded.monte_carlo_scoring.items()), {1 << 96: 2.5, 7: -1.0})
+        # updates on top of the mapped file, then saved again
+        loaded.monte_carlo_scoring[7] = 4.0
+        loaded.monte_carlo_scoring[9] = 1.0
+        del loaded.monte_carlo_scoring[1 << 96]
+        self.assertEqual(len(loaded.monte_carlo_scoring), 2)
+        loaded.save_status()
+        self.assertEqual(loaded.monte_carlo_scoring.changes, {})
+        self.assertEqual(dict(loaded.monte_carlo_scoring.items()), {7: 4.0, 9: 1.0})
+        extension = os.path.splitext(loaded.monte_carlo_file)[1]
+        self.assertEqual(len([name for name in os.listdir(self.game.save_directory) if name.endswith(extension)]), 2)
+
+    def test_monte_carlo_table_imports_json_states(self):
+        self.game.save_directory = tempfile.mkdtemp()
+        with open(os.path.join(self.game.save_directory, 'game_status.json'), 'w') as f:
+            json.dump({'total_games': 3, 'monte_carlo_scoring': {'R': 1}, 'monte_carlo_states': {'12': 0.5}}, f)
+        self.game.load_status()
+        self.assertEqual(dict(self.game.monte_carlo_scoring.items()), {12: 0.5})
+        self.assertEqual(self.game.legacy_monte_carlo_scoring, {'R': 1})
+
+    def test_monte_carlo_delta_log_recovers_after_crash(self):
+        self.game.save_directory = tempfile.mkdtemp()
+        self.game.load_status()
+        self.game.monte_carlo_scoring.update([(1 << 96, 2.5), (7, -1.0)])
+        self.game.save_status()
+        self.assertEqual(len(self.game.monte_carlo_logs), 1)
+        self.game.monte_carlo_scoring[7] = 4.0
+        self.game.monte_carlo_scoring[9] = 1.0
+        del self.game.monte_carlo_scoring[1 << 96]
+        self.assertEqual(self.game.monte_carlo_scoring.checkpoint(), 3)
+        self.game.monte_carlo_scoring[11] = 1.0  # not checkpointed, lost by the crash
+        log_path = os.path.join(self.game.save_directory, self.game.monte_carlo_logs[-1])
+        with open(log_path, 'ab') as f:
+            f.write(b'\x01\x02\x03')  # record cut by the crash
+        recovered = CheckersTraining()
+        recovered.save_directory = self.game.save_directory
+        recovered.load_status()
+        self.assertEqual(dict(recovered.monte_carlo_scoring.items()), {7: 4.0, 9: 1.0})
+        self.assertEqual(len(recovered.monte_carlo_scoring), 2)
+        # compaction folds the logs into a new table file
+        recovered.save_status()
+        self.assertEqual(recovered.monte_carlo_scoring.changes, {})
+        self.assertEqual(len(recovered.monte_carlo_logs), 1)
+
+    def test_memo_evicts_least_recently_used(self):
+        memo = Memo(capacity=2)
+        memo['a'] = 1
+        memo['b'] = 2
+        self.assertEqual(memo['a'], 1)  # b is now the least recently used
+        memo['c'] = 3
+        self.assertNotIn('b', memo)
+        self.assertIn('a', memo)
+        self.assertEqual(len(memo), 2)
+        self.assertEqual((memo.hits, memo.misses, memo.evictions), (1, 1, 1))
+        # the game memos keep working when bounded
+        self.game.valid_moves_memo = Memo(capacity=4)
+        self.game.transition_memo = Memo(capacity=4)
+        moves = self.game.generate_valid_moves(self.game.board, 1)
+        self.assertEqual(self.game.generate_valid_moves(self.game.board, 1), moves)
+        self.assertEqual(self.game.valid_moves_memo.hits, 1)
+
+    def test_move_tables(self):
+        # player 1 moves up, player -1 down, crowned chips both ways, nothing leaves the board
+        self.assertEqual(STEP_TARGETS[1][7][0], ((6, 1),))
+        self.assertEqual(STEP_TARGETS[-1][7][0], ())
+        self.assertEqual(STEP_TARGETS[2][4][3], ((3, 2), (3, 4), (5, 2), (5, 4)))
+        self.assertEqual(JUMP_TARGETS[1][6][3], (((5, 2), (4, 1)), ((5, 4), (4, 5))))
+        self.assertEqual(JUMP_TARGETS[-2][1][0], (((2, 1), (3, 2)),))
+        self.assertEqual(JUMP_TARGETS[-1][2][1], (((3, 2), (4, 3)),))
+
+    def test_capture_search_leaves_board_unchanged(self):
+        board = np.array([
+            [3, 0, 3, 0, 3, 0, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, 0, 3, -1, 3, -1, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, 0, 3, -1, 3, 0, 3, 0],
+            [0, 3, 0, 3, 0, 3, 0, 3],
+            [3, -1, 3, 0, 3, 0, 3, 0],
+            [2, 3, 0, 3, 0, 3, 0, 3]
+        ])
+        original = board.copy()
+        capturing_moves = []
+        self.game.find_all_capturing_moves(board, 7, 0, 1, capturing_moves)
+        self.assertTrue(np.array_equal(board, original))
+        self.assertEqual(capturing_moves, [
+            [(7, 0, 5, 2), (5, 2, 3, 4), (3, 4, 1, 2)],
+            [(7, 0, 5, 2), (5, 2, 3, 4), (3, 4, 1, 6)],
+        ])
+        self.assertEqual(capturing_moves, generate_bitboard_moves(board, 1))
+
+    def test_batch_moves_match_single_board(self):
+        rng = random.Random(11)
+        boards, players = [], []
+        for _ in range(20):
+            board = self.game.initialize_board()
+            player = rng.choice([1, -1])
+            for _ in range(self.game.move_limit):
+                boards.append(board.copy())
+                players.append(player)
+                valid_moves = generate_bitboard_moves(board, player)
+                if not valid_moves:
+                    break
+                board = self.game.update_score_and_board(rng.choice(valid_moves), player, board)
+                player = -player
+        boards, players = np.array(boards), np.array(players)
+        offsets, moves = self.game.generate_valid_moves_batch(boards, players)
+        self.assertEqual(len(offsets), len(boards) + 1)
+        for i, (board, player) in enumerate(zip(boards, players)):
+            self.assertEqual(moves[offsets[i]:offsets[i + 1]], generate_bitboard_moves(board, player))
+        # only the 32 playable tiles
+        flat_offsets, flat_moves = self.game.generate_valid_moves_batch(boards.reshape(len(boards), 64)[:, PLAYABLE_INDICES], players)
+        self.assertTrue(np.array_equal(flat_offsets, offsets))
+        self.assertEqual(flat_moves, moves)
+
+    def test_apply_moves_batch_matches_update_score_and_board(self):
+        rng = random.Random(5)
+        boards, moves, players, expected = [], [], [], []
+        for _ in range(10):
+            board = self.game.initialize_board()
+            player = rng.choice([1, -1])
+            for _ in range(self.game.move_limit):
+                valid_moves = generate_bitboard_moves(board, player)
+                if not valid_moves:
+                    break
+                move = rng.choice(valid_moves)
+                boards.append(board)
+                moves.append(move)
+                players.append(player)
+                board = self.game.update_score_and_board(move, player, board.copy())
+                expected.append(board)
+                player = -player
+        self.assertTrue(np.array_equal(apply_moves_batch(np.array(boards), moves, np.array(players)), np.array(expected)))
+
+    def test_lockstep_self_play(self):
+        self.game.save_directory = tempfile.mkdtemp()
+        LockstepSelfPlay(self.game, games=8).run(max_games=20)
+        self.assertEqual(self.game.total_games, 20)
+        self.assertEqual(self.game.player_1_win_count + self.game.player_2_win_count + self.game.tie_games, 20)
+        self.assertGreater(len(self.game.monte_carlo_scoring), 0)
+
+    def test_alpha_beta_avoids_losing_a_chip(self):
+        board = self.game.blank_board.copy()
+        board[board != 3] = 0
+        board[5, 2] = 1
+        board[3, 4] = -1  # captures a chip moved to (4, 3)
+        search = AlphaBetaSearch(time_budget=1, max_depth=4)
+        move = search.search(*board_to_bitboards(board), 1, 60)
+        self.assertEqual(move, [(5, 2, 4, 1)])
+        self.assertEqual(search.completed_depth, 4)
+        self.assertEqual(play_path_on_bitboards(*board_to_bitboards(board), move, 1),
+                         board_to_bitboards(self.game.update_score_and_board(move, 1, board.copy())))
+
+    def test_alpha_beta_respects_time_budget(self):
+        search = AlphaBetaSearch(time_budget=0.02, max_depth=50)
+        start = time.perf_counter()
+        move = search.search(*board_to_bitboards(self.game.board), 1, 60)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertIn(move, self.game.generate_valid_moves(self.game.board, 1))
+
+    def test_alpha_beta_table_depends_on_the_moves_left(self):
+        board = self.game.board.copy()
+        board[2, 1] = 0  # player 1 is a chip ahead, a win when the move limit is reached
+        position = board_to_bitboards(board)
+        search = AlphaBetaSearch(time_budget=60, max_depth=4)
+        self.assertGreaterEqual(search.negamax(*position, 1, 4, -math.inf, math.inf, 0, 2), WIN_THRESHOLD)
+        score = search.negamax(*position, 1, 4, -math.inf, math.inf, 0, 30)
+        self.assertEqual(score, AlphaBetaSearch(time_budget=60, max_depth=4).negamax(*position, 1, 4, -math.inf, math.inf, 0, 30))
+        self.assertLess(score, WIN_THRESHOLD)
+        # a win stored at ply 1 is read back as a win one ply closer at the root
+        child = play_path_on_bitboards(*position, search.search(*position, 1, 2), 1)
+        search.negamax(*child, -1, 3, -math.inf, math.inf, 1, 1)
+        self.assertEqual(search.negamax(*child, -1, 3, -math.inf, math.inf, 0, 1),
+                         AlphaBetaSearch(time_budget=60, max_depth=4).negamax(*child, -1, 3, -math.inf, math.inf, 0, 1))
+
+    def test_mcts_reuses_the_subtree_and_stays_in_its_pool(self):
+        random.seed(3)
+        search = MonteCarloTreeSearch(rollouts=200, time_budget=0, pool_size=300)
+        position = board_to_bitboards(self.game.board)
+        move = search.search(*position, 1, 60)
+        self.assertIn(move, self.game.generate_valid_moves(self.game.board, 1))
+        self.assertLessEqual(search.pool.used, 300)
+        self.assertEqual(search.pool.visits[search.root], 200)
+        position = play_path_on_bitboards(*position, move, 1)
+        reply = generate_bitboard_moves(bitboards_to_board(*position), -1)[0]
+        position = play_path_on_bitboards(*position, reply, -1)
+        search.search(*position, 1, 58)
+        self.assertGreater(search.reused_visits, 0)
+        self.assertEqual(search.pool.visits[search.root], 200 + search.reused_visits)
+
+    def test_parallel_mcts_adds_the_visits_of_every_worker(self):
+        position = board_to_bitboards(self.game.board)
+        valid_moves = self.game.generate_valid_moves(self.game.board, 1)
+        root_parallel = RootParallelTreeSearch(2, rollouts=50, time_budget=0, pool_size=300)
+        leaf_parallel = LeafParallelTreeSearch(2, rollouts=50, time_budget=0, pool_size=300)
+        try:
+            self.assertIn(root_parallel.search(*position, 1, 60), valid_moves)
+            self.assertEqual(root_parallel.visits.sum(), 100)
+            self.assertIn(leaf_parallel.search(*position, 1, 60), valid_moves)
+            self.assertEqual(leaf_parallel.root_visits().sum(), 50)
+            self.assertEqual(leaf_parallel.pool.visits[leaf_parallel.root], 50)
+        finally:
+            root_parallel.close()
+            leaf_parallel.close()
+
+    def test_opening_book_keeps_the_best_known_move(self):
+        board = self.game.initialize_board()
+        moves = self.game.generate_valid_moves(board, 1)
+        for index, move in enumerate(moves):
+            flat_board = self.game.filter_and_flatten_board(self.game.simulate_play_on_board(board.copy(), move, 1), 1)
+            self.game.monte_carlo_scoring[encode_state(flat_board)] = 5 if index == 2 else -5
+        book = build_opening_book(self.game, plies=2)
+        self.assertEqual(book[position_key(*board_to_bitboards(board), 1)], (2, 5))
+        self.assertEqual(len(book), 2)  # the moves of player -1 starting are the mirrors, the replies are unknown
+        path = os.path.join(tempfile.mkdtemp(), 'opening_book.bin')
+        write_opening_book(path, book)
+        opening_book = OpeningBook(path)
+        self.assertEqual(opening_book.find_move(*board_to_bitboards(board), 1, moves), moves[2])
+        self.assertIsNone(opening_book.find_move(*board_to_bitboards(board), 1, moves[:2]))
+
+    def test_endgame_tablebase_solves_a_capture(self):
+        path = os.path.join(tempfile.mkdtemp(), 'endgame_tablebase.bin')
+        write_tablebase(path, *build_tablebase(pieces=2), 2)
+        tablebase = EndgameTablebase(path)
+        player1, player2 = 1 << 21, 1 << 17  # men on (5, 2) and (4, 3), the square behind both is empty
+        self.assertEqual(tablebase.probe(player1, player2, 0, 1), (1, 1))  # tied scores, the capture wins
+        self.assertFalse(tablebase.decided(player1, player2, 0, 1))
+        self.assertEqual(tablebase.best_move(player1, player2, 0, 1, 10, [[(5, 2, 4, 1)], [(5, 2, 3, 4)]]), [(5, 2, 3, 4)])
+        self.assertIsNone(tablebase.best_move(player1, player2, 0, 1, 0, [[(5, 2, 3, 4)]]))
+        self.assertTrue(tablebase.decided(1 << 14, 0, 0, -1))
+        self.assertIsNone(tablebase.probe(player1 | 1, player2, 0, 1))
+        self.assertIsNone(EndgameTablebase().probe(player1, player2, 0, 1))
+
+    def test_endgame_tablebase_moves_keep_the_result_with_the_plies_left(self):
+        path = os.path.join(tempfile.mkdtemp(), 'endgame_tablebase.bin')
+        write_tablebase(path, *build_tablebase(pieces=3), 3)
+        tablebase = EndgameTablebase(path)
+        position = (33554432, 16781312, 33554432, -1)
+        self.assertEqual(tablebase.probe(*position), (1, 1))  # a win with one ply left
+        valid_moves = generate_bitboard_moves(bitboards_to_board(*position[:3]), -1)
+        self.assertEqual(tablebase.best_move(*position, 1, valid_moves), [(6, 1, 7, 0)])
+
+    def test_monte_carlo_table_migrates_to_canonical_keys(self):
+        flat = self.game.filter_and_flatten_board(self.game.initialize_board(), -1)
+        state = encode_state(flat)
+        other = encode_state(self.game.filter_and_flatten_board(self.game.initialize_board(), 1)) | 1
+        table = MappedMonteCarloTable()
+        table.update([(state, 10.0), (mirror_state_key(state), 20.0), (mirror_state_key(other), 4.0)])
+        self.assertEqual(table.canonicalize(os.path.join(tempfile.mkdtemp(), 'table.bin')), 1)
+        self.assertEqual(dict(table.items()), {canonical_state_key(state): 15.0, canonical_state_key(other): 4.0})
+        self.assertEqual(self.game.monte_carlo_key(flat), canonical_state_key(state))
+        self.assertEqual(encode_canonical_states(np.vstack([flat, flat])), [canonical_state_key(state)] * 2)
+
+    def test_monte_carlo_running_mean_keeps_the_visits(self):
+        flat = self.game.filter_and_flatten_board(self.game.initialize_board(), 1)
+        for reward in (10, 20, 60):
+            self.game.update_reward_monte_carlo_score(flat, reward)
+        table = self.game.monte_carlo_scoring
+        key = self.game.monte_carlo_key(flat)
+        self.assertEqual((table[key], table.visits(key)), (30.0, 3))
+        directory = tempfile.mkdtemp()
+        table.start_log(os.path.join(directory, 'changes.log'))
+        table.add_reward(key, -30)
+        table.checkpoint()
+        table.save(os.path.join(directory, 'table.bin'))
+        self.assertEqual(MappedMonteCarloTable(os.path.join(directory, 'table.bin')).stats(key), (15.0, 4))
+        recovered = MappedMonteCarloTable()
+        recovered.replay_log(os.path.join(directory, 'changes.log'))
+        self.assertEqual(recovered.stats(key), (15.0, 4))
+        shared = SharedMonteCarloTable.from_dict(os.path.join(directory, 'shared.bin'), table, capacity=64, stripes=4)
+        shared.add_reward(key, 35)
+        self.assertEqual((shared[key], shared.visits(key)), (19.0, 5))
+        shared.remove()
+
+    def test_monte_carlo_table_spills_to_runs(self):
+        directory = tempfile.mkdtemp()
+        table = MappedMonteCarloTable(hot_entries=4, spill_directory=directory)
+        for key in range(1, 41):
+            table[key << 40] = float(key)
+        table.add_reward(1 << 40, 3.0)
+        del table[2 << 40]
+        self.assertLessEqual(len(table.changes), 4)
+        self.assertTrue(table.runs)
+        self.assertEqual((table.stats(1 << 40), table.get(2 << 40), table[40 << 40]), ((2.0, 2), None, 40.0))
+        self.assertEqual(len(table), 39)
+        table.save(os.path.join(directory, 'table.bin'))
+        self.assertEqual(os.listdir(directory), ['table.bin'])
+        saved = MappedMonteCarloTable(os.path.join(directory, 'table.bin'))
+        self.assertEqual(dict(saved.items()), {key << 40: float(key) for key in range(3, 41)} | {1 << 40: 2.0})
+        self.assertIsNotNone(saved.bases[0][3])
+        self.assertNotIn(41 << 40, saved)
+        # entries of a mapped base overridden or deleted, then spilled
+        table = MappedMonteCarloTable(os.path.join(directory, 'table.bin'), hot_entries=2, spill_directory=directory)
+        table[3 << 40] = -1.0
+        del table[4 << 40]
+        for key in range(50, 56):
+            table[key << 40] = 1.0
+        self.assertNotIn(3 << 40, table.changes)
+        self.assertEqual((table[3 << 40], table.visits(3 << 40)), (-1.0, 1))
+        self.assertNotIn(4 << 40, table)
+        self.assertEqual(len(table), 39 + 6 - 1)
+        bloom = build_bloom_filter(keys_to_bytes(range(1000)))
+        self.assertTrue(all(bloom_may_contain(bloom, key) for key in range(1000)))
+        self.assertLess(sum(bloom_may_contain(bloom, key) for key in range(1000, 11000)), 500)
+
+    def test_monte_carlo_table_saves_verified_shards(self):
+        directory = tempfile.mkdtemp()
+        table = MappedMonteCarloTable(spill_directory=directory, shards=4, workers=2)
+        table.update((key << 64 | key, float(key)) for key in range(1, 101))
+        path = os.path.join(directory, 'table.manifest')
+        table.save(path, total_games=12)
+        manifest = read_manifest(path)
+        self.assertEqual((manifest['total_games'], sum(shard['entries'] for shard in manifest['shards'])), (12, 100))
+        self.assertEqual(len(table_files(path)), 4)
+        self.assertEqual(verify_manifest(path), [])
+        # resharded on the next save, the changes and the old shards are merged
+        del table[1 << 64 | 1]
+        table[7 << 64 | 7] = 0.5
+        table.shards = 2
+        table.save(os.path.join(directory, 'table2.manifest'))
+        loaded = MappedMonteCarloTable(os.path.join(directory, 'table2.manifest'), verify=True)
+        self.assertEqual((len(loaded), loaded[7 << 64 | 7], loaded.get(1 << 64 | 1), loaded[100 << 64 | 100]), (99, 0.5, None, 100.0))
+        with open(table_files(path)[2], 'r+b') as f:
+            f.seek(80)
+            f.write(b'corrupted')
+        self.assertEqual(verify_manifest(path), [table_files(path)[2]])
+        with self.assertRaises(ValueError):
+            MappedMonteCarloTable(path, verify=True)
+
+    def test_consolidator_merges_results_with_spilled_runs(self):
+        directory = tempfile.mkdtemp()
+        flat = self.game.filter_and_flatten_board(self.game.initialize_board(), 1)
+        state = self.game.monte_carlo_key(flat)
+        with open(os.path.join(directory, 'old.json'), 'w') as f:
+            json.dump({'total_games': 3, 'monte_carlo_scoring': {'R': 1},
+                       'monte_carlo_states': {str(key): float(key) for key in range(1, 30)}}, f)
+        self.game.save_directory = directory
+        self.game.total_games = 5
+        self.game.monte_carlo_scoring.update_stats([(1, 10.0, 3), (state, 2.0, 2)])
+        self.game.save_game_results()
+        table = MappedMonteCarloTable()
+        table.update_stats([(mirror_state_key(state), 5.0, 1), (40, 4.0, 2)])
+        table.save(os.path.join(directory, 'table.bin'))
+        names = sorted(os.listdir(directory))
+        consolidator = TrainningResultsConsolidator(merge_entries=4, spill_directory=directory, chunk_size=16)
+        for name in names:
+            consolidator.add_file(os.path.join(directory, name))
+        self.assertGreater(len(consolidator.runs), 4)
+        self.assertEqual(consolidator.merge(os.path.join(directory, 'merged.bin')), 31)
+        merged = MappedMonteCarloTable(os.path.join(directory, 'merged.bin'))
+        self.assertEqual((merged.stats(1), merged.stats(state), merged.stats(40), merged.stats(29)),
+                         ((7.75, 4), (3.0, 3), (4.0, 2), (29.0, 1)))
+        self.assertEqual(consolidator.totals['games'], 8)
+        self.assertFalse(os.path.exists(consolidator.run_directory))
+
+    def test_consolidator_skips_large_members_without_decoding_them(self):
+        path = os.path.join(tempfile.mkdtemp(), 'legacy.json')
+        legacy = {f'R{i}"}}]{{\\': [i, {'nested': [1.5, None, True]}] for i in range(20000)}
+        with open(path, 'w') as f:
+            json.dump({'monte_carlo_scoring': legacy, 'name': 'a\\"b', 'count': -1.5e-3, 'total_games': 7,
+                       'monte_carlo_states': {'5': 0.5}}, f)
+        with open(path, 'r') as f:
+            stream = JsonObjectStream(f, chunk_size=64)
+            read = dict()
+            for name in stream.members():
+                if name == 'total_games':
+                    read[name] = stream.value()
+                else:
+                    stream.skip_value()
+                    self.assertLess(len(stream.buffer), 64 * 2)
+        self.assertEqual(read, {'total_games': 7})
+        consolidator = TrainningResultsConsolidator(merge_entries=4, chunk_size=4096)
+        start = time.perf_counter()
+        consolidator.add_file(path)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual((consolidator.totals['games'], consolidator.totals['states']), (7, 1))
+        consolidator.merge(os.path.join(os.path.dirname(path), 'merged.bin'))
+
 if __name__ == "__main__":
     unittest.main()